@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Throughput comparison of the two ways of streaming a file through the MDML:
+
+  base64 - chunk_file + kafka_mdml_producer (JSON schema serialization)
+  binary - kafka_mdml_producer_schemaless.produce_file (raw bytes + headers)
+
+With -s HOST the full produce -> consume_chunks round trip is timed against
+a running broker and schema registry. With --mock only the produce side is
+timed, using the local stand-ins in tests/standins.py, so no services are needed.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+def make_file(size_mb):
+    f = tempfile.NamedTemporaryFile(suffix='.bin', delete=False)
+    f.write(os.urandom(size_mb * 1024 * 1024))
+    f.close()
+    return f.name
+
+def run_base64(args, mdml, fn):
+    producer = mdml.kafka_mdml_producer(f"{args.topic}-base64", schema=mdml.multipart_schema,
+        add_time=False, kafka_host=args.host, kafka_port=args.port,
+        schema_host=args.schemaHost, schema_port=args.schemaPort)
+    wire_bytes = 0
+    start = time.perf_counter()
+    for part in mdml.chunk_file(fn, args.chunk_size, file_id="bench-base64.bin"):
+        wire_bytes += len(json.dumps(part)) + 5 # schema registry framing
+        while True:
+            try:
+                producer.produce(part)
+                break
+            except BufferError:
+                producer.producer.poll(1)
+    producer.flush()
+    return time.perf_counter() - start, wire_bytes
+
+def run_binary(args, mdml, fn):
+    producer = mdml.kafka_mdml_producer_schemaless(f"{args.topic}-binary",
+        kafka_host=args.host, kafka_port=args.port)
+    wire_bytes = 0
+    for chunk, headers in mdml.chunk_file_binary(fn, args.chunk_size, "bench-binary.bin"):
+        wire_bytes += len(chunk) + sum(len(k) + len(v) for k, v in headers)
+    start = time.perf_counter()
+    producer.produce_file(fn, args.chunk_size, file_id="bench-binary.bin")
+    producer.flush()
+    return time.perf_counter() - start, wire_bytes
+
+def run_consume(args, mdml, mode):
+    consumer = mdml.kafka_mdml_consumer([f"{args.topic}-{mode}"], f"chunk-benchmark-{time.time()}",
+        kafka_host=args.host, kafka_port=args.port,
+        schema_host=args.schemaHost, schema_port=args.schemaPort)
+    save_dir = tempfile.mkdtemp()
+    start = time.perf_counter()
+    for _ in consumer.consume_chunks(overall_timeout=30, save_dir=save_dir, verbose=False):
+        break
+    elapsed = time.perf_counter() - start
+    consumer.close()
+    return elapsed
+
+def main(args):
+    # Benchmark the working tree rather than an installed package
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path[:0] = [os.path.join(root, 'tests'), root]
+    import mdml_client as mdml
+    if args.mock:
+        from standins import mock_kafka, schema_registry
+        # kafka must stay referenced for the mock cluster to stay up
+        kafka, servers = mock_kafka()
+        args.host, args.port = servers.split(':')
+        registry, args.schemaHost, args.schemaPort = schema_registry()
+    fn = make_file(args.size)
+    try:
+        results = {}
+        for mode, run in (('base64', run_base64), ('binary', run_binary)):
+            elapsed, wire_bytes = run(args, mdml, fn)
+            results[mode] = {
+                'produce_s': elapsed,
+                'produce_MBps': args.size / elapsed,
+                'wire_MB': wire_bytes / 1024 / 1024
+            }
+            if not args.mock:
+                elapsed = run_consume(args, mdml, mode)
+                results[mode]['consume_s'] = elapsed
+                results[mode]['consume_MBps'] = args.size / elapsed
+    finally:
+        os.remove(fn)
+        if args.mock:
+            registry.shutdown()
+    print(f"File size: {args.size} MB, chunk size: {args.chunk_size} bytes")
+    for mode, res in results.items():
+        print(f"{mode:>7}: " + ", ".join(f"{k}={v:.2f}" for k, v in res.items()))
+    print(f"binary/base64 produce speedup: {results['base64']['produce_s'] / results['binary']['produce_s']:.2f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare base64 and binary chunked file transfer")
+    parser.add_argument('-t', dest="topic", default="mdml-benchmark-chunks",
+                        help="Topic prefix to produce to [default: mdml-benchmark-chunks]")
+    parser.add_argument('-s', dest="host", default=None,
+                        help="Hostname of the kafka broker")
+    parser.add_argument('-port', dest="port", default=9092,
+                        help="Kafka broker port number [default: 9092]")
+    parser.add_argument('--schema-host', dest="schemaHost", default=None,
+                        help="Schema registry host [defaults to the -s HOST argument]")
+    parser.add_argument('--schema-port', dest="schemaPort", default=8081,
+                        help="Schema registry port [default: 8081]")
+    parser.add_argument('--mock', dest="mock", action='store_true',
+                        help="Use librdkafka's mock cluster and a local schema registry stand-in")
+    parser.add_argument('--size', dest="size", type=int, default=64,
+                        help="Size of the test file in MB [default: 64]")
+    parser.add_argument('--chunk-size', dest="chunk_size", type=int, default=500000,
+                        help="Chunk size in bytes [default: 500000]")
+    args = parser.parse_args()
+    if args.host is None and not args.mock:
+        parser.error("either -s HOST or --mock is required")
+    if args.schemaHost is None:
+        args.schemaHost = args.host
+    main(args)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Bytes on the wire versus CPU time for each compression codec:
+
+  kafka  - Kafka batch compression ('compression.type') of JSON sensor
+           records. Wire bytes are the bytes librdkafka sent to the
+           brokers, taken from its statistics
+  chunk  - per-chunk payload compression of a text log (chunk_file)
+  export - compressed experiment exports (upload_experiment_to_ADC)
+
+CPU is the process CPU time (including librdkafka's threads) spent
+producing, compressing or writing. Codecs that need a package that is
+not installed are skipped. With --mock the kafka runs use librdkafka's
+mock cluster, so no services are needed.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+def make_records(n):
+    rng = random.Random(0)
+    return [{
+        'time': 1700000000 + i * 0.01,
+        'sensor': f"thermocouple-{i % 16}",
+        'location': "reactor bay 2, north wall",
+        'temperature': round(20 + rng.random() * 5, 3),
+        'pressure': round(101.3 + rng.random(), 3),
+        'status': "nominal",
+    } for i in range(n)]
+
+def make_log(size_mb):
+    rng = random.Random(0)
+    f = tempfile.NamedTemporaryFile(mode='w', suffix='.log', delete=False)
+    written = 0
+    i = 0
+    while written < size_mb * 1024 * 1024:
+        line = f"2024-05-01T12:{i // 6000 % 60:02d}:{i // 100 % 60:02d}.{i % 100:02d} INFO furnace " \
+               f"setpoint={rng.randrange(400, 900)} measured={rng.random() * 900:.2f} valve=open\n"
+        f.write(line)
+        written += len(line)
+        i += 1
+    f.close()
+    return f.name
+
+def run_kafka(args, codec, values):
+    from confluent_kafka import Producer
+    stats = {}
+    def on_stats(raw):
+        stats.update(json.loads(raw))
+    producer = Producer({
+        'bootstrap.servers': f"{args.host}:{args.port}",
+        'compression.type': codec,
+        'linger.ms': 20,
+        'statistics.interval.ms': 100,
+        'stats_cb': on_stats
+    })
+    topic = f"{args.topic}-{codec}"
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for value in values:
+        while True:
+            try:
+                producer.produce(topic, value)
+                break
+            except BufferError:
+                producer.poll(0.1)
+    producer.flush()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    # Wait for statistics that include the last requests
+    time.sleep(0.3)
+    producer.poll(0)
+    wire = sum(b['txbytes'] for b in stats.get('brokers', {}).values() if b.get('nodeid', -1) >= 0)
+    return elapsed, cpu, wire
+
+def run_chunks(args, mdml, codec, fn):
+    cpu = time.process_time()
+    wire = 0
+    for part in mdml.chunk_file(fn, args.chunk_size, compression=codec):
+        wire += len(json.dumps(part))
+    return cpu, time.process_time() - cpu, wire
+
+def run_export(args, codec, lines):
+    from mdml_client.export import open_export, write_export, export_suffix
+    fn = os.path.join(tempfile.gettempdir(), f"mdml-bench-export{export_suffix('ndjson', codec)}")
+    cpu = time.process_time()
+    with open_export(fn, codec) as f:
+        write_export(iter(lines), f, "ndjson")
+    cpu = time.process_time() - cpu
+    size = os.path.getsize(fn)
+    os.remove(fn)
+    return cpu, size
+
+def report(section, rows):
+    base = rows[0][1]
+    print(section)
+    for codec, wire, cpu in rows:
+        print(f"  {codec:>6}: {wire / 1024 / 1024:8.2f} MB ({base / wire:5.1f}x smaller), cpu {cpu:6.2f} s")
+
+def main(args):
+    # Benchmark the working tree rather than an installed package
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path[:0] = [os.path.join(root, 'tests'), root]
+    import mdml_client as mdml
+    if args.mock:
+        from standins import mock_kafka
+        # kafka must stay referenced for the mock cluster to stay up
+        kafka, servers = mock_kafka()
+        args.host, args.port = servers.split(':')
+    records = make_records(args.records)
+    values = [json.dumps(r).encode('utf-8') for r in records]
+    results = {'kafka': [], 'chunk': [], 'export': []}
+    if args.host is not None:
+        for codec in mdml.kafka_codecs:
+            _, cpu, wire = run_kafka(args, codec, values)
+            results['kafka'].append((codec, wire, cpu))
+        report(f"kafka batch compression, {args.records} records", results['kafka'])
+    fn = make_log(args.size)
+    try:
+        for codec in (None,) + mdml.chunk_codecs:
+            try:
+                _, cpu, wire = run_chunks(args, mdml, codec, fn)
+            except Exception as e:
+                print(f"skipping chunk codec {codec}: {e}")
+                continue
+            results['chunk'].append((codec or "none", wire, cpu))
+    finally:
+        os.remove(fn)
+    report(f"chunk payload compression, {args.size} MB text log", results['chunk'])
+    lines = [json.dumps({'topic': "mdml-bench", 'value': r, 'time': r['time']}) for r in records]
+    for codec in (None,) + mdml.export_codecs:
+        try:
+            cpu, size = run_export(args, codec, lines)
+        except Exception as e:
+            print(f"skipping export codec {codec}: {e}")
+            continue
+        results['export'].append((codec or "none", size, cpu))
+    report(f"export compression, {args.records} records", results['export'])
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({section: [{'codec': c, 'bytes': w, 'cpu_s': cpu} for c, w, cpu in rows]
+                for section, rows in results.items()}, f, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare compression codecs by bytes on the wire and CPU time")
+    parser.add_argument('-t', dest="topic", default="mdml-benchmark-compression",
+                        help="Topic prefix to produce to [default: mdml-benchmark-compression]")
+    parser.add_argument('-s', dest="host", default=None,
+                        help="Hostname of the kafka broker. Without -s or --mock only the chunk and export codecs are compared")
+    parser.add_argument('-port', dest="port", default=9092,
+                        help="Kafka broker port number [default: 9092]")
+    parser.add_argument('--mock', dest="mock", action='store_true',
+                        help="Use librdkafka's mock cluster")
+    parser.add_argument('--records', dest="records", type=int, default=200000,
+                        help="Number of JSON records [default: 200000]")
+    parser.add_argument('--size', dest="size", type=int, default=32,
+                        help="Size of the text log in MB [default: 32]")
+    parser.add_argument('--chunk-size', dest="chunk_size", type=int, default=500000,
+                        help="Chunk size in bytes [default: 500000]")
+    parser.add_argument('--json', dest="json", default=None,
+                        help="Write the results to this file as JSON")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Startup cost of 'import mdml_client'. Each import runs in a fresh
+interpreter and the median wall time of several runs is reported for:
+
+  mdml_client - the package as it is imported by a producer script
+  eager       - the package plus the dependencies it used to import
+                eagerly (boto3, requests and the schema registry client)
+
+The modules with heavy dependencies that end up loaded are listed, so
+a regression that imports them eagerly again is easy to spot.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ['boto3', 'botocore', 'requests', 'confluent_kafka.schema_registry', 'jsonschema', 'numpy']
+
+TIMER = """
+import json, sys, time
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+CASES = {
+    'mdml_client': "import mdml_client",
+    'eager': "import boto3, requests, confluent_kafka.schema_registry.json_schema, mdml_client",
+}
+
+def time_import(imports, repeat):
+    code = TIMER.format(imports=imports, heavy=HEAVY_MODULES)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    runs = []
+    for _ in range(repeat + 1):
+        out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+            capture_output=True, text=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    runs = runs[1:] # the first run also compiles bytecode
+    return statistics.median(r['seconds'] for r in runs), runs[-1]['loaded']
+
+def main(args):
+    results = {}
+    for case, imports in CASES.items():
+        seconds, loaded = time_import(imports, args.repeat)
+        results[case] = seconds
+        print(f"{case:>11}: {seconds*1000:.1f} ms, heavy modules loaded: {', '.join(loaded) or 'none'}")
+    print(f"speedup: {results['eager'] / results['mdml_client']:.1f}x")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the time taken by 'import mdml_client'")
+    parser.add_argument('--repeat', dest="repeat", type=int, default=5,
+                        help="number of timed imports per case")
+    args = parser.parse_args()
+    main(args)
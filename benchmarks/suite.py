@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""
+Offline benchmark suite. Every case runs against the local stand-ins in
+tests/standins.py (librdkafka's mock cluster, the schema registry and the S3
+service), so no MDML instance is needed and runs on the same machine can
+be compared. Each case reports a throughput and latency percentiles:
+
+  produce       - kafka_mdml_producer.produce of JSON records. Latency
+                  is from produce() to the delivery report
+  consume       - kafka_mdml_consumer.consume loop over records produced
+                  beforehand. Latency is the time taken to yield each
+                  message (the consumer group join is not timed)
+  chunks        - chunk_file + produce, then consume_chunks, per file.
+                  Latency is the full round trip of one file
+  create_schema - create_schema on a nested record
+  s3            - kafka_mdml_s3_client upload (with notification) and
+                  ranged download of each object
+  metrics       - serialization of records by kafka_mdml_producer with
+                  and without the per-topic metrics (topic_metrics).
+                  Reports both throughputs and the cost per message
+
+Results can be saved as a JSON baseline (--save) and compared with an
+earlier baseline (--compare). A case is flagged as a regression when its
+throughput drops or its p99 latency grows by more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+def percentiles(samples):
+    """
+    Summary of latency samples in seconds as milliseconds
+    """
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    def pct(p):
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000
+    return {
+        'p50_ms': pct(50),
+        'p90_ms': pct(90),
+        'p99_ms': pct(99),
+        'max_ms': samples[-1] * 1000
+    }
+
+def make_record(i):
+    return {
+        'time': time.time(),
+        'sensor': f"thermocouple-{i % 16}",
+        'temperature': 20 + (i % 500) / 100,
+        'pressure': 101.3,
+        'status': "nominal"
+    }
+
+record_schema = {
+    "$schema": "http://merf.egs.anl.gov/mdml-benchmark-schema#",
+    "title": "BenchmarkRecord",
+    "description": "Benchmark sensor record",
+    "type": "object",
+    "properties": {
+        "time": {"type": "number"},
+        "sensor": {"type": "string"},
+        "temperature": {"type": "number"},
+        "pressure": {"type": "number"},
+        "status": {"type": "string"}
+    },
+    "required": ["time", "sensor", "temperature"]
+}
+
+def bench_produce(env, args, mdml):
+    producer = mdml.kafka_mdml_producer(f"mdml-bench-produce-{env['run']}", schema=record_schema,
+        **env['kafka'], **env['registry'])
+    latencies = []
+    def on_delivery(sent, err, msg):
+        latencies.append(time.perf_counter() - sent)
+    start = time.perf_counter()
+    for i in range(args.messages):
+        while True:
+            try:
+                sent = time.perf_counter()
+                producer.produce(make_record(i), on_delivery=lambda err, msg, sent=sent: on_delivery(sent, err, msg))
+                break
+            except BufferError:
+                producer.poll(0.05)
+        if i % 1000 == 0:
+            producer.poll(0)
+    producer.flush()
+    elapsed = time.perf_counter() - start
+    producer.close()
+    return dict(msgs_per_s=args.messages / elapsed, **percentiles(latencies))
+
+def bench_consume(env, args, mdml):
+    topic = f"mdml-bench-consume-{env['run']}"
+    producer = mdml.kafka_mdml_producer(topic, schema=record_schema, **env['kafka'], **env['registry'])
+    producer.produce_batch((make_record(i) for i in range(args.messages)), flush=True)
+    producer.close()
+    consumer = mdml.kafka_mdml_consumer([topic], f"bench-{uuid.uuid4()}", provision_topics=False,
+        **env['kafka'], **env['registry'])
+    latencies = []
+    count = 0
+    start = None
+    last = None
+    for _ in consumer.consume(overall_timeout=args.timeout, verbose=False):
+        now = time.perf_counter()
+        if start is None:
+            start = now # the group has joined
+        else:
+            latencies.append(now - last)
+        last = now
+        count += 1
+        if count == args.messages:
+            break
+    consumer.close()
+    if count < args.messages:
+        raise Exception(f"Error, only {count} of {args.messages} messages were consumed.")
+    return dict(msgs_per_s=(count - 1) / (last - start), **percentiles(latencies))
+
+def bench_chunks(env, args, mdml):
+    topic = f"mdml-bench-chunks-{env['run']}"
+    tmp_dir = tempfile.mkdtemp()
+    files = []
+    for i in range(args.files):
+        fn = os.path.join(tmp_dir, f"frame{i}.bin")
+        with open(fn, 'wb') as f:
+            f.write(os.urandom(args.file_size * 1024 * 1024))
+        files.append(fn)
+    producer = mdml.kafka_mdml_producer(topic, schema=mdml.multipart_schema, add_time=False,
+        **env['kafka'], **env['registry'])
+    # A one part warm-up file is received once the consumer group has
+    # joined, so the join is not timed
+    consumer = mdml.kafka_mdml_consumer([topic], f"bench-{uuid.uuid4()}",
+        provision_topics=False, **env['kafka'], **env['registry'])
+    producer.produce({'time': time.time(), 'chunk': "AAAA", 'part': "1.1", 'filename': "warmup", 'encoding': "base64"})
+    producer.flush()
+    save_dir = os.path.join(tmp_dir, "out")
+    os.makedirs(save_dir)
+    received = consumer.consume_chunks(overall_timeout=args.timeout, save_dir=save_dir, verbose=False)
+    next(received)
+    latencies = []
+    start = time.perf_counter()
+    for fn in files:
+        sent = time.perf_counter()
+        for part in mdml.chunk_file(fn, args.chunk_size, file_id=os.path.basename(fn)):
+            while True:
+                try:
+                    producer.produce(part)
+                    break
+                except BufferError:
+                    producer.poll(0.05)
+        producer.flush()
+        next(received)
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - start
+    received.close()
+    consumer.close()
+    producer.close()
+    for fn in os.listdir(save_dir):
+        os.remove(os.path.join(save_dir, fn))
+    for fn in files:
+        os.remove(fn)
+    return dict(MB_per_s=args.files * args.file_size / elapsed, files_per_s=args.files / elapsed,
+        **percentiles(latencies))
+
+def bench_create_schema(env, args, mdml):
+    record = {
+        'time': time.time(),
+        'sensor': "thermocouple-1",
+        'readings': [1.0, 2.0, 3.0],
+        'settings': {'setpoint': 700, 'mode': "ramp", 'limits': {'low': 10, 'high': 900}}
+    }
+    n = args.messages
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        mdml.create_schema(record, "Benchmark", "Benchmark schema", required_keys=['time'])
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    return dict(ops_per_s=n / elapsed, **percentiles(latencies))
+
+def bench_s3(env, args, mdml):
+    client = mdml.kafka_mdml_s3_client(f"mdml-benchs3{env['run']}-frames", s3_endpoint=env['s3'],
+        s3_access_key="benchmark", s3_secret_key="benchmark", **env['kafka'], **env['registry'])
+    tmp_dir = tempfile.mkdtemp()
+    fn = os.path.join(tmp_dir, "frame.bin")
+    with open(fn, 'wb') as f:
+        f.write(os.urandom(args.file_size * 1024 * 1024))
+    upload = []
+    start = time.perf_counter()
+    for i in range(args.files):
+        t = time.perf_counter()
+        client.produce(fn, f"frame{i}.bin")
+        upload.append(time.perf_counter() - t)
+    upload_s = time.perf_counter() - start
+    download = []
+    out = os.path.join(tmp_dir, "out.bin")
+    start = time.perf_counter()
+    for i in range(args.files):
+        t = time.perf_counter()
+        client.consume(client.bucket, f"frame{i}.bin", out)
+        download.append(time.perf_counter() - t)
+    download_s = time.perf_counter() - start
+    client.close()
+    os.remove(fn)
+    os.remove(out)
+    mb = args.files * args.file_size
+    res = {'upload_MB_per_s': mb / upload_s, 'download_MB_per_s': mb / download_s}
+    res.update({f"upload_{k}": v for k, v in percentiles(upload).items()})
+    res.update({f"download_{k}": v for k, v in percentiles(download).items()})
+    return res
+
+def bench_metrics(env, args, mdml):
+    from confluent_kafka.serialization import SerializationContext, MessageField
+    topic = f"mdml-bench-metrics-{env['run']}"
+    records = [make_record(i) for i in range(args.messages)]
+    ctx = SerializationContext(topic, MessageField.VALUE)
+    serializers = {}
+    for name, topic_metrics in (('instrumented', True), ('plain', False)):
+        producer = mdml.kafka_mdml_producer(topic, schema=record_schema, topic_metrics=topic_metrics,
+            **env['kafka'], **env['registry'])
+        serializers[name] = producer.value_serializer
+        serializers[name](records[0], ctx) # the schema is registered on first use
+        producer.close()
+    # Best of alternating rounds, as the difference is small next to the
+    # cost of validating and serializing a record
+    res = {name: float('inf') for name in serializers}
+    for _ in range(3):
+        for name, serialize in serializers.items():
+            start = time.perf_counter()
+            for record in records:
+                serialize(record, ctx)
+            res[name] = min(res[name], time.perf_counter() - start)
+    n = args.messages
+    return {'instrumented_msgs_per_s': n / res['instrumented'], 'plain_msgs_per_s': n / res['plain'],
+        'overhead_us': (res['instrumented'] - res['plain']) / n * 1e6}
+
+CASES = {
+    'produce': bench_produce,
+    'consume': bench_consume,
+    'chunks': bench_chunks,
+    'create_schema': bench_create_schema,
+    's3': bench_s3,
+    'metrics': bench_metrics,
+}
+
+def environment():
+    import confluent_kafka
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'time': time.time(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.node(),
+        'confluent_kafka': confluent_kafka.version()[0],
+        'librdkafka': confluent_kafka.libversion()[0],
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of each metric from the baseline and return the
+    names of the metrics that regressed by more than threshold
+    """
+    regressions = []
+    for case, metrics in results.items():
+        old = baseline.get('results', {}).get(case)
+        if old is None:
+            continue
+        print(f"{case}:")
+        for name, value in metrics.items():
+            if name not in old or not old[name]:
+                continue
+            change = (value - old[name]) / old[name]
+            # Throughputs should go up and latencies down
+            worse = -change if name.endswith('_per_s') else change
+            flag = ""
+            if worse > threshold and (name.endswith('_per_s') or name.endswith('p99_ms')):
+                flag = "  REGRESSION"
+                regressions.append(f"{case}.{name}")
+            print(f"  {name:>24}: {old[name]:10.3f} -> {value:10.3f} ({change*100:+6.1f}%){flag}")
+    return regressions
+
+def main(args):
+    # Benchmark the working tree rather than an installed package
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path[:0] = [os.path.join(root, 'tests'), root]
+    from standins import mock_kafka, schema_registry, s3
+    import mdml_client as mdml
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    # kafka must stay referenced for the mock cluster to stay up
+    kafka, servers = mock_kafka()
+    host, port = servers.split(':')
+    registry, schema_host, schema_port = schema_registry()
+    s3_server, s3_endpoint = s3()
+    env = {
+        'run': uuid.uuid4().hex[:8],
+        'kafka': {'kafka_host': host, 'kafka_port': int(port)},
+        'registry': {'schema_host': schema_host, 'schema_port': schema_port},
+        's3': s3_endpoint,
+    }
+    cases = args.cases or list(CASES)
+    results = {}
+    try:
+        for case in cases:
+            res = CASES[case](env, args, mdml)
+            results[case] = res
+            print(f"{case:>13}: " + ", ".join(f"{k}={v:.3f}" for k, v in res.items()))
+    finally:
+        registry.shutdown()
+        s3_server.shutdown()
+    report = {
+        'environment': environment(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('save', 'compare', 'cases')},
+        'results': results,
+    }
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.save}")
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('parameters') != report['parameters']:
+            print("Warning, the baseline was run with different parameters")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the offline MDML client benchmarks")
+    parser.add_argument('cases', nargs='*', choices=[[]] + list(CASES),
+                        help="Cases to run [default: all]")
+    parser.add_argument('--messages', dest="messages", type=int, default=20000,
+                        help="Number of messages for the produce, consume, create_schema and metrics cases [default: 20000]")
+    parser.add_argument('--files', dest="files", type=int, default=10,
+                        help="Number of files for the chunks and s3 cases [default: 10]")
+    parser.add_argument('--file-size', dest="file_size", type=int, default=4,
+                        help="Size of each file in MB [default: 4]")
+    parser.add_argument('--chunk-size', dest="chunk_size", type=int, default=500000,
+                        help="Chunk size in bytes for the chunks case [default: 500000]")
+    parser.add_argument('--timeout', dest="timeout", type=float, default=30.0,
+                        help="Seconds to wait for messages [default: 30]")
+    parser.add_argument('--save', dest="save", default=None,
+                        help="Save the results as a JSON baseline to this file")
+    parser.add_argument('--compare', dest="compare", default=None,
+                        help="Compare the results with a baseline saved with --save")
+    parser.add_argument('--threshold', dest="threshold", type=float, default=0.1,
+                        help="Relative change counted as a regression [default: 0.1]")
+    args = parser.parse_args()
+    main(args)
@@ -1,17 +1,24 @@
+import codecs
 import json
 import math
 import os
+import shutil
+import tempfile
+import threading
 import time
-import boto3
-import requests
 from base64 import b64encode, b64decode
-from confluent_kafka import Consumer, Producer, TopicPartition
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from confluent_kafka import Consumer, Producer, TopicPartition, KafkaException
 from confluent_kafka import SerializingProducer
 from confluent_kafka.admin import NewTopic, AdminClient
 from confluent_kafka.serialization import StringSerializer
-from confluent_kafka.schema_registry import SchemaRegistryClient
-from confluent_kafka.schema_registry.json_schema import JSONSerializer
-from confluent_kafka.schema_registry.json_schema import JSONDeserializer
+from confluent_kafka.serialization import SerializationContext, MessageField
+from .reassembly import chunk_reassembler
+from .columnar import columnar_buffer
+from .compression import check_kafka_codec, compress
+from .metrics import default_metrics, _instrumented_serializer, _message_metrics, _statistics_config, _null
+from .validation import compiled_json_serializer
 
 py_type_to_schema_type = {
     str: "string",
@@ -21,62 +28,163 @@ py_type_to_schema_type = {
     dict: "object",
 }
 
-def chunk_file(fn, chunk_size, use_b64=True, encoding='utf-8', file_id=None):
+def chunk_file(fn, chunk_size, use_b64=True, encoding='utf-8', file_id=None, compression=None):
     """
     Chunks a file into parts. Yields dictionaries 
     containing the file bytes encoded in base64. Base64 is used since
     the kafka Producer requires a string and some files must be opened in
-    byte format.    
+    byte format. The file is read incrementally, so memory use is bounded
+    by the chunk size rather than the size of the file.
     
     Parameters
     ----------
     fn : str
         Path to the file 
     chunk_size : int
-        Size of chunk to use
+        Size of chunk to use. When use_b64 is True, this is the maximum
+        length of the encoded chunk and is rounded down to a multiple of 4.
+        Otherwise it is the number of bytes of the file in each chunk
     use_b64 : bool
         True to return the file bytes as a base64 encoded string
     encoding : string
         Encoding to use to open the file if use_b64 is False  
     file_id : string
         File ID to use in the chunking process if the fn param is not suitable 
+    compression : str
+        Codec used to compress the bytes of each part before they are
+        base64 encoded (one of mdml_client.chunk_codecs). The codec is
+        recorded in the 'compression' field of each chunk and parts are
+        decompressed by consume_chunks. Requires use_b64
  
     Yields
     ------
     Dictionary containing a chunk of data and metadata information
     required to piece all of the chunks back together.
     """
+    if compression is not None and not use_b64:
+        raise Exception("Error, use_b64 must be True when compression is used.")
     if use_b64:
         encoding = 'base64'
+        # Read a multiple of 3 bytes per part so that each chunk can be
+        # encoded on its own without padding. The concatenated chunks are
+        # then identical to encoding the entire file at once.
+        read_size = (chunk_size // 4) * 3
+        if read_size == 0:
+            raise Exception("Error, chunk_size must be at least 4 when use_b64 is True.")
+        total_parts = math.ceil(os.path.getsize(fn)/read_size)
+        buf = bytearray(read_size)
+        view = memoryview(buf)
         with open(fn, 'rb') as f:
-            file_bytes = f.read()
-        file_dat = b64encode(file_bytes).decode('utf-8')
+            for part in range(1, total_parts+1):
+                n = f.readinto(buf)
+                data = view[:n]
+                if compression is not None:
+                    data = compress(data, compression)
+                chunk = b64encode(data).decode('utf-8')
+                msg = _chunk_message(chunk, part, total_parts, fn, encoding, file_id)
+                if compression is not None:
+                    msg['compression'] = compression
+                yield msg
     else:
-        with open(fn, 'r', encoding=encoding) as f:
-            file_dat = f.read()
-    file_len = len(file_dat)
-    total_parts = math.ceil(file_len/chunk_size)
-    part = 1
-    while len(file_dat):
-        chunk_bytes = file_dat[0:chunk_size]
-        file_dat = file_dat[chunk_size:]
-        dat = {
-            'time': time.time(),
-            'chunk': chunk_bytes,
-            'part': f'{part}.{total_parts}',
-            'filename': fn,
-            'encoding': encoding
-        }
-        if file_id is not None:
-            dat['filename'] = file_id
-        part += 1
-        yield dat
+        # Parts are chunk_size bytes of the file, so they are counted from
+        # its size and the file is read once. Characters split between
+        # parts are held back by the decoder until the next part
+        total_parts = math.ceil(os.path.getsize(fn)/chunk_size)
+        decoder = codecs.getincrementaldecoder(encoding)()
+        with open(fn, 'rb') as f:
+            for part in range(1, total_parts+1):
+                chunk = decoder.decode(f.read(chunk_size), final=part == total_parts)
+                yield _chunk_message(chunk, part, total_parts, fn, encoding, file_id)
+
+def _chunk_message(chunk, part, total_parts, fn, encoding, file_id=None):
+    dat = {
+        'time': time.time(),
+        'chunk': chunk,
+        'part': f'{part}.{total_parts}',
+        'filename': fn,
+        'encoding': encoding
+    }
+    if file_id is not None:
+        dat['filename'] = file_id
+    return dat
 
-def start_experiment(id, topics, producer_kwargs={}):
+def chunk_file_binary(fn, chunk_size, file_id=None, compression=None):
+    """
+    Chunks a file into raw binary parts. Unlike chunk_file, the bytes 
+    are not encoded and the metadata needed to piece the file back 
+    together is returned as Kafka message headers. Used by 
+    kafka_mdml_producer_schemaless.produce_file.
+
+    Parameters
+    ----------
+    fn : str
+        Path to the file
+    chunk_size : int
+        Number of file bytes in each chunk. Must be smaller than the 
+        maximum message size of the Kafka broker (1MB by default)
+    file_id : string
+        File ID to use in the chunking process if the fn param is not suitable
+    compression : str
+        Codec used to compress each part (one of mdml_client.chunk_codecs).
+        The codec is sent in a 'compression' header
+
+    Yields
+    ------
+    tuple
+        A tuple containing (chunk, headers) where chunk is the bytes of
+        the part and headers is a list of Kafka message headers.
+    """
+    if file_id is None:
+        file_id = fn
+    total_parts = math.ceil(os.path.getsize(fn)/chunk_size)
+    with open(fn, 'rb') as f:
+        for part in range(1, total_parts+1):
+            chunk = f.read(chunk_size)
+            headers = [
+                ('time', str(time.time())),
+                ('part', f'{part}.{total_parts}'),
+                ('filename', file_id),
+                ('encoding', 'binary')
+            ]
+            if compression is not None:
+                chunk = compress(chunk, compression)
+                headers.append(('compression', compression))
+            yield chunk, headers
+
+def _binary_chunk_value(msg):
+    """
+    Returns a chunk dictionary (matching the multipart schema) for a 
+    message produced by chunk_file_binary or None for any other message.
+    """
+    headers = msg.headers()
+    if headers is None:
+        return None
+    info = {}
+    for k, v in headers:
+        if k in ('time', 'part', 'filename', 'encoding', 'compression') and v is not None:
+            info[k] = v.decode('utf-8')
+    compression = info.pop('compression', None)
+    if info.get('encoding') != 'binary' or len(info) != 4:
+        return None
+    value = {
+        'time': float(info['time']),
+        'chunk': msg.value(),
+        'part': info['part'],
+        'filename': info['filename'],
+        'encoding': 'binary'
+    }
+    if compression is not None:
+        value['compression'] = compression
+    return value
+
+def start_experiment(id, topics, producer_kwargs={}, settle=None):
     """
     Start an experiment with the MDML Experiment service.
     Messages produced on all of the specified topics will be saved
-    to a file and upload to S3. 
+    to a file and upload to S3. Returns once Kafka acknowledges the
+    start message. The control producer is kept open and reused by later
+    calls with the same producer_kwargs (see experiment_session to
+    manage it yourself).
     
     Parameters
     ----------
@@ -87,45 +195,16 @@ def start_experiment(id, topics, producer_kwargs={}):
     producer_kwargs : dict
         Dictionary that is passed as kwargs to the underlying producer in this function.
         Parameter names should be the same as those in a kafka_mdml_producer. 
+    settle : float
+        Optional seconds to wait after the start message is acknowledged,
+        giving the experiment service time to start consuming the topics
     """
-    experiment_topics_schema = {
-        "$schema": "http://merf.egs.anl.gov/mdml-experiment-service-schema#",
-        "title": "ExperimentServiceSchema",
-        "description": "Schema for Kafka MDML Experiments",
-        "type": "object",
-        "properties": {
-            "time": {
-                "description": "Sent timestamp",
-                "type": "number"
-            },
-            "experiment_id": {
-                "description": "A unique experiment ID",
-                "type": "string"
-            },
-            "topics": {
-                "description": "Topics under the experiment",
-                "type": "array",
-                "items": {
-                    "type": "string"
-                },
-            },
-            "status": {
-                "description": "Experiment status",
-                "type": "string"
-            }
-        },
-        "required": [ "time", "experiment_id", "status" ]
-    }
-    producer = kafka_mdml_producer("mdml-experiment-service", schema=experiment_topics_schema, **producer_kwargs)
-    producer.produce({
-        "time": time.time(),
-        "experiment_id": id,
-        "topics": topics,
-        "status": "on"
-    })
-    producer.flush()
-    time.sleep(5)
-    print("Experiment started")
+    from .experiments import _default_session
+    session = _default_session(producer_kwargs)
+    session.start(id, topics, wait=True)
+    session.flush()
+    if settle:
+        time.sleep(settle)
 
 def stop_experiment(id, producer_kwargs={}):
     """
@@ -142,44 +221,49 @@ def stop_experiment(id, producer_kwargs={}):
         Dictionary that is passed as kwargs to the underlying producer in this function.
         Parameter names should be the same as those in a kafka_mdml_producer.
     """
-    experiment_topics_schema = {
-        "$schema": "http://merf.egs.anl.gov/mdml-experiment-service-schema#",
-        "title": "ExperimentServiceSchema",
-        "description": "Schema for Kafka MDML Experiments",
-        "type": "object",
-        "properties": {
-            "time": {
-                "description": "Sent timestamp",
-                "type": "number"
-            },
-            "experiment_id": {
-                "description": "A unique experiment ID",
-                "type": "string"
-            },
-            "topics": {
-                "description": "Topics under the experiment",
-                "type": "array",
-                "items": {
-                    "type": "string"
-                },
-            },
-            "status": {
-                "description": "Experiment status",
-                "type": "string"
-            }
-        },
-        "required": [ "time", "experiment_id", "status" ]
-    }
-    producer = kafka_mdml_producer("mdml-experiment-service", schema=experiment_topics_schema, **producer_kwargs)
-    producer.produce({
-        "time": time.time(),
-        "experiment_id": id,
-        "status": "off"
-    })
-    producer.flush()
-    print("Experiment stopped")
+    from .experiments import _default_session
+    _default_session(producer_kwargs).stop(id, wait=True)
 
-def upload_experiment_to_ADC(exp_id, group, ADC_SDL_TOKEN, study_id, producer_kwargs={}, consumer_kwargs={}):
+def upload_experiment_to_ADC(exp_id, group, ADC_SDL_TOKEN, study_id, producer_kwargs={}, consumer_kwargs={},
+                export_format="json", compression=None, max_memory_bytes=64*1024*1024):
+    """
+    Upload the data streamed during an experiment to the Argonne Data Cloud.
+    Messages are decoded as they are consumed and sorted by time with an
+    external merge sort, so memory use does not grow with the length of
+    the experiment.
+
+    Parameters
+    ----------
+    exp_id : str
+        Experiment ID
+    group : str
+        Consumer group ID. Must be unique for each upload
+    ADC_SDL_TOKEN : str
+        ADC SDK access token
+    study_id : str
+        ADC study to create the sample in
+    producer_kwargs : dict
+        Dictionary that is passed as kwargs to the producer of the upload URL.
+        Parameter names should be the same as those in a kafka_mdml_producer.
+    consumer_kwargs : dict
+        Dictionary that is passed as kwargs to the experiment consumer.
+        Parameter names should be the same as those in a kafka_mdml_consumer_schemaless.
+    export_format : str
+        'json' to upload one JSON array or 'ndjson' for newline-delimited JSON
+    compression : str
+        None or the codec used to compress the uploaded file ('gzip',
+        'bz2', 'xz' or 'zstd')
+    max_memory_bytes : int
+        Approximate number of bytes of messages held in memory while sorting
+
+    Returns
+    -------
+    dict
+        The ADC sample that was created
+    """
+    from .export import external_sort, open_export, write_export, export_suffix
+    if study_id is None or ADC_SDL_TOKEN is None:
+        raise Exception("cannot use method 'upload' without a study_id")
     experiment_topics_schema = {
         "$schema": "http://merf.egs.anl.gov/mdml-experiment-upload-urls-schema#",
         "title": "ExperimentUploadURLSchema",
@@ -210,29 +294,27 @@ def upload_experiment_to_ADC(exp_id, group, ADC_SDL_TOKEN, study_id, producer_kw
         "required": [ "time", "name", "user_name", "user_email", "url" ]
     }
     url_producer = kafka_mdml_producer("mdml-experiment-upload-urls", schema=experiment_topics_schema, **producer_kwargs)
-    data = []
     exp_consumer = kafka_mdml_consumer_schemaless([f"mdml-experiment-{exp_id}"], group, **consumer_kwargs)
     print("Gathering experiment data for upload.")
-    for msg in exp_consumer.consume(overall_timeout=5, verbose=False):
-        data.append(json.loads(msg['value']))
-    if len(data) == 0:
+    def records():
+        for msg in exp_consumer.consume(overall_timeout=5, verbose=False):
+            d = json.loads(msg['value'])
+            d['time'] = d['value']['time']
+            yield d['time'], json.dumps(d)
+    # Save data messages to a file, sorted by time
+    fn = f"{exp_id}{export_suffix(export_format, compression)}"
+    with open_export(fn, compression) as f:
+        count = write_export(external_sort(records(), max_memory_bytes), f, export_format)
+    if count == 0:
+        os.remove(fn)
         print("No experiment data found. You must use a unique group ID for each upload.")
         return
-    for d in data:
-        d['time'] = d['value']['time']
-    data = sorted(data, key=lambda k: k['time'])
-    # Save data messages to a JSON file
-    with open(f'{exp_id}.json', 'w') as f:
-        f.writelines(json.dumps(data))
-    if study_id is None or ADC_SDL_TOKEN is None:
-        Exception("cannot use method 'upload' without a study_id")
-    else:
-        from adc_sdk.client import ADCClient
-        client = ADCClient(ADC_SDL_TOKEN)
-        with open(f'{exp_id}.json', 'rb') as f:
-            sample = client.create_sample(f,study_id,f"MDML experiment {exp_id}")
-            print(type(sample))
-            print(f"SAMPLE {sample} SAMPLE END")
+    from adc_sdk.client import ADCClient
+    client = ADCClient(ADC_SDL_TOKEN)
+    with open(fn, 'rb') as f:
+        sample = client.create_sample(f,study_id,f"MDML experiment {exp_id}")
+        print(type(sample))
+        print(f"SAMPLE {sample} SAMPLE END")
     url_producer.produce({
         "time": time.time(),
         "name": sample['sample']['name'],
@@ -241,12 +323,15 @@ def upload_experiment_to_ADC(exp_id, group, ADC_SDL_TOKEN, study_id, producer_kw
         "url": sample['sample']['url'],
     })
     url_producer.flush()
-    os.remove(f"{exp_id}.json")
+    os.remove(fn)
     return sample
 
-def get_experiment_data(exp_id, ADC_TOKEN):
+def get_experiment_data(exp_id, ADC_TOKEN, cache_dir=None):
     """
-    Return the data streamed during an experiment
+    Return the data streamed during an experiment. Experiment IDs are
+    looked up in an index that is kept between calls, and with cache_dir
+    downloaded experiments are cached on disk (see experiment_data_store
+    for streaming and concurrent retrieval).
     
     Parameters
     ----------
@@ -254,6 +339,8 @@ def get_experiment_data(exp_id, ADC_TOKEN):
         Experiment ID
     ADC_TOKEN : str
         ADC SDK access token
+    cache_dir : str
+        Directory to cache the index and downloaded experiments in
 
     Return
     ------
@@ -261,21 +348,8 @@ def get_experiment_data(exp_id, ADC_TOKEN):
         Tuple containing the ADC URL to the sample and a list 
         containing the data messsages streamed during the experiment
     """
-    from adc_sdk.client import ADCClient
-    MDML_STUDY_ID = "U3R1ZHlOb2RlOjMx" # ADC ID for MDML experiments Study
-    client = ADCClient(ADC_TOKEN)
-    study = client.get_study(MDML_STUDY_ID)
-    exp_sample = None
-    exp_url = None
-    for sample in study['study']['samples']['edges']:
-        # print(sample)
-        if sample['node']['name'] == f"MDML experiment {exp_id}":
-            exp_sample = sample
-            exp_url = exp_sample['node']['url']
-    if exp_sample is None:
-        raise Exception("No experiment found with that ID.")
-    resp = requests.get(exp_sample['node']['url'], verify=False)
-    return (exp_url, resp.json())
+    from .experiment_data import _default_store
+    return _default_store(ADC_TOKEN, cache_dir).get(exp_id)
 
 def replay_experiment(experiment_id, speed=1, producer_kwargs={}):
     """
@@ -291,34 +365,8 @@ def replay_experiment(experiment_id, speed=1, producer_kwargs={}):
     producer_kwargs : dict
         Dictionary of kwargs for this functions internal producer
     """
-    experiment_replay_schema = {
-        "$schema": "http://merf.egs.anl.gov/mdml-replay-service-schema#",
-        "title": "ExperimentReplayServiceSchema",
-        "description": "Schema for Kafka MDML Experiment Replays",
-        "type": "object",
-        "properties": {
-            "time": {
-                "description": "Sent timestamp",
-                "type": "number"
-            },
-            "experiment_id": {
-                "description": "Argonne Data Cloud sample ID",
-                "type": "string"
-            },
-            "speed": {
-                "description": "Speed to replay at",
-                "type": "number"
-            }
-        },
-        "required": [ "time", "experiment_id", "speed" ]
-    }
-    producer = kafka_mdml_producer("mdml-replay-service", schema=experiment_replay_schema, **producer_kwargs)
-    producer.produce({
-        "time": time.time(),
-        "experiment_id": experiment_id,
-        "speed": speed
-    })
-    producer.flush()
+    from .experiments import _default_session
+    _default_session(producer_kwargs).replay(experiment_id, speed, wait=True)
 
 def create_schema(d, title, descr, required_keys=None, add_time=False):
     """
@@ -403,6 +451,81 @@ def create_schema(d, title, descr, required_keys=None, add_time=False):
         #     }
     return schema
 
+class _delivery_poller:
+    """
+    Serves the delivery reports of a producer from a background thread.
+    """
+    def __init__(self, producer, interval=0.1):
+        self.producer = producer
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    def run(self):
+        while not self.stopped.is_set():
+            self.producer.poll(self.interval)
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+def _delivery_future(on_delivery=None):
+    """
+    Returns a (future, callback) pair. The callback resolves the future
+    with the delivered message or fails it with a KafkaException, after
+    calling on_delivery if one was given.
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+    def callback(err, msg):
+        if on_delivery is not None:
+            on_delivery(err, msg)
+        if err is None:
+            future.set_result(msg)
+        else:
+            future.set_exception(KafkaException(err))
+    return future, callback
+
+# Topics known to exist, by bootstrap server
+_known_topics = {}
+_known_topics_lock = threading.Lock()
+
+def _provision_topics(bootstrap, topics, num_partitions=10, timeout=10.0):
+    """
+    Creates the topics that do not exist yet. Existing topics are found
+    with one metadata request and all missing topics are created with one
+    batched request. Topics known to exist are cached for the lifetime of
+    the process and are not checked again.
+    """
+    with _known_topics_lock:
+        known = _known_topics.setdefault(bootstrap, set())
+        missing = [topic for topic in topics if topic not in known]
+    if not missing:
+        return
+    AC = AdminClient({'bootstrap.servers': bootstrap})
+    try:
+        existing = AC.list_topics(timeout=timeout).topics
+    except KafkaException as e:
+        print(f"ERROR creating topic {e.args[0].name()}")
+        return
+    found = [topic for topic in missing if topic in existing]
+    missing = [topic for topic in missing if topic not in existing]
+    if missing:
+        results = AC.create_topics([NewTopic(topic, num_partitions) for topic in missing],
+            request_timeout=timeout)
+        for topic, res in results.items():
+            try:
+                res.result()
+                print("Topic created since it did not exist yet.")
+                found.append(topic)
+            except KafkaException as e:
+                reason = e.args[0].name()
+                if reason == "TOPIC_ALREADY_EXISTS":
+                    found.append(topic)
+                else:
+                    print(f"ERROR creating topic {reason}")
+    with _known_topics_lock:
+        known.update(found)
+
 class kafka_mdml_producer:
     """
     Creates a producer instance for producing data to an MDML instance. 
@@ -427,10 +550,39 @@ class kafka_mdml_producer:
         Host name of the kafka schema registry
     schema_port : int
         Port of the kafka schema registry
+    background_poll : bool
+        If True, a background thread continuously serves delivery reports
+        so on_delivery callbacks and futures from produce() complete
+        without calling flush(). Use close() to stop the thread.
+    validation : str
+        None (default) validates every message with confluent_kafka's
+        JSONSerializer. Otherwise the schema is compiled once (see 
+        compiled_json_serializer) and messages are validated according
+        to the policy: 'always', 'every' (one in every validation_n 
+        messages), 'first' (the first validation_n messages) or 'off'
+    validation_n : int
+        Number of messages used by the 'every' and 'first' policies
+    compression : str
+        Codec Kafka uses to compress batches of messages ('none', 'gzip',
+        'snappy', 'lz4' or 'zstd'). Batches are decompressed by the
+        consumer automatically. None leaves the producer default (no
+        compression). Not used when config is given
+    statistics_interval_ms : int
+        Interval at which librdkafka statistics (queue depths, broker
+        round trip times, per partition counts) are recorded in
+        mdml_client.default_metrics. Statistics are recorded while
+        delivery reports are served (poll, flush or background_poll).
+        None disables statistics
+    topic_metrics : bool
+        Record the per-topic message, byte and serialization time metrics in
+        mdml_client.default_metrics. False skips this bookkeeping on
+        every message
     """
     def __init__(self, topic, schema=None, config=None, add_time=True,
                 kafka_host="merf.egs.anl.gov", kafka_port=9092,
-                schema_host="merf.egs.anl.gov", schema_port=8081):
+                schema_host="merf.egs.anl.gov", schema_port=8081,
+                background_poll=False, validation=None, validation_n=1000,
+                compression=None, statistics_interval_ms=None, topic_metrics=True):
         # Checking topic param
         if type(topic) == str:
             if topic[0:5] != "mdml-":
@@ -440,10 +592,8 @@ class kafka_mdml_producer:
         else:
             raise Exception("Error, topic must be of type string.")
         # Create schema registry config, client, and serializer
-        schema_registry_conf = {
-            "url": f"http://{schema_host}:{schema_port}"
-        }
-        schema_registry_client = SchemaRegistryClient(schema_registry_conf)
+        from .registry import get_schema_registry_client
+        schema_registry_client = get_schema_registry_client(f"http://{schema_host}:{schema_port}")
         # Checking schema param
         if schema is None:
             try:
@@ -461,18 +611,40 @@ class kafka_mdml_producer:
                     self.schema = f.read()
             else:
                 raise Exception("Error, schema must be of type str or dict.")
-        json_serializer = JSONSerializer(self.schema, schema_registry_client)
+        if validation is None:
+            from confluent_kafka.schema_registry import topic_subject_name_strategy
+            from confluent_kafka.schema_registry.json_schema import JSONSerializer
+            # Subjects are always <topic>-value. Naming the strategy also stops
+            # newer confluent_kafka versions from asking the registry for
+            # topic associations each time a producer is created
+            json_serializer = JSONSerializer(self.schema, schema_registry_client,
+                conf={'subject.name.strategy': topic_subject_name_strategy})
+        else:
+            json_serializer = compiled_json_serializer(self.schema, schema_registry_client,
+                validation=validation, validation_n=validation_n)
         # Create producer and its config 
         if config is None:
             producer_config = {
                 'bootstrap.servers': f'{kafka_host}:{kafka_port}',
                 'value.serializer': json_serializer
             }
+            if compression is not None:
+                producer_config['compression.type'] = check_kafka_codec(compression)
         else:
-            producer_config = config
+            producer_config = dict(config)
+        if topic_metrics and producer_config.get('value.serializer') is not None:
+            # Records serialization time, messages and bytes of the topic
+            producer_config['value.serializer'] = _instrumented_serializer(producer_config['value.serializer'], self.topic)
+        if statistics_interval_ms is not None:
+            producer_config.update(_statistics_config(statistics_interval_ms))
         self.add_time = add_time
+        self.value_serializer = producer_config.get('value.serializer')
+        self.key_serializer = producer_config.get('key.serializer')
         self.producer = SerializingProducer(producer_config)
-    def produce(self, data, key=None, partition=None):
+        self.poller = None
+        if background_poll:
+            self.poller = _delivery_poller(self.producer)
+    def produce(self, data, key=None, partition=None, on_delivery=None, return_future=False):
         """
         Produce data to the supplied topic 
 
@@ -484,18 +656,135 @@ class kafka_mdml_producer:
             String for the Kafka assignor to use to calculate a partition
         partition : int
             Number of the Kafka partition to assign the message to
+        on_delivery : callable
+            Function called as on_delivery(err, msg) when the message is
+            delivered or fails. Called from poll(), flush() or the 
+            background thread (see background_poll)
+        return_future : bool
+            If True, returns a concurrent.futures.Future that resolves to
+            the delivered message or raises a KafkaException
+
+        Returns
+        -------
+        concurrent.futures.Future or None
         """
         if self.add_time:
             data['mdml_time'] = time.time()
-        if partition is None:
-            self.producer.produce(topic=self.topic, value=data, key=key)
+        future = None
+        if return_future:
+            future, on_delivery = _delivery_future(on_delivery)
+        kwargs = {}
+        if partition is not None:
+            kwargs['partition'] = partition
+        if on_delivery is not None:
+            kwargs['on_delivery'] = on_delivery
+        self.producer.produce(topic=self.topic, value=data, key=key, **kwargs)
+        return future
+    def produce_batch(self, records, key=None, partition=None, poll_interval=1000, flush=False):
+        """
+        Produce many records without flushing after each one. Records are
+        time stamped, serialized and queued in a single pass and delivery
+        reports are served every poll_interval records. Records that fail
+        are reported instead of stopping the batch.
+
+        Parameters
+        ----------
+        records : list(dict) or iterator
+            Data objects to produce
+        key : str
+            String for the Kafka assignor to use to calculate a partition
+        partition : int
+            Number of the Kafka partition to assign the messages to
+        poll_interval : int
+            Number of records between serving delivery reports. Values
+            below 1 serve them after every record
+        flush : bool
+            True to wait for all records to be delivered before returning
+
+        Returns
+        -------
+        list(tuple)
+            (index, error) for each record that failed to serialize or to be
+            delivered, where index is the position of the record in records.
+            Delivery failures are added as delivery reports are served, so
+            the list is only complete after flush() (or flush=True).
+        """
+        failures = []
+        poll_interval = max(poll_interval, 1)
+        kwargs = {}
+        if partition is not None:
+            kwargs['partition'] = partition
+        if self.value_serializer is None:
+            # Custom config without a serializer - the producer handles the values
+            produce = self.producer.produce
         else:
-            self.producer.produce(topic=self.topic, value=data, key=key, partition=partition)
+            # Values are serialized below, once per record. The base class
+            # method sends them as they are, where the SerializingProducer
+            # would run them through value.serializer a second time
+            produce = partial(Producer.produce, self.producer)
+            if key is not None and self.key_serializer is not None:
+                key = self.key_serializer(key, SerializationContext(self.topic, MessageField.KEY))
+            ctx = SerializationContext(self.topic, MessageField.VALUE)
+        for i, data in enumerate(records):
+            try:
+                if self.add_time:
+                    data['mdml_time'] = time.time()
+                value = data
+                if self.value_serializer is not None:
+                    value = self.value_serializer(data, ctx)
+            except Exception as e:
+                failures.append((i, e))
+                continue
+            on_delivery = partial(_record_failure, failures, i)
+            while True:
+                try:
+                    produce(topic=self.topic, value=value, key=key, on_delivery=on_delivery, **kwargs)
+                    break
+                except BufferError:
+                    # Local queue is full - wait for messages to be delivered
+                    self.producer.poll(0.1)
+                except Exception as e:
+                    failures.append((i, e))
+                    break
+            if i % poll_interval == 0:
+                self.producer.poll(0)
+        self.producer.poll(0)
+        if flush:
+            self.producer.flush()
+        return failures
+    def poll(self, timeout=0):
+        """
+        Serve delivery reports for messages that have been sent. Not
+        needed when background_poll is used.
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum time to wait for a delivery report
+
+        Returns
+        -------
+        int
+            Number of delivery reports served
+        """
+        return self.producer.poll(timeout)
     def flush(self):
         """
         Flush (send) any messages currently waiting in the producer.
         """
         self.producer.flush()
+    def close(self):
+        """
+        Flush the producer and stop the background delivery thread
+        """
+        self.producer.flush()
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+
+def _record_failure(failures, index, err, msg):
+    if err is not None:
+        failures.append((index, err))
 
 class kafka_mdml_consumer:
     """
@@ -523,11 +812,35 @@ class kafka_mdml_consumer:
         Host name of the kafka schema registry
     schema_port : int
         Port of the kafka schema registry
+    provision_topics : bool
+        Create topics that do not exist yet. Topics are checked and 
+        created in one batched request while schemas are looked up, and 
+        topics known to exist are not checked again. False skips this
+        step entirely for the fastest startup
+    statistics_interval_ms : int
+        Interval at which librdkafka statistics (consumer lag, fetch
+        queue depths, broker round trip times) are recorded in
+        mdml_client.default_metrics while consuming. None disables
+        statistics
+    track_latency : bool
+        Record the produce-to-consume latency of every message per topic
+        and partition from its 'mdml_time' and Kafka timestamp (see
+        latency_tracker). Read it with latency_report(). Works whether
+        or not show_mdml_time is set
+    latency_kwargs : dict
+        Dictionary that is passed as kwargs to the latency_tracker, e.g.
+        report_interval to print a report every few seconds
+    topic_metrics : bool
+        Record the per-topic message, byte and deserialization time metrics in
+        mdml_client.default_metrics. False skips this bookkeeping on
+        every message
     """
     def __init__(self, topics, group, auto_offset_reset="earliest",
                 show_mdml_time=True,
                 kafka_host="merf.egs.anl.gov", kafka_port=9092,
-                schema_host="merf.egs.anl.gov", schema_port=8081):
+                schema_host="merf.egs.anl.gov", schema_port=8081,
+                provision_topics=True, statistics_interval_ms=None,
+                track_latency=False, latency_kwargs={}, topic_metrics=True):
         self.topics = topics
         self.group = group
         self.kafka_host = kafka_host
@@ -535,54 +848,74 @@ class kafka_mdml_consumer:
         self.schema_host = schema_host
         self.schema_port = schema_port
         self.deserializers = {}
+        self._topic_metrics = {} # topic -> (deserialize seconds, messages, bytes)
+        self.topic_metrics = topic_metrics
+        # Shared schema registry client for looking up deserializers
+        from .registry import get_schema_registry_client
+        self.sr_client = get_schema_registry_client(f"http://{schema_host}:{schema_port}")
         # Checking topic param
         if type(topics) == list:
             for topic in topics:
                 if type(topic) == str:
                     if topic[0:5] != "mdml-":
                         raise Exception("Error, topic must be of the form 'mdml-<experiment id>-<sensor>'")
-                    else:
-                        # Create schema registry config, client, and serializer
-                        sr_config = {
-                            "url": f"http://{schema_host}:{schema_port}"
-                        }
-                        self.sr_client = SchemaRegistryClient(sr_config)
-                        try:
-                            schema_string = self.sr_client.get_latest_version(f'{topic}-value').schema.schema_str
-                            self.deserializers[topic] = JSONDeserializer(schema_string)
-                        except:
-                            self.deserializers[topic] = None
                 else:
                     raise Exception("Error, topic must be of type string.")
         else:
             raise Exception("Error, topics parameter must be a list of strings.")
-        # Topic creation is needed
-        AC = AdminClient({'bootstrap.servers': self.kafka_host})
+        # Topic creation is needed - runs while the schemas are looked up
+        provisioner = None
+        if provision_topics:
+            provisioner = threading.Thread(target=_provision_topics,
+                args=(f"{kafka_host}:{kafka_port}", topics), daemon=True)
+            provisioner.start()
+        from confluent_kafka.schema_registry.json_schema import JSONDeserializer
         for topic in topics:
-            res = AC.create_topics([NewTopic(topic, 10)])
-            res = res[topic]
-            if res.exception() is None:
-                print("Topic created since it did not exist yet.")
-                continue
-            else:
-                reason = res.exception().args[0].name()
-                if reason == "TOPIC_ALREADY_EXISTS":
-                    continue
-                else:
-                    print(f"ERROR creating topic {reason}") 
-        # .exception().args[0].name()
+            try:
+                schema_string = self.sr_client.get_latest_version(f'{topic}-value').schema.schema_str
+                self.deserializers[topic] = JSONDeserializer(schema_string)
+            except:
+                self.deserializers[topic] = None
+        if provisioner is not None:
+            provisioner.join()
         consumer_conf = {
             'bootstrap.servers': f"{kafka_host}:{kafka_port}",
             'group.id': group,
             'auto.offset.reset': auto_offset_reset,
             'allow.auto.create.topics': 'true' # prevents unknown topic error 
         }
+        if statistics_interval_ms is not None:
+            consumer_conf.update(_statistics_config(statistics_interval_ms, group=group))
         consumer = Consumer(consumer_conf)
         consumer.subscribe(topics)
         self.consumer = consumer
         self.show_mdml_time = show_mdml_time
+        self.latency = None
+        if track_latency:
+            from .latency import latency_tracker
+            self.latency = latency_tracker(**latency_kwargs)
 
-    def consume(self, poll_timeout=1.0, overall_timeout=300.0, verbose=True):
+    def latency_report(self, reset=False):
+        """
+        Returns the p50, p99 and p999 produce-to-consume latencies of each
+        topic, partition and stage (see latency_tracker.report). Requires
+        track_latency=True
+
+        Parameters
+        ----------
+        reset : bool
+            Start new histograms after the report
+
+        Returns
+        -------
+        dict
+            {topic: {partition: {stage: summary}}}
+        """
+        if self.latency is None:
+            raise Exception("Error, the consumer was created without track_latency=True.")
+        return self.latency.report(reset)
+
+    def consume(self, poll_timeout=1.0, overall_timeout=300.0, verbose=True, processes=None):
         """
         Start consuming from the specified topic
 
@@ -596,6 +929,11 @@ class kafka_mdml_consumer:
             This timeout is restarted every time a new message is received
         verbose : bool
             Print a message with notes when the consume loop starts
+        processes : int
+            Number of worker processes used to deserialize and validate
+            messages (True for one per CPU, otherwise at least 1). None
+            deserializes messages in this process. Messages are still
+            yielded in the order they were consumed
 
         Yields
         ------
@@ -607,6 +945,10 @@ class kafka_mdml_consumer:
                 print(f"Consumer loop will exit after {overall_timeout} seconds without receiving a message or with Ctrl+C")
             else:
                 print(f"Consumer loop will run indefinitely until a Ctrl+C")
+        if processes is not None:
+            for batch in self._consume_parallel(1000, processes, poll_timeout, overall_timeout):
+                yield from batch
+            return
         timeout = 0.0
         while timeout < overall_timeout or overall_timeout == -1:
             try:
@@ -614,14 +956,12 @@ class kafka_mdml_consumer:
                 if msg is None:
                     timeout += poll_timeout
                     continue # no messages within timeout - poll again 
-                if self.deserializers[msg.topic()] is None:
-                    if "topic not available" in msg.value().decode('utf-8'):
-                        continue # default message from broker the topic hasn't been created - poll again
-                    else:
-                        schema_string = self.sr_client.get_latest_version(f'{msg.topic()}-value').schema.schema_str
-                        self.deserializers[msg.topic()] = JSONDeserializer(schema_string)
+                val = self._deserialize(msg)
+                if val is None:
+                    continue # default message from broker the topic hasn't been created - poll again
                 timeout = 0.0
-                val = self.deserializers[msg.topic()](msg.value(), {})
+                if self.latency is not None:
+                    self.latency.record_message(msg, val.get('mdml_time'))
                 if not self.show_mdml_time:
                     if 'mdml_time' in val:
                         del val['mdml_time']
@@ -631,11 +971,283 @@ class kafka_mdml_consumer:
                 }
             except KeyboardInterrupt:
                 break
+
+    def consume_batch(self, batch_size=1000, poll_timeout=1.0, overall_timeout=300.0, verbose=True, processes=None):
+        """
+        Start consuming from the specified topics in batches. Messages
+        are fetched with a single call to the underlying consumer and 
+        deserialized together, which is much faster than consume() for
+        high rate topics.
+
+        Parameters
+        ----------
+        batch_size : int
+            Maximum number of messages in one batch
+        poll_timeout : float
+            Timeout to wait when consuming one batch
+        overall_timeout : float
+            Timeout to wait until the consume generator is closed down.
+            This timeout is restarted every time a new message is received
+        verbose : bool
+            Print a message with notes when the consume loop starts
+        processes : int
+            Number of worker processes used to deserialize and validate
+            messages (see consume)
+
+        Yields
+        ------
+        list(dict)
+            A list of dictionaries containing the topic and value of each
+            message, in the same format as consume()
+        """
+        if verbose:
+            if overall_timeout != -1:
+                print(f"Consumer loop will exit after {overall_timeout} seconds without receiving a message or with Ctrl+C")
+            else:
+                print(f"Consumer loop will run indefinitely until a Ctrl+C")
+        if processes is not None:
+            yield from self._consume_parallel(batch_size, processes, poll_timeout, overall_timeout)
+            return
+        timeout = 0.0
+        show_mdml_time = self.show_mdml_time
+        deserialize = self._deserialize
+        latency = self.latency
+        while timeout < overall_timeout or overall_timeout == -1:
+            try:
+                msgs = self.consumer.consume(batch_size, poll_timeout)
+                received = time.time()
+                batch = []
+                for msg in msgs:
+                    val = deserialize(msg)
+                    if val is None:
+                        continue
+                    if latency is not None:
+                        latency.record_message(msg, val.get('mdml_time'), received)
+                    if not show_mdml_time:
+                        val.pop('mdml_time', None)
+                    batch.append({
+                        'topic': msg.topic(),
+                        'value': val
+                    })
+                if len(batch) == 0:
+                    timeout += poll_timeout
+                    continue
+                timeout = 0.0
+                yield batch
+            except KeyboardInterrupt:
+                break
+
+    def consume_columnar(self, output="numpy", window_size=10000, window_seconds=1.0,
+                poll_timeout=1.0, overall_timeout=300.0, verbose=True):
+        """
+        Start consuming from the specified topics in columnar form. Records
+        of each topic are collected into columns built from the properties
+        of the topic's registered schema and yielded as one NumPy 
+        structured array (or Arrow record batch) per window. Records are
+        not validated against the schema, values are converted to the
+        column types instead. See columnar_buffer for how missing values
+        are handled.
+
+        Parameters
+        ----------
+        output : str
+            'numpy' for NumPy structured arrays or 'arrow' for Arrow
+            record batches (requires pyarrow)
+        window_size : int
+            Maximum number of records in one array
+        window_seconds : float
+            Maximum number of seconds records are collected before the
+            array of a topic is yielded
+        poll_timeout : float
+            Timeout to wait when consuming messages
+        overall_timeout : float
+            Timeout to wait until the consume generator is closed down.
+            This timeout is restarted every time a new message is received
+        verbose : bool
+            Print a message with notes when the consume loop starts
+
+        Yields
+        ------
+        dict
+            A dictionary containing the topic and the array of records
+            received in one window
+        """
+        if output not in ("numpy", "arrow"):
+            raise Exception("Error, output must be 'numpy' or 'arrow'.")
+        if verbose:
+            if overall_timeout != -1:
+                print(f"Consumer loop will exit after {overall_timeout} seconds without receiving a message or with Ctrl+C")
+            else:
+                print(f"Consumer loop will run indefinitely until a Ctrl+C")
+        buffers = {}
+        started = {}
+        def window(topic):
+            buffer = buffers[topic]
+            arr = buffer.to_numpy() if output == "numpy" else buffer.to_arrow()
+            buffer.clear()
+            del started[topic]
+            return {
+                'topic': topic,
+                'value': arr
+            }
+        timeout = 0.0
+        loads = json.loads
+        while timeout < overall_timeout or overall_timeout == -1:
+            try:
+                msgs = self.consumer.consume(window_size, min(poll_timeout, window_seconds))
+                received_time = time.time()
+                received = 0
+                for msg in msgs:
+                    value = msg.value()
+                    if msg.error() is not None or not value or value[0] != 0:
+                        continue # not a schema registry message (e.g. topic not available)
+                    topic = msg.topic()
+                    buffer = buffers.get(topic)
+                    if buffer is None:
+                        schema_string = self.sr_client.get_latest_version(f'{topic}-value').schema.schema_str
+                        buffer = columnar_buffer(schema_string, self.show_mdml_time)
+                        buffers[topic] = buffer
+                    if topic not in started:
+                        started[topic] = time.monotonic()
+                    _, messages, nbytes = self._metrics(topic)
+                    messages.inc()
+                    nbytes.inc(len(value))
+                    record = loads(value[5:])
+                    if self.latency is not None:
+                        self.latency.record_message(msg, record.get('mdml_time'), received_time)
+                    buffer.append(record)
+                    received += 1
+                    if len(buffer) >= window_size:
+                        yield window(topic)
+                if received == 0:
+                    timeout += min(poll_timeout, window_seconds)
+                else:
+                    timeout = 0.0
+                now = time.monotonic()
+                for topic in [t for t, start in started.items() if now - start >= window_seconds]:
+                    yield window(topic)
+            except KeyboardInterrupt:
+                break
+        for topic in list(started):
+            yield window(topic)
+
+    def _consume_parallel(self, batch_size, processes, poll_timeout, overall_timeout):
+        """
+        Consumes messages and deserializes them in a pool of worker
+        processes. Each batch from the consumer is split into contiguous
+        slices, one per worker, and the results are yielded in the order
+        the slices were submitted, so the order of every partition is kept.
+        """
+        import multiprocessing
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        from .deserialize_pool import _deserialize_messages
+        if processes is True:
+            processes = os.cpu_count()
+        if processes < 1:
+            raise Exception("Error, processes must be at least 1.")
+        # Spawned workers do not inherit the librdkafka threads of this process
+        pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+        pending = deque() # (future, latency info of the messages)
+        schemas = {}
+        timeout = 0.0
+        latency = self.latency
+        # Workers keep mdml_time when latency is tracked; it is removed here instead
+        worker_mdml_time = self.show_mdml_time or latency is not None
+        try:
+            while timeout < overall_timeout or overall_timeout == -1:
+                try:
+                    # Do not wait for messages while results are ready to be yielded
+                    if pending and pending[0][0].done():
+                        msgs = self.consumer.consume(batch_size, 0)
+                    else:
+                        msgs = self.consumer.consume(batch_size, poll_timeout)
+                    received = time.time()
+                    messages = []
+                    info = []
+                    for msg in msgs:
+                        if msg.error() is not None:
+                            continue # e.g. the topic hasn't been created - poll again
+                        topic = msg.topic()
+                        if topic not in schemas:
+                            schemas[topic] = self.sr_client.get_latest_version(f'{topic}-value').schema.schema_str
+                        value = msg.value()
+                        # Deserialization time is spent in the workers and not recorded
+                        _, messages_counter, bytes_counter = self._metrics(topic)
+                        messages_counter.inc()
+                        bytes_counter.inc(len(value))
+                        messages.append((topic, value))
+                        if latency is not None:
+                            info.append((msg.partition(), msg.timestamp(), received))
+                    if messages:
+                        timeout = 0.0
+                        step = math.ceil(len(messages) / processes)
+                        for i in range(0, len(messages), step):
+                            part = messages[i:i+step]
+                            part_schemas = {topic: schemas[topic] for topic in set(t for t, _ in part)}
+                            pending.append((pool.submit(_deserialize_messages, part_schemas, part, worker_mdml_time),
+                                info[i:i+step]))
+                    elif not pending:
+                        timeout += poll_timeout
+                    # Yield finished results in order, waiting when too many are in flight
+                    while pending and (pending[0][0].done() or len(pending) > 2 * processes or not msgs):
+                        future, part_info = pending.popleft()
+                        batch = future.result()
+                        if latency is not None:
+                            for item, (partition, (ts_type, ts), received_time) in zip(batch, part_info):
+                                val = item['value']
+                                latency.record(item['topic'], partition, val.get('mdml_time'),
+                                    None if ts_type == 0 else ts / 1000, received_time)
+                                if not self.show_mdml_time:
+                                    val.pop('mdml_time', None)
+                        if batch:
+                            yield batch
+                except KeyboardInterrupt:
+                    break
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _deserialize(self, msg):
+        """
+        Deserializes the value of a message with the schema of its topic.
+        Returns None for the placeholder messages the broker sends before
+        a topic has been created.
+        """
+        topic = msg.topic()
+        value = msg.value()
+        deserializer = self.deserializers.get(topic)
+        if deserializer is None:
+            if "topic not available" in value.decode('utf-8', errors='replace'):
+                return None
+            from confluent_kafka.schema_registry.json_schema import JSONDeserializer
+            schema_string = self.sr_client.get_latest_version(f'{topic}-value').schema.schema_str
+            deserializer = JSONDeserializer(schema_string)
+            self.deserializers[topic] = deserializer
+        seconds, messages, nbytes = self._metrics(topic)
+        start = time.perf_counter()
+        val = deserializer(value, SerializationContext(topic, MessageField.VALUE))
+        seconds.observe(time.perf_counter() - start)
+        messages.inc()
+        nbytes.inc(len(value))
+        return val
+
+    def _metrics(self, topic):
+        metrics = self._topic_metrics.get(topic)
+        if metrics is None:
+            if not self.topic_metrics:
+                return (_null, _null, _null)
+            metrics = (default_metrics.summary('mdml_deserialize_seconds', topic=topic),) + _message_metrics(topic, 'consumed')
+            self._topic_metrics[topic] = metrics
+        return metrics
         
-    def consume_chunks(self, poll_timeout=1.0, overall_timeout=300.0, save_file=True, save_dir='.', passthrough=True, verbose=True):
+    def consume_chunks(self, poll_timeout=1.0, overall_timeout=300.0, save_file=True, save_dir='.', passthrough=True, verbose=True,
+                max_buffer_bytes=64*1024*1024, file_ttl=3600.0, max_files=1000):
         """
         Consume messages from a topic that contains chunked messages.
-        The original file is saved to disk by default. 
+        The original file is saved to disk by default. Files sent with
+        chunk_file or kafka_mdml_producer_schemaless.produce_file are 
+        both supported. Parts are written to disk as they arrive (see
+        chunk_reassembler), so memory use does not depend on file size.
         
         Parameters
         ----------
@@ -655,6 +1267,14 @@ class kafka_mdml_consumer:
             messages are still yielded by the generator
         verbose : bool
             Print details regarding the consumer on start
+        max_buffer_bytes : int
+            Maximum bytes of out-of-order parts held in memory before
+            they are spilled to disk
+        file_ttl : float
+            Seconds without a new part after which an incomplete file
+            is discarded. None keeps incomplete files indefinitely
+        max_files : int
+            Maximum number of incomplete files tracked at once
 
         Yields
         ------
@@ -676,64 +1296,58 @@ class kafka_mdml_consumer:
             else:
                 print(f"Consumer loop will run indefinitely until a Ctrl+C")
         timeout = 0.0
-        files = {}
-        while timeout < overall_timeout or overall_timeout == -1:
-            try:
-                msg = self.consumer.poll(poll_timeout)
-                if msg is None:
-                    timeout += poll_timeout
-                    continue # no messages within timeout - poll again
-                if self.deserializers[msg.topic()] is None:
-                    if "topic not available" in msg.value().decode('utf-8'):
-                        continue # default message from broker the topic hasn't been created - poll again
-                    else: 
-                        schema_string = self.sr_client.get_latest_version(f'{msg.topic()}-value').schema.schema_str
-                        self.deserializers[msg.topic()] = JSONDeserializer(schema_string)
-                timeout = 0.0
-                value = self.deserializers[msg.topic()](msg.value(), {})
-                if passthrough:
+        tmp_dir = None
+        if not save_file:
+            tmp_dir = tempfile.mkdtemp()
+            save_dir = tmp_dir
+        reassembler = chunk_reassembler(save_dir, max_buffer_bytes=max_buffer_bytes, ttl=file_ttl, max_files=max_files)
+        try:
+            while timeout < overall_timeout or overall_timeout == -1:
+                try:
+                    msg = self.consumer.poll(poll_timeout)
+                    if msg is None:
+                        timeout += poll_timeout
+                        reassembler.evict()
+                        continue # no messages within timeout - poll again
+                    value = _binary_chunk_value(msg)
+                    if value is None:
+                        value = self._deserialize(msg)
+                        if value is None:
+                            continue # default message from broker the topic hasn't been created - poll again
+                    else:
+                        _, messages, nbytes = self._metrics(msg.topic())
+                        messages.inc()
+                        nbytes.inc(len(value['chunk']))
+                    timeout = 0.0
                     if 'chunk' not in value:
-                        if self.show_mdml_time:
-                            if 'mdml_time' in value:
-                                del value['mdml_time']
+                        if passthrough:
+                            if self.show_mdml_time:
+                                if 'mdml_time' in value:
+                                    del value['mdml_time']
                             yield {
                                 'topic': msg.topic(),
                                 'value': value
                             }
-                fn = value['filename']
-                part_info = value['part'].split('.')
-                if fn in files:
-                    files[fn][part_info[0]] = value['chunk']
-                else:
-                    files[fn] = {
-                        'parts': part_info[1],
-                        part_info[0]: value['chunk'] 
-                    }
-                if int(part_info[0]) == 1:
-                    files[fn]['time'] = value['time']
-                if len(files[fn].keys()) == (int(files[fn]['parts']) + 2):
-                    dat = ''
-                    for i in range(int(files[fn]['parts'])):
-                        dat += files[fn][str(i+1)]
-                    if value['encoding'] == 'base64':
-                        dat_bytes = b64decode(dat)
-                        if save_file:
-                            with open(f'{save_dir}/{os.path.basename(fn)}', 'wb') as f:
-                                f.write(dat_bytes)
-                            ret = os.path.basename(fn)
-                        else:
-                            ret = dat_bytes
+                        continue
+                    res = reassembler.add(value)
+                    if res is None:
+                        continue
+                    timestamp, path = res
+                    if save_file:
+                        ret = os.path.basename(path)
                     else:
-                        if save_file:
-                            with open(f'{save_dir}/{os.path.basename(fn)}', 'w', encoding=value['encoding']) as f:
-                                f.write(dat)
-                        else:
-                            ret = dat.decode(value['encoding'])                     
-                    timestamp = files[fn]['time']
-                    del files[fn]
+                        with open(path, 'rb') as f:
+                            ret = f.read()
+                        os.remove(path)
+                        if value['encoding'] not in ('base64', 'binary'):
+                            ret = ret.decode(value['encoding'])
                     yield timestamp, ret
-            except KeyboardInterrupt:
-                break
+                except KeyboardInterrupt:
+                    break
+        finally:
+            reassembler.close()
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
     def close(self):
         """
         Closes down the consumer. Ensures that received 
@@ -755,9 +1369,25 @@ class kafka_mdml_producer_schemaless:
         Host name of the kafka broker
     kafka_port : int
         Port used for the Kafka broker
+    background_poll : bool
+        If True, a background thread continuously serves delivery reports
+        so on_delivery callbacks and futures from produce() complete
+        without calling flush(). Use close() to stop the thread.
+    compression : str
+        Codec Kafka uses to compress batches of messages ('none', 'gzip',
+        'snappy', 'lz4' or 'zstd'). None leaves the producer default (no
+        compression). Not used when config is given
+    statistics_interval_ms : int
+        Interval at which librdkafka statistics are recorded (see
+        kafka_mdml_producer). None disables statistics
+    topic_metrics : bool
+        Record the per-topic message and byte counts (see
+        kafka_mdml_producer)
     """
     def __init__(self, topic, config=None,
-                kafka_host="merf.egs.anl.gov", kafka_port=9092):
+                kafka_host="merf.egs.anl.gov", kafka_port=9092,
+                background_poll=False, compression=None, statistics_interval_ms=None,
+                topic_metrics=True):
         # Checking topic param
         if type(topic) == str:
             if topic[0:5] != "mdml-":
@@ -772,10 +1402,18 @@ class kafka_mdml_producer_schemaless:
             producer_config = {
                 'bootstrap.servers': f'{kafka_host}:{kafka_port}'
             }
+            if compression is not None:
+                producer_config['compression.type'] = check_kafka_codec(compression)
         else:
-            producer_config = config
+            producer_config = dict(config)
+        if statistics_interval_ms is not None:
+            producer_config.update(_statistics_config(statistics_interval_ms))
+        self._messages, self._bytes = _message_metrics(self.topic, 'produced', topic_metrics)
         self.producer = Producer(producer_config)
-    def produce(self, data, key=None, partition=None):
+        self.poller = None
+        if background_poll:
+            self.poller = _delivery_poller(self.producer)
+    def produce(self, data, key=None, partition=None, headers=None, on_delivery=None, return_future=False):
         """
         Produce data to the supplied topic
 
@@ -787,16 +1425,100 @@ class kafka_mdml_producer_schemaless:
             Key of the message (used in determining a partition) - not required
         partition : int
             Partition used to save the message - not required
+        headers : list
+            List of (key, value) Kafka message headers - not required
+        on_delivery : callable
+            Function called as on_delivery(err, msg) when the message is
+            delivered or fails. Called from poll(), flush() or the 
+            background thread (see background_poll)
+        return_future : bool
+            If True, returns a concurrent.futures.Future that resolves to
+            the delivered message or raises a KafkaException
+
+        Returns
+        -------
+        concurrent.futures.Future or None
         """
-        if partition is None:
-            self.producer.produce(topic=self.topic, value=data, key=key)
-        else:
-            self.producer.produce(topic=self.topic, value=data, key=key, partition=partition)
+        future = None
+        if return_future:
+            future, on_delivery = _delivery_future(on_delivery)
+        kwargs = {}
+        if partition is not None:
+            kwargs['partition'] = partition
+        if headers is not None:
+            kwargs['headers'] = headers
+        if on_delivery is not None:
+            kwargs['on_delivery'] = on_delivery
+        self.producer.produce(topic=self.topic, value=data, key=key, **kwargs)
+        self._messages.inc()
+        if data is not None:
+            self._bytes.inc(len(data))
+        return future
+    def produce_file(self, fn, chunk_size, file_id=None, key=None, partition=None, compression=None):
+        """
+        Produce a file as raw binary chunks. File metadata is sent in the
+        message headers so the chunks skip base64 encoding and JSON 
+        serialization. Files are reassembled by 
+        kafka_mdml_consumer.consume_chunks.
+
+        Parameters
+        ----------
+        fn : str
+            Path to the file
+        chunk_size : int
+            Number of file bytes in each message
+        file_id : string
+            File ID to use in the chunking process if the fn param is not suitable
+        key : string
+            Key of the message (used in determining a partition) - not required
+        partition : int
+            Partition used to save the message - not required
+        compression : str
+            Codec used to compress each chunk (see chunk_file_binary)
+        """
+        kwargs = {'topic': self.topic, 'key': key}
+        if partition is not None:
+            kwargs['partition'] = partition
+        for chunk, headers in chunk_file_binary(fn, chunk_size, file_id, compression):
+            while True:
+                try:
+                    self.producer.produce(value=chunk, headers=headers, **kwargs)
+                    break
+                except BufferError:
+                    # Local queue is full - wait for messages to be delivered
+                    self.producer.poll(1)
+            self._messages.inc()
+            self._bytes.inc(len(chunk))
+            self.producer.poll(0)
+    def poll(self, timeout=0):
+        """
+        Serve delivery reports for messages that have been sent. Not
+        needed when background_poll is used.
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum time to wait for a delivery report
+
+        Returns
+        -------
+        int
+            Number of delivery reports served
+        """
+        return self.producer.poll(timeout)
     def flush(self):
         """
         Flush (send) any messages currently waiting in the producer.
         """
         self.producer.flush()
+    def close(self):
+        """
+        Flush the producer and stop the background delivery thread
+        """
+        self.producer.flush()
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
 
 class kafka_mdml_consumer_schemaless:
     """
@@ -813,10 +1535,21 @@ class kafka_mdml_consumer_schemaless:
         Host name of the kafka broker
     kafka_port : int
         Port used for the kafka broker
+    provision_topics : bool
+        Create topics that do not exist yet (see kafka_mdml_consumer).
+        False skips this step entirely for the fastest startup
+    statistics_interval_ms : int
+        Interval at which librdkafka statistics are recorded (see
+        kafka_mdml_consumer). None disables statistics
+    topic_metrics : bool
+        Record the per-topic message and byte counts (see
+        kafka_mdml_consumer)
 
     """
     def __init__(self, topics, group, 
-                kafka_host="merf.egs.anl.gov", kafka_port=9092):
+                kafka_host="merf.egs.anl.gov", kafka_port=9092,
+                provision_topics=True, statistics_interval_ms=None,
+                topic_metrics=True):
         self.topics = topics
         self.group = group
         self.kafka_host = kafka_host
@@ -832,19 +1565,8 @@ class kafka_mdml_consumer_schemaless:
         else:
             raise Exception("Error, topics parameter must be a list of strings.")
         # Topic creation is needed
-        AC = AdminClient({'bootstrap.servers': self.kafka_host})
-        for topic in topics:
-            res = AC.create_topics([NewTopic(topic, 10)])
-            res = res[topic]
-            if res.exception() is None:
-                print("Topic created since it did not exist yet.")
-                continue
-            else:
-                reason = res.exception().args[0].name()
-                if reason == "TOPIC_ALREADY_EXISTS":
-                    continue
-                else:
-                    print(f"ERROR creating topic {reason}") 
+        if provision_topics:
+            _provision_topics(f"{kafka_host}:{kafka_port}", topics)
 
         consumer_conf = {
             'bootstrap.servers': f"{kafka_host}:{kafka_port}",
@@ -852,9 +1574,13 @@ class kafka_mdml_consumer_schemaless:
             'auto.offset.reset': 'earliest',
             'allow.auto.create.topics': 'true' # prevents unknown topic error 
         }
+        if statistics_interval_ms is not None:
+            consumer_conf.update(_statistics_config(statistics_interval_ms, group=group))
         consumer = Consumer(consumer_conf)
         consumer.subscribe(topics)
         self.consumer = consumer
+        self._topic_metrics = {} # topic -> (messages, bytes)
+        self.topic_metrics = topic_metrics
 
     def consume(self, poll_timeout=1.0, overall_timeout=300.0, verbose=True):
         """
@@ -876,12 +1602,30 @@ class kafka_mdml_consumer_schemaless:
                     timeout += poll_timeout
                     continue # no messages within timeout - poll again 
                 timeout = 0.0
+                topic = msg.topic()
+                value = msg.value()
+                self._record(topic, value)
                 yield {
-                    'topic': msg.topic(),
-                    'value': msg.value()
+                    'topic': topic,
+                    'value': value
                 }
             except KeyboardInterrupt:
                 break
+
+    def _record(self, topic, value):
+        """
+        Records a received message in the per-topic metrics
+        """
+        if not self.topic_metrics:
+            return
+        metrics = self._topic_metrics.get(topic)
+        if metrics is None:
+            metrics = _message_metrics(topic, 'consumed')
+            self._topic_metrics[topic] = metrics
+        metrics[0].inc()
+        if value is not None:
+            metrics[1].inc(len(value))
+
     def close(self):
         """
         Closes down the consumer. Ensures that received 
@@ -889,10 +1633,129 @@ class kafka_mdml_consumer_schemaless:
         """
         self.consumer.close()
 
+def _s3_get_range(s3_client, bucket, object_name, etag, start, end, out, read_size, f=None):
+    """
+    Reads bytes [start, end) of an object into the writable memoryview
+    out, at most read_size bytes at a time. If a file is given, out is
+    a reusable buffer that is written to the file at the start offset
+    after each read.
+    """
+    kwargs = {}
+    if etag is not None:
+        # Fail instead of mixing parts of two versions of the object
+        kwargs['IfMatch'] = etag
+    body = s3_client.get_object(Bucket=bucket, Key=object_name,
+        Range=f"bytes={start}-{end-1}", **kwargs)['Body']
+    if f is not None:
+        f.seek(start)
+    readinto = getattr(body, 'readinto', None)
+    remaining = end - start
+    pos = 0
+    try:
+        while remaining > 0:
+            n = min(read_size, remaining)
+            view = out[pos:pos+n] if f is None else out[:n]
+            if readinto is not None:
+                n = readinto(view)
+            else:
+                chunk = body.read(len(view))
+                n = len(chunk)
+                view[:n] = chunk
+            if n == 0:
+                raise Exception(f"Error, download of {object_name} ended early.")
+            if f is not None:
+                f.write(view[:n])
+            else:
+                pos += n
+            remaining -= n
+    finally:
+        body.close()
+
+def _s3_map_parts(get_part, ranges, workers):
+    if len(ranges) <= 1 or workers <= 1:
+        for part in ranges:
+            get_part(part)
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+        for _ in executor.map(get_part, ranges):
+            pass
+
+def _s3_download(s3_client, bucket, object_name, head, save_filepath=None, buffer=None,
+                part_size=32*1024*1024, workers=8, buffer_size=1024*1024):
+    """
+    Downloads an object described by a head_object response as parallel
+    ranged GETs (see kafka_mdml_s3_client.consume).
+    """
+    size = head['ContentLength']
+    etag = head.get('ETag')
+    start_time = time.perf_counter()
+    ranges = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+    if save_filepath is not None:
+        # Parts are written into a temporary file that is renamed when complete
+        tmp_path = f"{save_filepath}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp_path, 'wb') as f:
+            f.truncate(size)
+        def get_part(part):
+            with open(tmp_path, 'r+b') as f:
+                _s3_get_range(s3_client, bucket, object_name, etag, part[0], part[1],
+                    memoryview(bytearray(buffer_size)), buffer_size, f)
+        try:
+            _s3_map_parts(get_part, ranges, workers)
+            os.replace(tmp_path, save_filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        _s3_record_transfer('download', bucket, size, start_time)
+        return None
+    if buffer is None:
+        out = memoryview(bytearray(size))
+    else:
+        out = memoryview(buffer).cast('B')
+        if out.readonly or len(out) < size:
+            raise Exception(f"Error, buffer must be writable and at least {size} bytes.")
+    _s3_map_parts(lambda part: _s3_get_range(s3_client, bucket, object_name, etag,
+        part[0], part[1], out[part[0]:part[1]], buffer_size), ranges, workers)
+    _s3_record_transfer('download', bucket, size, start_time)
+    if buffer is None:
+        return bytes(out)
+    return size
+
+def _s3_record_transfer(direction, bucket, size, start_time):
+    # direction is 'upload' or 'download'
+    default_metrics.inc(f'mdml_s3_{direction}ed_bytes_total', size, bucket=bucket)
+    default_metrics.observe(f'mdml_s3_{direction}_seconds', time.perf_counter() - start_time, bucket=bucket)
+
+class _s3_upload:
+    """
+    State of one file uploaded by a kafka_mdml_s3_client.
+    """
+    def __init__(self, filepath, obj_name, payload, progress):
+        self.filepath = filepath
+        self.obj_name = obj_name
+        self.payload = payload
+        self.progress = progress
+        self.size = os.path.getsize(filepath)
+        self.sent = 0
+        self.lock = threading.Lock()
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+        self.start = time.time()
+
+    def on_progress(self, n):
+        # Called by the boto3 transfer threads with the bytes sent since the last call
+        with self.lock:
+            self.sent += n
+            sent = self.sent
+        if self.progress is not None:
+            self.progress(self.obj_name, sent, self.size)
+
 class kafka_mdml_s3_client:
     """
     Creates an MDML producer for sending >1MB files to an s3 location. Simultaneously, the MDML sends 
     upload information along a Kafka topic to be received by a client that can retrieve the file. 
+    Files are uploaded by a pool of worker threads, each running a multipart
+    transfer with parallel parts, and the Kafka notification of a file is
+    only sent once its upload has completed.
     
     Parameters
     ----------
@@ -917,12 +1780,27 @@ class kafka_mdml_s3_client:
         sends a dictionary containing the time of upload and the location 
         for retrieval. If dict, value is used as the schema. If string, 
         value is used as a file path to a json file.
+    upload_workers : int
+        Number of files uploaded at the same time
+    max_inflight_bytes : int
+        Maximum number of bytes of files queued or uploading. upload()
+        blocks until there is room. A file larger than this is uploaded
+        on its own
+    transfer_kwargs : dict
+        Dictionary that is passed as kwargs to boto3.s3.transfer.TransferConfig,
+        e.g. multipart_threshold, multipart_chunksize and max_concurrency
+        (the number of parts of one file sent in parallel)
+    statistics_interval_ms : int
+        Interval at which librdkafka statistics of the notification
+        producer are recorded (see kafka_mdml_producer). None disables
+        statistics
     """
     def __init__(self, topic, 
                 s3_endpoint=None, s3_access_key=None, s3_secret_key=None,
                 kafka_host="merf.egs.anl.gov", kafka_port=9092,
                 schema_host="merf.egs.anl.gov", schema_port=8081,
-                schema=None):
+                schema=None, upload_workers=4, max_inflight_bytes=4*1024**3,
+                transfer_kwargs={}, statistics_interval_ms=None):
         # Checking topic param
         if type(topic) == str:
             if topic[0:5] != "mdml-":
@@ -964,6 +1842,8 @@ class kafka_mdml_s3_client:
         else:
             self.schema = schema 
         # Creating boto3 (s3) client connection
+        import boto3
+        from boto3.s3.transfer import TransferConfig
         try:
             session = boto3.session.Session()
             self.s3_client = session.client(
@@ -975,16 +1855,123 @@ class kafka_mdml_s3_client:
         except Exception as e:
             print("ERROR creating connection to the S3 endpoint!")
             print(e)
+        # Large parts keep the number of requests for multi-GB files low
+        transfer_config = {
+            'multipart_threshold': 64*1024*1024,
+            'multipart_chunksize': 64*1024*1024,
+            'max_concurrency': 8
+        }
+        transfer_config.update(transfer_kwargs)
+        self.transfer_config = TransferConfig(**transfer_config)
+        self.max_inflight_bytes = max_inflight_bytes
+        self._inflight_bytes = 0
+        self._inflight = threading.Condition()
+        self._pending = set()
+        self._closed = False
+        self.executor = ThreadPoolExecutor(max_workers=upload_workers)
         # Creating Kafka producer
         self.producer = kafka_mdml_producer(
-            topic, self.schema, 
-            self.kafka_host, self.kafka_port,
-            self.schema_host, self.schema_port
+            topic, schema=self.schema,
+            kafka_host=self.kafka_host, kafka_port=self.kafka_port,
+            schema_host=self.schema_host, schema_port=self.schema_port,
+            background_poll=True, statistics_interval_ms=statistics_interval_ms
         )
 
+    def _release(self, upload):
+        with self._inflight:
+            self._inflight_bytes -= upload.size
+            self._inflight.notify_all()
+
+    def _upload(self, upload):
+        start_time = time.perf_counter()
+        try:
+            self.s3_client.upload_file(upload.filepath, self.bucket, upload.obj_name,
+                Config=self.transfer_config, Callback=upload.on_progress)
+        except Exception as e:
+            upload.future.set_exception(e)
+            return
+        finally:
+            self._release(upload)
+        _s3_record_transfer('upload', self.bucket, upload.size, start_time)
+        def on_delivery(err, msg):
+            if err is not None:
+                upload.future.set_exception(Exception(f"Error delivering the notification of {upload.obj_name}: {err}"))
+            else:
+                upload.future.set_result({
+                    's3_bucket': self.bucket,
+                    's3_object_name': upload.obj_name,
+                    'bytes': upload.size,
+                    'seconds': time.time() - upload.start
+                })
+        payload = upload.payload
+        if payload is None:
+            payload = {
+                'time': time.time(),
+                's3_bucket': self.bucket,
+                's3_object_name': upload.obj_name
+            }
+        while True:
+            try:
+                self.producer.produce(payload, on_delivery=on_delivery)
+                return
+            except BufferError:
+                # Local producer queue is full - wait for deliveries
+                self.producer.poll(0.05)
+            except Exception as e:
+                upload.future.set_exception(e)
+                return
+
+    def upload(self, filepath, obj_name, payload=None, progress=None):
+        """
+        Queue a file to be uploaded to the S3 bucket. The notification is
+        produced on the Kafka topic after the upload completes. Blocks
+        while max_inflight_bytes are already queued or uploading.
+
+        Parameters
+        ----------
+        filepath : str
+            Path of the file to upload to the S3 bucket 
+        obj_name : str
+            Name to store the file under  
+        payload : dict
+            Payload for the message sent on the Kafka topic.
+            Only used when the default schema has been overridden.
+        progress : callable
+            Function called as progress(obj_name, bytes_sent, total_bytes)
+            as parts of the file are uploaded. Called from the upload threads
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to a dictionary with the bucket, object name, bytes
+            and seconds taken once the notification has been delivered.
+            Raises if the upload or the notification fails.
+        """
+        if self._closed:
+            raise Exception("Error, the S3 client has been closed.")
+        upload = _s3_upload(filepath, obj_name, payload, progress)
+        with self._inflight:
+            while self._inflight_bytes > 0 and self._inflight_bytes + upload.size > self.max_inflight_bytes:
+                self._inflight.wait()
+            self._inflight_bytes += upload.size
+        try:
+            self.executor.submit(self._upload, upload)
+        except Exception:
+            self._release(upload)
+            raise
+        with self._inflight:
+            self._pending.add(upload.future)
+        upload.future.add_done_callback(self._upload_done)
+        return upload.future
+
+    def _upload_done(self, future):
+        with self._inflight:
+            self._pending.discard(future)
+
     def produce(self, filepath, obj_name, payload=None):
         """
-        Produce data to supplied S3 endpoint and Kafka topic 
+        Produce data to supplied S3 endpoint and Kafka topic. Waits for
+        the upload and notification to complete (see upload)
 
         Parameters
         ----------
@@ -995,25 +1982,41 @@ class kafka_mdml_s3_client:
         payload : dict
             Payload for the message sent on the Kafka topic.
             Only used when the default schema has been overridden.
+
+        Returns
+        -------
+        dict
+            Bucket, object name, bytes and seconds taken
         """
-        # Default payload
-        if payload is None:
-            payload = {
-                'filepath': filepath,
-                'obj_name': obj_name
-            }
-        # Upload to s3
-        self.s3_client.upload_file(filepath, self.bucket, obj_name)
-        # Publish it
-        self.producer.produce({
-            'time': time.time(),
-            's3_bucket': self.bucket,
-            's3_object_name': obj_name
-        })
-    def consume(self, bucket, object_name, save_filepath):
+        return self.upload(filepath, obj_name, payload).result()
+
+    def flush(self):
         """
-        Gets a file from an S3 bucket. Can return the bytes of the file 
-        or save the file to a specified path.
+        Wait for all queued files to be uploaded and their notifications
+        to be delivered. Raises if any of them failed.
+        """
+        with self._inflight:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+        self.producer.flush()
+
+    def close(self):
+        """
+        Upload all queued files and stop the upload and delivery threads
+        """
+        self._closed = True
+        self.executor.shutdown(wait=True)
+        self.producer.close()
+
+    def consume(self, bucket, object_name, save_filepath=None, buffer=None,
+                part_size=32*1024*1024, workers=8, buffer_size=1024*1024):
+        """
+        Gets a file from an S3 bucket. Can return the bytes of the file,
+        save the file to a specified path or read it into a buffer.
+        Objects larger than part_size are downloaded as parallel ranged
+        GETs. Downloads to a file are streamed through a fixed buffer per
+        connection, so memory use does not grow with the object size.
 
         Parameters
         ----------
@@ -1024,14 +2027,30 @@ class kafka_mdml_s3_client:
         save_filepath : str
             Path in which to save the downloaded file. Using a value of None
             will return the bytes of the file instead of saving to a file
+        buffer : bytearray, memoryview or other writable buffer
+            If given (and save_filepath is None), the object is read
+            directly into the start of this buffer, which must be at least
+            as large as the object
+        part_size : int
+            Size of each ranged GET
+        workers : int
+            Maximum number of parts downloaded in parallel
+        buffer_size : int
+            Number of bytes read at a time by each connection (and the size
+            of its buffer when saving to a file)
+
+        Returns
+        -------
+        bytes, int or None
+            The bytes of the file if neither save_filepath nor buffer is
+            given, the number of bytes read into buffer, or None when the
+            file is saved
         """
         try:
-            resp = self.s3_client.get_object(Bucket=bucket, Key=object_name)
+            head = self.s3_client.head_object(Bucket=bucket, Key=object_name)
         except Exception as e:
             print("ERROR getting object!")
             print(e)
-        if save_filepath is None:
-            return resp['Body'].read()
-        else:
-            with open(save_filepath, 'wb') as f:
-                f.write(resp['Body'].read())
+            raise
+        return _s3_download(self.s3_client, bucket, object_name, head, save_filepath, buffer,
+            part_size, workers, buffer_size)
@@ -1,4 +1,10 @@
 from .MDML_client import *
+from .reassembly import chunk_reassembler
+from .columnar import columnar_buffer, schema_dtype
+from .validation import compile_validator, compiled_json_serializer
+from .compression import kafka_codecs, chunk_codecs, export_codecs
+from .metrics import metrics_registry, default_metrics, get_metrics, start_metrics_server
+from .latency import latency_histogram, latency_tracker, print_latency_report
 name = "MDML_Client"
 __version__ = "1.2.14"
 multipart_schema = {
@@ -43,3 +49,33 @@ stop_funcx_schema = {
     },
     "required": [ "stop" ]
 }
+from .file_sender import kafka_mdml_file_sender
+from .experiments import experiment_session
+from .experiment_data import experiment_data_store
+from .replay import replay_engine, read_experiment_file, read_experiment_topic
+from .s3_consumer import kafka_mdml_s3_consumer, s3_object_cache
+
+# Names from the schema registry client and the asyncio clients are
+# imported on first use to keep 'import mdml_client' fast. This defers
+# confluent_kafka.schema_registry and its HTTP dependencies, not asyncio
+# itself, which confluent_kafka imports anyway.
+_lazy_imports = {
+    'get_schema_registry_client': 'registry',
+    'configure_schema_registry_cache': 'registry',
+    'kafka_mdml_producer_async': 'aio',
+    'kafka_mdml_producer_schemaless_async': 'aio',
+    'kafka_mdml_consumer_async': 'aio',
+    'kafka_mdml_consumer_schemaless_async': 'aio',
+}
+
+def __getattr__(name):
+    module = _lazy_imports.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = getattr(import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_imports))
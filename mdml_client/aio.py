@@ -0,0 +1,241 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from confluent_kafka import KafkaException
+from .MDML_client import kafka_mdml_producer, kafka_mdml_producer_schemaless
+from .MDML_client import kafka_mdml_consumer, kafka_mdml_consumer_schemaless
+
+def _set_delivery(future, err, msg):
+    if future.done():
+        return
+    if err is not None:
+        future.set_exception(KafkaException(err))
+    else:
+        future.set_result(msg)
+
+class _async_producer:
+    """
+    Shared implementation of the asyncio producers. Messages are handed to
+    the underlying producer without leaving the event loop and delivery
+    reports are served by its background thread, which resolves the
+    asyncio future of each message.
+    """
+    def __init__(self, producer):
+        self.producer = producer
+        self._backlog = deque()
+        self._drain_task = None
+
+    def produce(self, data, key=None, partition=None, **kwargs):
+        """
+        Produce data to the supplied topic
+
+        Parameters
+        ----------
+        data : dict or str
+            Data to send (see the produce method of the underlying producer)
+        key : string
+            Key of the message (used in determining a partition) - not required
+        partition : int
+            Partition used to save the message - not required
+
+        Returns
+        -------
+        asyncio.Future
+            Resolves to the delivered message once Kafka acknowledges it.
+            Raises a KafkaException if delivery fails.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        def on_delivery(err, msg):
+            try:
+                loop.call_soon_threadsafe(_set_delivery, future, err, msg)
+            except RuntimeError:
+                pass # event loop has been closed
+        args = (data, key, partition, on_delivery, kwargs)
+        if self._backlog:
+            # Keep the order of messages waiting for queue space
+            self._backlog.append((future, args))
+        else:
+            try:
+                self._produce(*args)
+            except BufferError:
+                self._backlog.append((future, args))
+                self._drain_task = loop.create_task(self._drain())
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def _produce(self, data, key, partition, on_delivery, kwargs):
+        self.producer.produce(data, key=key, partition=partition, on_delivery=on_delivery, **kwargs)
+
+    async def _drain(self):
+        while self._backlog:
+            future, args = self._backlog[0]
+            try:
+                self._produce(*args)
+            except BufferError:
+                # Local producer queue is full - wait for deliveries
+                await asyncio.sleep(0.01)
+                continue
+            except Exception as e:
+                if not future.done(): # the caller may have cancelled it
+                    future.set_exception(e)
+            self._backlog.popleft()
+
+    async def flush(self):
+        """
+        Wait until all messages have been delivered
+        """
+        if self._drain_task is not None:
+            await self._drain_task
+        await asyncio.get_running_loop().run_in_executor(None, self.producer.flush)
+
+    async def close(self):
+        """
+        Deliver all messages and stop the background delivery thread
+        """
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(None, self.producer.close)
+
+class kafka_mdml_producer_async(_async_producer):
+    """
+    asyncio version of kafka_mdml_producer. produce() returns an awaitable
+    delivery result instead of blocking, so many messages can be in flight
+    from one event loop. Takes the same parameters as kafka_mdml_producer
+    (background_poll is always used).
+    """
+    def __init__(self, topic, schema=None, **kwargs):
+        kwargs['background_poll'] = True
+        super().__init__(kafka_mdml_producer(topic, schema=schema, **kwargs))
+
+class kafka_mdml_producer_schemaless_async(_async_producer):
+    """
+    asyncio version of kafka_mdml_producer_schemaless. produce() returns
+    an awaitable delivery result and also takes the headers parameter.
+    Takes the same parameters as kafka_mdml_producer_schemaless
+    (background_poll is always used).
+    """
+    def __init__(self, topic, **kwargs):
+        kwargs['background_poll'] = True
+        super().__init__(kafka_mdml_producer_schemaless(topic, **kwargs))
+
+# Returned by _value for messages that are not yielded
+_skip = object()
+
+class _async_consumer:
+    """
+    Shared implementation of the asyncio consumers. The underlying consumer
+    is created (schema lookups and topic provisioning) and messages are
+    fetched in batches on a thread owned by the consumer, so neither
+    blocks the event loop and fetching costs one thread hop per batch.
+    Errors creating the consumer are raised by consume() and close().
+    """
+    def __init__(self, create, batch_size):
+        self.consumer = None
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._created = self._executor.submit(create)
+
+    async def _consumer(self):
+        if self.consumer is None:
+            self.consumer = await asyncio.wrap_future(self._created)
+        return self.consumer
+
+    def _value(self, msg):
+        return msg.value()
+
+    async def consume(self, poll_timeout=1.0, overall_timeout=300.0, verbose=True):
+        """
+        Start consuming from the specified topics
+
+        Parameters
+        ----------
+        poll_timeout : float
+            Timeout to wait when consuming one batch of messages
+        overall_timeout : float
+            Timeout to wait until the consume generator is closed down.
+            This timeout is restarted every time a new message is received
+        verbose : bool
+            Print a message with notes when the consume loop starts
+
+        Yields
+        ------
+        dict
+            A dictionary containing the topic and value of a single message
+        """
+        consumer = await self._consumer()
+        if verbose:
+            if overall_timeout != -1:
+                print(f"Consumer loop will exit after {overall_timeout} seconds without receiving a message")
+            else:
+                print(f"Consumer loop will run indefinitely until it is cancelled")
+        loop = asyncio.get_running_loop()
+        timeout = 0.0
+        while timeout < overall_timeout or overall_timeout == -1:
+            msgs = await loop.run_in_executor(self._executor,
+                consumer.consumer.consume, self.batch_size, poll_timeout)
+            received = False
+            for msg in msgs:
+                if msg.error() is not None:
+                    continue # e.g. the topic hasn't been created - poll again
+                val = self._value(msg)
+                if val is _skip:
+                    continue
+                received = True
+                yield {
+                    'topic': msg.topic(),
+                    'value': val
+                }
+            if received:
+                timeout = 0.0
+            else:
+                timeout += poll_timeout
+
+    def __aiter__(self):
+        return self.consume(overall_timeout=-1, verbose=False)
+
+    async def close(self):
+        """
+        Closes down the consumer. Ensures that received
+        messages have been acknowledged by Kafka.
+        """
+        try:
+            consumer = await self._consumer()
+            await asyncio.get_running_loop().run_in_executor(self._executor, consumer.close)
+        finally:
+            self._executor.shutdown(wait=False)
+
+class kafka_mdml_consumer_async(_async_consumer):
+    """
+    asyncio version of kafka_mdml_consumer. consume() is an async
+    generator and the consumer itself can be used in an async for loop,
+    which consumes until the task is cancelled. Takes the same parameters
+    as kafka_mdml_consumer plus batch_size, the maximum number of messages
+    fetched at once.
+    """
+    def __init__(self, topics, group, batch_size=1000, **kwargs):
+        super().__init__(lambda: kafka_mdml_consumer(topics, group, **kwargs), batch_size)
+
+    def _value(self, msg):
+        val = self.consumer._deserialize(msg)
+        if val is None:
+            return _skip # placeholder sent before the topic was created
+        if self.consumer.latency is not None:
+            self.consumer.latency.record_message(msg, val.get('mdml_time'))
+        if not self.consumer.show_mdml_time:
+            val.pop('mdml_time', None)
+        return val
+
+class kafka_mdml_consumer_schemaless_async(_async_consumer):
+    """
+    asyncio version of kafka_mdml_consumer_schemaless. Takes the same
+    parameters as kafka_mdml_consumer_schemaless plus batch_size, the
+    maximum number of messages fetched at once.
+    """
+    def __init__(self, topics, group, batch_size=1000, **kwargs):
+        super().__init__(lambda: kafka_mdml_consumer_schemaless(topics, group, **kwargs), batch_size)
+
+    def _value(self, msg):
+        value = msg.value()
+        self.consumer._record(msg.topic(), value)
+        return value
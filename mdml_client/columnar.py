@@ -0,0 +1,166 @@
+import json
+
+# Column types used for each JSON schema type. Everything else (strings,
+# arrays and objects) is stored as Python objects.
+_schema_type_to_numpy = {
+    "number": "f8",
+    "integer": "i8",
+    "boolean": "?",
+}
+
+# Column types and fill values used in NumPy output for columns with
+# missing values, by dtype. Integers have no NaN so they become floats;
+# booleans become Python objects holding None.
+_missing_values = {
+    "f8": ("f8", float("nan")),
+    "i8": ("f8", float("nan")),
+    "b1": ("O", None),
+}
+
+def _numpy_type(stype):
+    # A list of types with one type besides "null" (e.g. ["number", "null"])
+    # uses the column type of that type; missing values are handled as
+    # for any other column
+    if isinstance(stype, list):
+        types = [t for t in stype if t != "null"]
+        if len(types) != 1:
+            return 'O'
+        stype = types[0]
+    if not isinstance(stype, str):
+        return 'O'
+    return _schema_type_to_numpy.get(stype, 'O')
+
+def schema_dtype(schema, show_mdml_time=True):
+    """
+    Creates a NumPy structured dtype with one field per property of a
+    schema (e.g. one made with create_schema). Numbers become float64,
+    integers int64, booleans bool and all other types Python objects.
+    A list of types such as ["number", "null"] is treated as its one
+    non-null type; lists with more types become Python objects.
+
+    Parameters
+    ----------
+    schema : dict or str
+        JSON schema of the records
+    show_mdml_time : bool
+        Add an 'mdml_time' float64 field if the schema does not have one
+
+    Returns
+    -------
+    numpy.dtype
+    """
+    import numpy as np
+    if isinstance(schema, str):
+        schema = json.loads(schema)
+    properties = schema.get('properties')
+    if not properties:
+        raise Exception("Error, columnar output requires a schema with properties.")
+    fields = []
+    for name, prop in properties.items():
+        stype = prop.get('type')
+        fields.append((name, _numpy_type(stype)))
+    if show_mdml_time and 'mdml_time' not in properties:
+        fields.append(('mdml_time', 'f8'))
+    return np.dtype(fields)
+
+class columnar_buffer:
+    """
+    Accumulates records of one schema into per-field columns, which are
+    converted into a NumPy structured array or an Arrow record batch in
+    one step instead of keeping one dictionary per record.
+    Missing values are nulls in Arrow output. In NumPy output missing
+    numbers are NaN; integer columns with missing values are returned
+    as float64 and boolean columns with missing values as objects
+    holding None. Properties that are not in the schema are dropped.
+
+    Parameters
+    ----------
+    schema : dict or str
+        JSON schema of the records
+    show_mdml_time : bool
+        Keep the 'mdml_time' value added by kafka_mdml_producer
+    """
+    def __init__(self, schema, show_mdml_time=True):
+        self.dtype = schema_dtype(schema, show_mdml_time)
+        self.names = self.dtype.names
+        self.columns = {name: [] for name in self.names}
+        self._appenders = [(name, self.columns[name].append) for name in self.names]
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record):
+        """
+        Add one record to the buffer
+
+        Parameters
+        ----------
+        record : dict
+            Decoded record
+        """
+        get = record.get
+        for name, append in self._appenders:
+            append(get(name))
+        self.count += 1
+
+    def clear(self):
+        """
+        Remove all records from the buffer
+        """
+        for column in self.columns.values():
+            column.clear()
+        self.count = 0
+
+    def to_numpy(self):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            Structured array with one row per record. Its dtype differs
+            from self.dtype for integer and boolean columns with missing
+            values (see columnar_buffer) and columns holding values that
+            do not match the schema type, which are returned as objects
+        """
+        import numpy as np
+        columns = []
+        for name in self.names:
+            column = self.columns[name]
+            kind = self.dtype[name].str[1:]
+            values = None
+            if kind in _missing_values and None in column:
+                kind, missing = _missing_values[kind]
+                column = [missing if v is None else v for v in column]
+            if kind != 'O':
+                try:
+                    values = np.asarray(column, dtype=kind)
+                except (TypeError, ValueError):
+                    pass # values that do not match the schema type
+            if values is None:
+                # Assign one by one so arrays are not broadcast into 2D
+                values = np.empty(self.count, dtype=object)
+                for i, v in enumerate(column):
+                    values[i] = v
+            columns.append(values)
+        arr = np.empty(self.count, dtype=[(name, values.dtype) for name, values in zip(self.names, columns)])
+        for name, values in zip(self.names, columns):
+            arr[name] = values
+        return arr
+
+    def to_arrow(self):
+        """
+        Returns
+        -------
+        pyarrow.RecordBatch
+            Record batch with one row per record. Requires pyarrow
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise Exception("Error, pyarrow must be installed for Arrow output (pip install mdml_client[columnar]).")
+        arrow_types = {'f8': pa.float64(), 'i8': pa.int64(), 'b1': pa.bool_()}
+        arrays = []
+        for name in self.names:
+            kind = self.dtype[name].str[1:]
+            arrays.append(pa.array(self.columns[name], type=arrow_types.get(kind)))
+        return pa.RecordBatch.from_arrays(arrays, names=list(self.names))
@@ -0,0 +1,141 @@
+import bz2
+import lzma
+import zlib
+
+# Codecs librdkafka applies to whole message batches ('compression.type')
+kafka_codecs = ("none", "gzip", "snappy", "lz4", "zstd")
+# Codecs for the payload of each chunk (see chunk_file and chunk_file_binary)
+chunk_codecs = ("zlib", "bz2", "lzma", "zstd", "lz4")
+# Codecs for exported experiment files (see upload_experiment_to_ADC)
+export_codecs = ("gzip", "bz2", "xz", "zstd")
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("Error, zstd compression requires the 'zstandard' package (pip install mdml_client[compression]).")
+    return zstandard
+
+def _lz4():
+    try:
+        import lz4.frame
+    except ImportError:
+        raise Exception("Error, lz4 compression requires the 'lz4' package (pip install mdml_client[compression]).")
+    return lz4.frame
+
+def check_kafka_codec(codec):
+    if codec not in kafka_codecs:
+        raise Exception(f"Error, compression must be one of {kafka_codecs}.")
+    return codec
+
+def compress(data, codec, level=None):
+    """
+    Compress one chunk payload
+
+    Parameters
+    ----------
+    data : bytes
+        Payload to compress
+    codec : str
+        One of chunk_codecs
+    level : int
+        Compression level. None uses the default of the codec
+
+    Returns
+    -------
+    bytes
+    """
+    if codec == "zlib":
+        return zlib.compress(data, -1 if level is None else level)
+    elif codec == "bz2":
+        return bz2.compress(data, 9 if level is None else level)
+    elif codec == "lzma":
+        return lzma.compress(data, preset=level)
+    elif codec == "zstd":
+        zstandard = _zstandard()
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    elif codec == "lz4":
+        return _lz4().compress(data, compression_level=0 if level is None else level)
+    raise Exception(f"Error, compression must be one of {chunk_codecs}.")
+
+def decompress(data, codec):
+    """
+    Decompress one chunk payload
+
+    Parameters
+    ----------
+    data : bytes
+        Compressed payload
+    codec : str
+        One of chunk_codecs
+
+    Returns
+    -------
+    bytes
+    """
+    if codec == "zlib":
+        return zlib.decompress(data)
+    elif codec == "bz2":
+        return bz2.decompress(data)
+    elif codec == "lzma":
+        return lzma.decompress(data)
+    elif codec == "zstd":
+        return _zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    elif codec == "lz4":
+        return _lz4().decompress(data)
+    raise Exception(f"Error, unsupported chunk compression '{codec}'.")
+
+def open_compressed(fn, codec):
+    """
+    Open a file for writing text through a streaming compressor
+
+    Parameters
+    ----------
+    fn : str
+        Path of the file
+    codec : str
+        One of export_codecs
+    """
+    if codec == "gzip":
+        import gzip
+        return gzip.open(fn, 'wt', encoding='utf-8')
+    elif codec == "bz2":
+        return bz2.open(fn, 'wt', encoding='utf-8')
+    elif codec == "xz":
+        return lzma.open(fn, 'wt', encoding='utf-8')
+    elif codec == "zstd":
+        return _zstandard().open(fn, 'wt', encoding='utf-8')
+    raise Exception(f"Error, unsupported compression '{codec}'.")
+
+def export_extension(codec):
+    return {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz", "zstd": ".zst"}[codec]
+
+# Magic numbers of the export codecs, used to read files of any of them
+_magic = (
+    (b'\x1f\x8b', "gzip"),
+    (b'BZh', "bz2"),
+    (b'\xfd7zXZ\x00', "xz"),
+    (b'(\xb5/\xfd', "zstd"),
+)
+magic_length = max(len(m) for m, _ in _magic)
+
+def sniff_decompressor(head):
+    """
+    Returns an incremental decompressor (with a decompress(bytes) method)
+    for data starting with head, or None if it is not compressed
+
+    Parameters
+    ----------
+    head : bytes
+        The first magic_length bytes of the data (or all of it if shorter)
+    """
+    for magic, codec in _magic:
+        if head.startswith(magic):
+            if codec == "gzip":
+                return zlib.decompressobj(wbits=31)
+            elif codec == "bz2":
+                return bz2.BZ2Decompressor()
+            elif codec == "xz":
+                return lzma.LZMADecompressor()
+            return _zstandard().ZstdDecompressor().decompressobj()
+    return None
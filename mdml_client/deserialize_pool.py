@@ -0,0 +1,41 @@
+from confluent_kafka.serialization import SerializationContext, MessageField
+from confluent_kafka.schema_registry.json_schema import JSONDeserializer
+
+# Deserializers of each worker process, by topic and schema
+_deserializers = {}
+
+def _deserialize_messages(schemas, messages, show_mdml_time=True):
+    """
+    Deserializes raw message values in a worker process of
+    kafka_mdml_consumer's deserialization pool.
+
+    Parameters
+    ----------
+    schemas : dict
+        Schema string of each topic in messages
+    messages : list(tuple)
+        (topic, value bytes) of each message, in the order they were consumed
+    show_mdml_time : bool
+        Keep the 'mdml_time' value added by kafka_mdml_producer
+
+    Returns
+    -------
+    list(dict)
+        A dictionary containing the topic and value of each message, in
+        the same order as messages
+    """
+    results = []
+    for topic, value in messages:
+        key = (topic, schemas[topic])
+        deserializer = _deserializers.get(key)
+        if deserializer is None:
+            deserializer = JSONDeserializer(schemas[topic])
+            _deserializers[key] = deserializer
+        val = deserializer(value, SerializationContext(topic, MessageField.VALUE))
+        if not show_mdml_time:
+            val.pop('mdml_time', None)
+        results.append({
+            'topic': topic,
+            'value': val
+        })
+    return results
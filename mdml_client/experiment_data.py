@@ -0,0 +1,335 @@
+import codecs
+import hashlib
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .compression import magic_length, sniff_decompressor
+
+MDML_STUDY_ID = "U3R1ZHlOb2RlOjMx" # ADC ID for MDML experiments Study
+
+# Samples of a study after a cursor, with only the fields the index needs
+_STUDY_SAMPLES = """
+    query ($id: ID!, $after: String) {
+        study(id: $id) {
+            samples(after: $after) { edges { cursor node { name url } } }
+        }
+    }
+"""
+
+_object_tokens = re.compile(r'[{}"]')
+_string_tokens = re.compile(r'["\\]')
+
+def _scan_object(text, state):
+    """
+    Continues scanning a JSON object through the next piece of its text.
+    state is [depth, in_string, escaped] at the start of text and is
+    updated, so each character is scanned once however the object is
+    split. Returns the offset in text after the end of the object, or
+    None if the object continues past text.
+    """
+    depth, in_string, escaped = state
+    pos = 1 if escaped else 0 # skip the character after a backslash
+    n = len(text)
+    escaped = False
+    while pos < n:
+        if in_string:
+            m = _string_tokens.search(text, pos)
+            if m is None:
+                break
+            pos = m.end()
+            if m.group() == '\\':
+                pos += 1
+                escaped = pos > n
+            else:
+                in_string = False
+            continue
+        m = _object_tokens.search(text, pos)
+        if m is None:
+            break
+        pos = m.end()
+        token = m.group()
+        if token == '"':
+            in_string = True
+        elif token == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+    state[:] = [depth, in_string, escaped]
+    return None
+
+def _iter_json_records(chunks):
+    """
+    Parses records from chunks of an experiment file as they arrive. The
+    file may be a JSON array or newline-delimited JSON and may be
+    compressed with any of the export codecs.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    decompress = None
+    head = b''
+    buf = ''
+    pending = None # pieces of a record that is not complete yet
+    state = None # scan state of the pending record
+    # An empty chunk marks the end so files shorter than a magic number are parsed
+    for chunk in itertools.chain(chunks, [b'']):
+        last = not chunk
+        if head is not None:
+            # Wait for enough bytes to check for a compression magic number
+            head += chunk
+            if len(head) < magic_length and not last:
+                continue
+            decompress = sniff_decompressor(head)
+            chunk, head = head, None
+        if decompress is not None and chunk:
+            chunk = decompress.decompress(chunk)
+        piece = text.decode(chunk)
+        if pending is not None:
+            # Only the new text of a long record is scanned for its end
+            pending.append(piece)
+            if _scan_object(piece, state) is None and not last:
+                continue
+            buf = ''.join(pending)
+            pending = None
+        else:
+            buf += piece
+        pos = 0
+        n = len(buf)
+        while True:
+            # Skip whitespace and the brackets and commas of a JSON array
+            while pos < n and buf[pos] in ' \t\r\n[,]':
+                pos += 1
+            if pos >= n:
+                break
+            try:
+                record, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Record is not complete yet
+                if buf[pos] == '{' and not last:
+                    rest = buf[pos:]
+                    state = [0, False, False]
+                    if _scan_object(rest, state) is not None:
+                        raise Exception("Error, experiment data contains an invalid record.")
+                    pending = [rest]
+                    pos = n
+                break
+            yield record
+        buf = buf[pos:]
+    if buf.strip(' \t\r\n[,]'):
+        raise Exception("Error, experiment data ended with an incomplete record.")
+
+class experiment_data_store:
+    """
+    Retrieves experiment data from the Argonne Data Cloud. Experiment IDs
+    are looked up in a local index that is only refreshed from the MDML
+    study, with the samples added since the last refresh, when an ID is
+    not found. Downloaded files are kept in a
+    content-addressed cache on disk (named by their SHA-256), so each
+    experiment is downloaded once. Downloads share a pooled HTTP session.
+
+    Parameters
+    ----------
+    ADC_TOKEN : str
+        ADC SDK access token
+    cache_dir : str
+        Directory for the index and downloaded files. None keeps the
+        index in memory and does not cache downloads
+    workers : int
+        Number of concurrent downloads used by get_many
+    """
+    def __init__(self, ADC_TOKEN, cache_dir=None, workers=8):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.ADC_TOKEN = ADC_TOKEN
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.RLock()
+        self.index = {} # experiment ID -> sample URL
+        self.downloads = {} # sample URL -> SHA-256 of the file
+        self.cursor = None # cursor of the last sample added to the index
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            try:
+                with open(self._index_path(), 'r') as f:
+                    saved = json.load(f)
+                self.index.update(saved.get('experiments', {}))
+                self.downloads.update(saved.get('downloads', {}))
+                self.cursor = saved.get('cursor')
+            except (OSError, ValueError):
+                pass
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, 'index.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, f'{digest}.data')
+
+    def _save(self):
+        if self.cache_dir is None:
+            return
+        tmp_path = f"{self._index_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'experiments': self.index, 'downloads': self.downloads, 'cursor': self.cursor}, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _fetch_samples(self, after=None):
+        """
+        Returns the (cursor, name, URL) of the samples of the MDML study
+        that come after a cursor (all samples for None)
+        """
+        from adc_sdk.client import ADCClient
+        from adc_sdk.queries import ADCQuery
+        client = ADCClient(self.ADC_TOKEN)
+        study = client._execute(ADCQuery(_STUDY_SAMPLES), {'id': MDML_STUDY_ID, 'after': after})
+        return [(edge['cursor'], edge['node']['name'], edge['node']['url'])
+            for edge in study['study']['samples']['edges']]
+
+    def refresh_index(self):
+        """
+        Add experiments that are not in the index yet from the MDML study.
+        Only the samples added since the last refresh are fetched.
+        """
+        with self._lock:
+            after = self.cursor
+        samples = self._fetch_samples(after)
+        prefix = "MDML experiment "
+        with self._lock:
+            for cursor, name, url in samples:
+                if name.startswith(prefix):
+                    self.index[name[len(prefix):]] = url
+            if samples and self.cursor == after:
+                self.cursor = samples[-1][0]
+            self._save()
+
+    def url(self, exp_id):
+        """
+        Returns the ADC URL of an experiment's sample
+
+        Parameters
+        ----------
+        exp_id : str
+            Experiment ID
+        """
+        with self._lock:
+            url = self.index.get(exp_id)
+        if url is None:
+            self.refresh_index()
+            with self._lock:
+                url = self.index.get(exp_id)
+        if url is None:
+            raise Exception("No experiment found with that ID.")
+        return url
+
+    def _cached_chunks(self, path, chunk_size=1024*1024):
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _download_chunks(self, url, chunk_size=1024*1024):
+        resp = self.session.get(url, verify=False, stream=True)
+        resp.raise_for_status()
+        if self.cache_dir is None:
+            yield from resp.iter_content(chunk_size)
+            return
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in resp.iter_content(chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    yield chunk
+            digest = digest.hexdigest()
+            os.replace(tmp_path, self._blob_path(digest))
+            with self._lock:
+                self.downloads[url] = digest
+                self._save()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def iter_records(self, exp_id):
+        """
+        Yield the data messages of an experiment while it downloads (or
+        from the cache if it has been downloaded before)
+
+        Parameters
+        ----------
+        exp_id : str
+            Experiment ID
+
+        Yields
+        ------
+        dict
+            One data message streamed during the experiment
+        """
+        url = self.url(exp_id)
+        with self._lock:
+            digest = self.downloads.get(url)
+        if digest is not None and os.path.exists(self._blob_path(digest)):
+            chunks = self._cached_chunks(self._blob_path(digest))
+        else:
+            chunks = self._download_chunks(url)
+        yield from _iter_json_records(chunks)
+
+    def get(self, exp_id):
+        """
+        Return the data streamed during an experiment
+
+        Parameters
+        ----------
+        exp_id : str
+            Experiment ID
+
+        Returns
+        -------
+        (url, data) : (str, list(dict))
+            Tuple containing the ADC URL to the sample and a list
+            containing the data messsages streamed during the experiment
+        """
+        data = list(self.iter_records(exp_id))
+        return (self.url(exp_id), data)
+
+    def get_many(self, exp_ids):
+        """
+        Return the data of several experiments, downloading them concurrently
+
+        Parameters
+        ----------
+        exp_ids : list(str)
+            Experiment IDs
+
+        Returns
+        -------
+        dict
+            (url, data) tuple of each experiment ID (see get)
+        """
+        # Look up all IDs first so the index is refreshed at most once
+        for exp_id in exp_ids:
+            self.url(exp_id)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(zip(exp_ids, executor.map(self.get, exp_ids)))
+
+# Stores used by get_experiment_data, by token and cache directory
+_stores = {}
+_stores_lock = threading.Lock()
+
+def _default_store(ADC_TOKEN, cache_dir=None):
+    with _stores_lock:
+        store = _stores.get((ADC_TOKEN, cache_dir))
+        if store is None:
+            store = experiment_data_store(ADC_TOKEN, cache_dir)
+            _stores[(ADC_TOKEN, cache_dir)] = store
+        return store
@@ -0,0 +1,242 @@
+import atexit
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import wait
+from .MDML_client import kafka_mdml_producer
+
+experiment_service_schema = {
+    "$schema": "http://merf.egs.anl.gov/mdml-experiment-service-schema#",
+    "title": "ExperimentServiceSchema",
+    "description": "Schema for Kafka MDML Experiments",
+    "type": "object",
+    "properties": {
+        "time": {
+            "description": "Sent timestamp",
+            "type": "number"
+        },
+        "experiment_id": {
+            "description": "A unique experiment ID",
+            "type": "string"
+        },
+        "topics": {
+            "description": "Topics under the experiment",
+            "type": "array",
+            "items": {
+                "type": "string"
+            },
+        },
+        "status": {
+            "description": "Experiment status",
+            "type": "string"
+        }
+    },
+    "required": [ "time", "experiment_id", "status" ]
+}
+
+replay_service_schema = {
+    "$schema": "http://merf.egs.anl.gov/mdml-replay-service-schema#",
+    "title": "ExperimentReplayServiceSchema",
+    "description": "Schema for Kafka MDML Experiment Replays",
+    "type": "object",
+    "properties": {
+        "time": {
+            "description": "Sent timestamp",
+            "type": "number"
+        },
+        "experiment_id": {
+            "description": "Argonne Data Cloud sample ID",
+            "type": "string"
+        },
+        "speed": {
+            "description": "Speed to replay at",
+            "type": "number"
+        }
+    },
+    "required": [ "time", "experiment_id", "speed" ]
+}
+
+class experiment_session:
+    """
+    Keeps the producers used to control the MDML experiment and replay
+    services open between calls. Commands are confirmed when Kafka
+    acknowledges delivery of the control message instead of after a fixed
+    sleep, and several commands can be pipelined by passing wait=False
+    and waiting on the returned futures (or calling flush).
+
+    Parameters
+    ----------
+    producer_kwargs : dict
+        Dictionary that is passed as kwargs to the underlying producers.
+        Parameter names should be the same as those in a kafka_mdml_producer.
+    timeout : float
+        Seconds to wait for a control message to be acknowledged
+    """
+    def __init__(self, producer_kwargs={}, timeout=30.0):
+        self.producer_kwargs = dict(producer_kwargs, background_poll=True)
+        self.timeout = timeout
+        self._producers = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _producer(self, topic, schema):
+        with self._lock:
+            producer = self._producers.get(topic)
+            if producer is None:
+                producer = kafka_mdml_producer(topic, schema=schema, **self.producer_kwargs)
+                self._producers[topic] = producer
+            return producer
+
+    def _send(self, topic, schema, data, wait):
+        future = self._producer(topic, schema).produce(data, return_future=True)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        if wait:
+            future.result(self.timeout)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def start(self, id, topics, wait=True):
+        """
+        Start an experiment with the MDML Experiment service
+        (see start_experiment).
+
+        Parameters
+        ----------
+        id : str
+            Unique ID for the experiment
+        topics : list(str)
+            Topics to consume from that make up the experiment
+        wait : bool
+            Wait until the start message is acknowledged by Kafka
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the delivered control message
+        """
+        future = self._send("mdml-experiment-service", experiment_service_schema, {
+            "time": time.time(),
+            "experiment_id": id,
+            "topics": topics,
+            "status": "on"
+        }, wait)
+        if wait:
+            print("Experiment started")
+        return future
+
+    def stop(self, id, wait=True):
+        """
+        Stop a previously started experiment (see stop_experiment).
+
+        Parameters
+        ----------
+        id : str
+            Unique ID for the experiment
+        wait : bool
+            Wait until the stop message is acknowledged by Kafka
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the delivered control message
+        """
+        future = self._send("mdml-experiment-service", experiment_service_schema, {
+            "time": time.time(),
+            "experiment_id": id,
+            "status": "off"
+        }, wait)
+        if wait:
+            print("Experiment stopped")
+        return future
+
+    def replay(self, experiment_id, speed=1, wait=True):
+        """
+        Ask the MDML replay service to replay an experiment
+        (see replay_experiment).
+
+        Parameters
+        ----------
+        experiment_id : str
+            Unique ID of the experiment to replay
+        speed : int
+            Speed multiplier used during the replay
+        wait : bool
+            Wait until the replay message is acknowledged by Kafka
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the delivered control message
+        """
+        return self._send("mdml-replay-service", replay_service_schema, {
+            "time": time.time(),
+            "experiment_id": experiment_id,
+            "speed": speed
+        }, wait)
+
+    def flush(self):
+        """
+        Wait until all control messages sent so far are acknowledged.
+        Raises if any of them could not be delivered.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        done, not_done = wait(pending, timeout=self.timeout)
+        if not_done:
+            raise Exception(f"Error, {len(not_done)} control messages were not acknowledged in time.")
+        for future in done:
+            future.result()
+
+    def close(self):
+        """
+        Deliver all control messages and close the producers
+        """
+        with self._lock:
+            producers = list(self._producers.values())
+            self._producers = {}
+        for producer in producers:
+            producer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Sessions used by start_experiment, stop_experiment and replay_experiment,
+# most recently used last. At most _max_sessions are kept open and all are
+# closed when the interpreter exits.
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+_max_sessions = 4
+
+def _default_session(producer_kwargs):
+    key = json.dumps(producer_kwargs, sort_keys=True, default=str)
+    evicted = []
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = experiment_session(producer_kwargs)
+            _sessions[key] = session
+            while len(_sessions) > _max_sessions:
+                evicted.append(_sessions.popitem(last=False)[1])
+        else:
+            _sessions.move_to_end(key)
+    for old in evicted:
+        old.close()
+    return session
+
+def _close_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+atexit.register(_close_sessions)
@@ -0,0 +1,170 @@
+import heapq
+import json
+import os
+import tempfile
+from .compression import export_codecs, export_extension, open_compressed
+
+export_formats = ("json", "ndjson")
+
+# Most run files open at once during a merge
+_max_fan_in = 64
+
+def _sort_run(lines):
+    try:
+        lines.sort(key=lambda line: line[0])
+    except TypeError:
+        types = sorted({type(t).__name__ for t, _ in lines})
+        raise Exception(f"Error, cannot sort records by time, times must all be numbers or all be strings (found {', '.join(types)}).")
+
+def _write_run(lines, tmp_dir):
+    _sort_run(lines)
+    f = tempfile.TemporaryFile(mode='w+', encoding='utf-8', dir=tmp_dir)
+    for t, line in lines:
+        # JSON keeps the type of the time and escapes any tabs in strings
+        f.write(f"{json.dumps(t)}\t{line}\n")
+    f.seek(0)
+    return f
+
+def _read_run(f):
+    for line in f:
+        t, line = line[:-1].split('\t', 1)
+        yield json.loads(t), line
+
+def _merge(runs):
+    try:
+        yield from heapq.merge(*[_read_run(f) for f in runs], key=lambda line: line[0])
+    except TypeError:
+        raise Exception("Error, cannot sort records by time, times must all be numbers or all be strings.")
+
+def _merge_runs(runs, tmp_dir):
+    # Merges consecutive groups of runs into new runs until at most
+    # _max_fan_in remain, which keeps the merge stable
+    while len(runs) > _max_fan_in:
+        merged = []
+        for i in range(0, len(runs), _max_fan_in):
+            group = runs[i:i + _max_fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            f = tempfile.TemporaryFile(mode='w+', encoding='utf-8', dir=tmp_dir)
+            merged.append(f)
+            for t, line in _merge(group):
+                f.write(f"{json.dumps(t)}\t{line}\n")
+            f.seek(0)
+            for g in group:
+                g.close()
+        runs[:] = merged
+
+def external_sort(records, max_memory_bytes=64*1024*1024, tmp_dir=None):
+    """
+    Sorts (time, line) pairs by time without holding them all in memory.
+    Pairs are collected into runs of up to max_memory_bytes, each run is
+    sorted and spilled to a temporary file, and the runs are merged, at
+    most _max_fan_in at a time. The sort is stable, so records with equal times keep their order. Times
+    must be all numbers or all strings (e.g. ISO 8601 times).
+
+    Parameters
+    ----------
+    records : iterable(tuple)
+        (time, line) pairs, where time is a number or string and line
+        is a string without newlines
+    max_memory_bytes : int
+        Approximate number of bytes of lines held in memory
+    tmp_dir : str
+        Directory for the temporary run files
+
+    Yields
+    ------
+    str
+        The lines in time order
+    """
+    runs = []
+    lines = []
+    size = 0
+    try:
+        for t, line in records:
+            lines.append((t, line))
+            size += len(line)
+            if size >= max_memory_bytes:
+                runs.append(_write_run(lines, tmp_dir))
+                lines = []
+                size = 0
+        if not runs:
+            # Everything fit in memory
+            _sort_run(lines)
+            for _, line in lines:
+                yield line
+            return
+        if lines:
+            runs.append(_write_run(lines, tmp_dir))
+            lines = []
+        _merge_runs(runs, tmp_dir)
+        for _, line in _merge(runs):
+            yield line
+    finally:
+        for f in runs:
+            f.close()
+
+def open_export(fn, compression=None):
+    """
+    Open a file for writing an export, compressing it if requested
+
+    Parameters
+    ----------
+    fn : str
+        Path of the file
+    compression : str
+        None or one of export_codecs ('gzip', 'bz2', 'xz' or 'zstd')
+
+    Returns
+    -------
+    file object opened for writing text
+    """
+    if compression is None:
+        return open(fn, 'w', encoding='utf-8')
+    elif compression in export_codecs:
+        return open_compressed(fn, compression)
+    raise Exception(f"Error, unsupported compression '{compression}'.")
+
+def write_export(lines, f, export_format="ndjson"):
+    """
+    Write JSON lines to a file as newline-delimited JSON or as one JSON
+    array, one line at a time
+
+    Parameters
+    ----------
+    lines : iterable(str)
+        JSON encoded records
+    f : file object
+        File opened for writing text
+    export_format : str
+        'ndjson' for one record per line or 'json' for a JSON array
+
+    Returns
+    -------
+    int
+        Number of records written
+    """
+    if export_format not in export_formats:
+        raise Exception(f"Error, export_format must be one of {export_formats}.")
+    count = 0
+    if export_format == "ndjson":
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+            count += 1
+    else:
+        f.write("[")
+        for line in lines:
+            if count:
+                f.write(", ")
+            f.write(line)
+            count += 1
+        f.write("]")
+    return count
+
+def export_suffix(export_format="ndjson", compression=None):
+    suffix = ".ndjson" if export_format == "ndjson" else ".json"
+    if compression is not None:
+        suffix += export_extension(compression)
+    return suffix
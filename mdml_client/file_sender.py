@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from .MDML_client import chunk_file, chunk_file_binary
+from .MDML_client import kafka_mdml_producer, kafka_mdml_producer_schemaless
+
+class _file_transfer:
+    """
+    Delivery state of one file sent by a kafka_mdml_file_sender.
+    """
+    def __init__(self, fn, file_id):
+        self.fn = fn
+        self.file_id = file_id
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+        self.lock = threading.Lock()
+        self.total_parts = None
+        self.delivered = 0
+        self.start = time.time()
+        self.size = None # set by the worker before the file is chunked
+
+    def resolve(self):
+        self.future.set_result({
+            'filename': self.file_id,
+            'parts': self.total_parts,
+            'bytes': self.size,
+            'seconds': time.time() - self.start
+        })
+
+    def set_total(self, total_parts):
+        with self.lock:
+            self.total_parts = total_parts
+            done = self.delivered == total_parts
+        if done:
+            self.resolve()
+
+    def on_delivery(self, err, msg):
+        with self.lock:
+            if self.future.done():
+                return
+            if err is not None:
+                self.future.set_exception(Exception(f"Error delivering part of {self.file_id}: {err}"))
+                return
+            self.delivered += 1
+            done = self.delivered == self.total_parts
+        if done:
+            self.resolve()
+
+class kafka_mdml_file_sender:
+    """
+    Sends many files concurrently as chunked messages. Files are chunked
+    and produced by a pool of worker threads while a background thread
+    serves delivery reports. Each file gets a future that resolves once
+    every one of its parts has been acknowledged by Kafka. Files are
+    reassembled with kafka_mdml_consumer.consume_chunks.
+
+    Parameters
+    ----------
+    topic : str
+        Topic to send under
+    chunk_size : int
+        Size of chunk to use (see chunk_file and chunk_file_binary)
+    workers : int
+        Number of threads chunking and producing files
+    binary : bool
+        True to send raw bytes with kafka_mdml_producer_schemaless.
+        False to send base64 chunks with kafka_mdml_producer
+    producer_kwargs : dict
+        Dictionary that is passed as kwargs to the underlying producer.
+        Parameter names should be the same as those in a kafka_mdml_producer
+        (or kafka_mdml_producer_schemaless if binary is True).
+    compression : str
+        Codec used to compress each chunk (see chunk_file and chunk_file_binary)
+    """
+    def __init__(self, topic, chunk_size=500000, workers=4, binary=False, producer_kwargs={},
+                compression=None):
+        self.chunk_size = chunk_size
+        self.binary = binary
+        self.compression = compression
+        producer_kwargs = dict(producer_kwargs, background_poll=True)
+        if binary:
+            self.producer = kafka_mdml_producer_schemaless(topic, **producer_kwargs)
+        else:
+            from . import multipart_schema
+            self.producer = kafka_mdml_producer(topic, schema=multipart_schema, **producer_kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = set()
+        self._jobs_lock = threading.Lock()
+        self._closed = False
+
+    def _produce(self, transfer, value, headers=None):
+        kwargs = {'on_delivery': transfer.on_delivery}
+        if headers is not None:
+            kwargs['headers'] = headers
+        while True:
+            try:
+                self.producer.produce(value, **kwargs)
+                return
+            except BufferError:
+                # Local producer queue is full - wait for deliveries
+                self.producer.poll(0.05)
+
+    def _send(self, transfer):
+        try:
+            # Read here as the file may be gone by the time the transfer
+            # is resolved on the delivery thread
+            transfer.size = os.path.getsize(transfer.fn)
+            if self.binary:
+                for chunk, headers in chunk_file_binary(transfer.fn, self.chunk_size, transfer.file_id, self.compression):
+                    if transfer.total_parts is None:
+                        transfer.set_total(int(dict(headers)['part'].split('.')[1]))
+                    self._produce(transfer, chunk, headers)
+            else:
+                for part in chunk_file(transfer.fn, self.chunk_size, file_id=transfer.file_id,
+                        compression=self.compression):
+                    if transfer.total_parts is None:
+                        transfer.set_total(int(part['part'].split('.')[1]))
+                    self._produce(transfer, part)
+            if transfer.total_parts is None:
+                transfer.set_total(0) # empty file
+        except Exception as e:
+            if not transfer.future.done():
+                transfer.future.set_exception(e)
+
+    def send(self, fn, file_id=None):
+        """
+        Queue a file to be sent
+
+        Parameters
+        ----------
+        fn : str
+            Path to the file
+        file_id : str
+            File ID to use in the chunking process if the fn param is not suitable
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to a dictionary with the filename, number of parts,
+            bytes and seconds taken once all parts are delivered. Raises
+            if any part fails to be delivered.
+        """
+        if self._closed:
+            raise Exception("Error, the file sender has been closed.")
+        if file_id is None:
+            file_id = fn
+        transfer = _file_transfer(fn, file_id)
+        job = self.executor.submit(self._send, transfer)
+        with self._jobs_lock:
+            self._jobs.add(job)
+        job.add_done_callback(self._job_done)
+        return transfer.future
+
+    def _job_done(self, job):
+        with self._jobs_lock:
+            self._jobs.discard(job)
+
+    def send_many(self, fns):
+        """
+        Queue multiple files to be sent
+
+        Parameters
+        ----------
+        fns : list(str)
+            Paths to the files
+
+        Returns
+        -------
+        list(concurrent.futures.Future)
+            One future per file (see send)
+        """
+        return [self.send(fn) for fn in fns]
+
+    def flush(self):
+        """
+        Wait for all queued files to be produced and delivered
+        """
+        with self._jobs_lock:
+            jobs = list(self._jobs)
+        wait(jobs)
+        self.producer.flush()
+
+    def close(self):
+        """
+        Send all queued files and stop the worker and delivery threads
+        """
+        self._closed = True
+        self.executor.shutdown(wait=True)
+        self.producer.close()
@@ -0,0 +1,274 @@
+import threading
+import time
+from array import array
+from .metrics import default_metrics
+
+# Stages of the path of a message that latencies are recorded for
+latency_stages = ("end_to_end", "produce", "consume")
+
+class latency_histogram:
+    """
+    Compact histogram of latencies in the style of HdrHistogram. Values
+    are recorded in microseconds into buckets that are linear within each
+    power of two, so percentiles are exact to within 1/2**(sub_bucket_bits-1)
+    of the value (under 1% by default) whatever the range. A histogram
+    covering a microsecond to an hour takes about 30 KB.
+
+    Parameters
+    ----------
+    max_seconds : float
+        Largest latency tracked. Larger values are recorded as max_seconds
+    sub_bucket_bits : int
+        Number of bits of precision of each bucket
+    """
+    def __init__(self, max_seconds=3600.0, sub_bucket_bits=8):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_value = int(max_seconds * 1e6)
+        self.reset()
+
+    def reset(self):
+        """
+        Remove all recorded values
+        """
+        self.counts = array('Q', bytes(8 * (self._index(self.max_value) + 1)))
+        self.count = 0
+        self.negative = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return (shift << (self.sub_bucket_bits - 1)) + (value >> shift)
+
+    def _highest_value(self, index):
+        # Largest value that falls in a bucket
+        half = 1 << (self.sub_bucket_bits - 1)
+        if index < 2 * half:
+            return index
+        shift = (index >> (self.sub_bucket_bits - 1)) - 1
+        return ((index - (shift << (self.sub_bucket_bits - 1)) + 1) << shift) - 1
+
+    def record(self, seconds):
+        """
+        Record one latency
+
+        Parameters
+        ----------
+        seconds : float
+            Latency in seconds. Negative values (from clocks that are out
+            of sync) are recorded as 0 and counted in negative
+        """
+        if seconds < 0:
+            self.negative += 1
+            value = 0
+        else:
+            value = min(int(seconds * 1e6), self.max_value)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Add the values recorded in another histogram with the same
+        max_seconds and sub_bucket_bits
+        """
+        if len(other.counts) != len(self.counts):
+            raise Exception("Error, histograms must have the same max_seconds and sub_bucket_bits.")
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.negative += other.negative
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, p):
+        """
+        Returns the latency in seconds below which p percent of the
+        recorded values fall, or None if nothing was recorded
+
+        Parameters
+        ----------
+        p : float
+            Percentile between 0 and 100
+        """
+        if self.count == 0:
+            return None
+        rank = max(1, int(p / 100 * self.count + 0.5))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self._highest_value(i), self.max) / 1e6
+        return self.max / 1e6
+
+    def summary(self):
+        """
+        Returns the count, negative count, min, mean, p50, p99, p999 and
+        max of the recorded latencies, in seconds
+        """
+        if self.count == 0:
+            return {'count': 0, 'negative': 0}
+        return {
+            'count': self.count,
+            'negative': self.negative,
+            'min': self.min / 1e6,
+            'mean': self.total / self.count / 1e6,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max / 1e6
+        }
+
+def print_latency_report(report):
+    """
+    Print a latency report (see latency_tracker.report) as a table
+    """
+    for topic, partitions in sorted(report.items()):
+        for partition, stages in sorted(partitions.items()):
+            for stage, s in stages.items():
+                if s['count'] == 0:
+                    continue
+                print(f"{topic}[{partition}] {stage:>10}: n={s['count']} p50={s['p50']*1e3:.2f}ms "
+                      f"p99={s['p99']*1e3:.2f}ms p999={s['p999']*1e3:.2f}ms max={s['max']*1e3:.2f}ms")
+
+class latency_tracker:
+    """
+    Records produce-to-consume latencies per topic and partition. Three
+    stages are tracked for each message:
+
+    * end_to_end: from the 'mdml_time' stamped by kafka_mdml_producer to
+      the time the message was received
+    * produce: from 'mdml_time' to the Kafka message timestamp. With the
+      default CreateTime timestamps this only covers serialization in the
+      producer; with LogAppendTime topics it covers producer batching,
+      the network and the broker
+    * consume: from the Kafka message timestamp to the time the message
+      was received (batching, broker and consumer lag with CreateTime)
+
+    Stages are skipped when mdml_time or the timestamp is missing.
+    Latencies that span two hosts depend on their clocks being in sync;
+    negative values are counted in each summary's 'negative' count.
+
+    Parameters
+    ----------
+    report_interval : float
+        Seconds between periodic reports. Each periodic report covers the
+        messages received since the previous one. None disables them
+    report : callable
+        Function called as report(latency report) for periodic reports.
+        Defaults to print_latency_report
+    max_seconds : float
+        Largest latency tracked (see latency_histogram)
+    """
+    def __init__(self, report_interval=None, report=None, max_seconds=3600.0):
+        self.report_interval = report_interval
+        self.report_fn = print_latency_report if report is None else report
+        self.max_seconds = max_seconds
+        self.histograms = {} # (topic, partition) -> {stage: latency_histogram}
+        self._lock = threading.Lock()
+        self._last_report = time.time()
+
+    def _histograms(self, topic, partition):
+        key = (topic, partition)
+        histograms = self.histograms.get(key)
+        if histograms is None:
+            histograms = {stage: latency_histogram(self.max_seconds) for stage in latency_stages}
+            self.histograms[key] = histograms
+        return histograms
+
+    def record(self, topic, partition, mdml_time, timestamp, received):
+        """
+        Record the latencies of one message
+
+        Parameters
+        ----------
+        topic : str
+            Topic of the message
+        partition : int
+            Partition of the message
+        mdml_time : float
+            'mdml_time' of the message value or None
+        timestamp : float
+            Kafka timestamp of the message in seconds or None
+        received : float
+            Time the message was received
+        """
+        with self._lock:
+            histograms = self._histograms(topic, partition)
+            if mdml_time is not None:
+                histograms['end_to_end'].record(received - mdml_time)
+                if timestamp is not None:
+                    histograms['produce'].record(timestamp - mdml_time)
+            if timestamp is not None:
+                histograms['consume'].record(received - timestamp)
+        if self.report_interval is not None and received - self._last_report >= self.report_interval:
+            self._last_report = received
+            self.report_fn(self.report(reset=True))
+
+    def record_message(self, msg, mdml_time, received=None):
+        """
+        Record the latencies of a confluent_kafka Message
+
+        Parameters
+        ----------
+        msg : confluent_kafka.Message
+            The consumed message
+        mdml_time : float
+            'mdml_time' of the message value or None
+        received : float
+            Time the message was received. None uses the current time
+        """
+        ts_type, ts = msg.timestamp()
+        self.record(msg.topic(), msg.partition(), mdml_time,
+            None if ts_type == 0 else ts / 1000, time.time() if received is None else received)
+
+    def report(self, reset=False):
+        """
+        Returns the latency percentiles of each topic, partition and stage
+        (see latency_histogram.summary). The p50, p99 and p999 are also
+        recorded in mdml_client.default_metrics as mdml_latency_seconds
+
+        Parameters
+        ----------
+        reset : bool
+            Start new histograms after the report
+
+        Returns
+        -------
+        dict
+            {topic: {partition: {stage: summary}}}
+        """
+        out = {}
+        with self._lock:
+            for (topic, partition), histograms in self.histograms.items():
+                stages = {stage: h.summary() for stage, h in histograms.items()}
+                out.setdefault(topic, {})[partition] = stages
+                if reset:
+                    for h in histograms.values():
+                        h.reset()
+        for topic, partitions in out.items():
+            for partition, stages in partitions.items():
+                for stage, s in stages.items():
+                    if s['count'] == 0:
+                        continue
+                    for quantile, key in (("0.5", 'p50'), ("0.99", 'p99'), ("0.999", 'p999')):
+                        default_metrics.set('mdml_latency_seconds', s[key], topic=topic,
+                            partition=str(partition), stage=stage, quantile=quantile)
+        return out
+
+    def reset(self):
+        """
+        Remove all recorded latencies
+        """
+        with self._lock:
+            self.histograms = {}
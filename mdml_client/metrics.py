@@ -0,0 +1,333 @@
+import json
+import threading
+import time
+
+# name -> (type, help) of the metrics recorded by the MDML client
+metric_types = {
+    'mdml_produced_messages_total': ('counter', "Messages serialized and queued for production"),
+    'mdml_produced_bytes_total': ('counter', "Bytes of message values queued for production"),
+    'mdml_serialize_seconds': ('summary', "Time spent serializing message values"),
+    'mdml_consumed_messages_total': ('counter', "Messages received by consumers"),
+    'mdml_consumed_bytes_total': ('counter', "Bytes of message values received by consumers"),
+    'mdml_deserialize_seconds': ('summary', "Time spent deserializing message values"),
+    'mdml_schema_lookups_total': ('counter', "Schema registry lookups by kind and cache result"),
+    'mdml_reassembly_parts_total': ('counter', "Chunks added to reassemblers"),
+    'mdml_reassembly_duplicate_parts_total': ('counter', "Chunks received more than once"),
+    'mdml_reassembly_files_completed_total': ('counter', "Files reassembled from chunks"),
+    'mdml_reassembly_files_discarded_total': ('counter', "Incomplete files discarded"),
+    'mdml_reassembly_incomplete_files': ('gauge', "Files with missing chunks"),
+    'mdml_reassembly_buffered_bytes': ('gauge', "Bytes of out-of-order chunks held in memory"),
+    'mdml_s3_uploaded_bytes_total': ('counter', "Bytes uploaded to S3"),
+    'mdml_s3_upload_seconds': ('summary', "Time spent uploading files to S3"),
+    'mdml_s3_downloaded_bytes_total': ('counter', "Bytes downloaded from S3"),
+    'mdml_s3_download_seconds': ('summary', "Time spent downloading objects from S3"),
+    'mdml_s3_cache_requests_total': ('counter', "S3 object cache lookups by result"),
+    'mdml_latency_seconds': ('gauge', "Produce-to-consume latency percentiles from the last latency report"),
+    'mdml_kafka_queue_messages': ('gauge', "Messages in the librdkafka queues of a client"),
+    'mdml_kafka_queue_bytes': ('gauge', "Bytes in the librdkafka queues of a client"),
+    'mdml_kafka_broker_rtt_seconds': ('gauge', "Average broker round trip time"),
+    'mdml_kafka_broker_rtt_p99_seconds': ('gauge', "99th percentile broker round trip time"),
+    'mdml_kafka_broker_outbuf_messages': ('gauge', "Messages waiting to be sent to a broker"),
+    'mdml_kafka_broker_waitresp_messages': ('gauge', "Messages waiting for a broker response"),
+    'mdml_kafka_partition_tx_messages': ('gauge', "Messages sent to a partition"),
+    'mdml_kafka_partition_tx_bytes': ('gauge', "Bytes sent to a partition"),
+    'mdml_kafka_partition_rx_messages': ('gauge', "Messages received from a partition"),
+    'mdml_kafka_partition_rx_bytes': ('gauge', "Bytes received from a partition"),
+    'mdml_kafka_partition_consumer_lag': ('gauge', "Messages between the committed and high watermark offsets"),
+}
+
+class _metric:
+    """
+    One time series (a metric name and set of labels)
+    """
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, value=1):
+        with self.lock:
+            self.value += value
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+class _null_metric:
+    """
+    Stands in for the per-topic metrics of a client created with
+    topic_metrics=False. Records nothing
+    """
+    __slots__ = ()
+
+    def inc(self, value=1):
+        pass
+
+    def observe(self, seconds, count=1):
+        pass
+
+_null = _null_metric()
+
+class _summary:
+    """
+    Count and sum of observed durations
+    """
+    __slots__ = ('count', 'sum', 'lock')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, count=1):
+        with self.lock:
+            self.count += count
+            self.sum += seconds
+
+class metrics_registry:
+    """
+    Collects the counters, gauges and summaries recorded by the MDML
+    client classes and the statistics reported by librdkafka. All
+    clients record to default_metrics; read it with get_metrics() or
+    serve it to Prometheus with start_metrics_server().
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {} # (name, labels) -> _metric or _summary
+        self._statistics = {} # librdkafka client name -> latest statistics
+
+    def _get(self, name, labels, cls):
+        key = (name, tuple(sorted(labels.items())))
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, cls())
+        return series
+
+    def metric(self, name, **labels):
+        """
+        Returns the counter or gauge for a name and labels. Keep the
+        returned object to record values on hot paths without lookups.
+        """
+        return self._get(name, labels, _metric)
+
+    def summary(self, name, **labels):
+        """
+        Returns the summary (count and sum of durations) for a name and labels
+        """
+        return self._get(name, labels, _summary)
+
+    def inc(self, name, value=1, **labels):
+        self.metric(name, **labels).inc(value)
+
+    def set(self, name, value, **labels):
+        self.metric(name, **labels).set(value)
+
+    def observe(self, name, seconds, **labels):
+        self.summary(name, **labels).observe(seconds)
+
+    def stats_cb(self, **labels):
+        """
+        Returns a callback for librdkafka's stats_cb config property that
+        records the statistics of a client
+        """
+        return lambda stats_json: self.record_statistics(stats_json, **labels)
+
+    def record_statistics(self, stats_json, **labels):
+        """
+        Record a librdkafka statistics report (see statistics.interval.ms)
+
+        Parameters
+        ----------
+        stats_json : str
+            JSON statistics passed to stats_cb
+        labels : str
+            Labels added to the recorded gauges
+        """
+        stats = json.loads(stats_json)
+        client = stats.get('name', 'unknown')
+        with self._lock:
+            self._statistics[client] = stats
+        labels = dict(labels, client=client)
+        self.set('mdml_kafka_queue_messages', stats.get('msg_cnt', 0), **labels)
+        self.set('mdml_kafka_queue_bytes', stats.get('msg_size', 0), **labels)
+        for broker in stats.get('brokers', {}).values():
+            if broker.get('nodeid', -1) < 0:
+                continue # bootstrap and coordinator connections
+            b = dict(labels, broker=broker['name'])
+            rtt = broker.get('rtt', {})
+            self.set('mdml_kafka_broker_rtt_seconds', rtt.get('avg', 0) / 1e6, **b)
+            self.set('mdml_kafka_broker_rtt_p99_seconds', rtt.get('p99', 0) / 1e6, **b)
+            self.set('mdml_kafka_broker_outbuf_messages', broker.get('outbuf_msg_cnt', 0), **b)
+            self.set('mdml_kafka_broker_waitresp_messages', broker.get('waitresp_msg_cnt', 0), **b)
+        producer = stats.get('type') == 'producer'
+        for topic, t in stats.get('topics', {}).items():
+            for partition, p in t.get('partitions', {}).items():
+                if partition == '-1':
+                    continue # messages not assigned to a partition yet
+                pl = dict(labels, topic=topic, partition=partition)
+                if producer:
+                    self.set('mdml_kafka_partition_tx_messages', p.get('txmsgs', 0), **pl)
+                    self.set('mdml_kafka_partition_tx_bytes', p.get('txbytes', 0), **pl)
+                    continue
+                self.set('mdml_kafka_partition_rx_messages', p.get('rxmsgs', 0), **pl)
+                self.set('mdml_kafka_partition_rx_bytes', p.get('rxbytes', 0), **pl)
+                if p.get('consumer_lag', -1) >= 0:
+                    self.set('mdml_kafka_partition_consumer_lag', p['consumer_lag'], **pl)
+
+    def statistics(self):
+        """
+        Returns the latest full librdkafka statistics of each client, by client name
+        """
+        with self._lock:
+            return dict(self._statistics)
+
+    def snapshot(self):
+        """
+        Returns the current value of every metric
+
+        Returns
+        -------
+        dict
+            Metric name -> list of {'labels': dict, 'value': number}.
+            Summaries appear as <name>_count and <name>_sum
+        """
+        with self._lock:
+            series = list(self._series.items())
+        out = {}
+        for (name, labels), s in sorted(series, key=lambda item: item[0]):
+            if isinstance(s, _summary):
+                out.setdefault(f"{name}_count", []).append({'labels': dict(labels), 'value': s.count})
+                out.setdefault(f"{name}_sum", []).append({'labels': dict(labels), 'value': s.sum})
+            else:
+                out.setdefault(name, []).append({'labels': dict(labels), 'value': s.value})
+        return out
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            series = list(self._series.items())
+        by_name = {}
+        for (name, labels), s in series:
+            by_name.setdefault(name, []).append((labels, s))
+        lines = []
+        for name in sorted(by_name):
+            kind, text = metric_types.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, s in sorted(by_name[name], key=lambda item: item[0]):
+                label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                label_str = "{" + label_str + "}" if label_str else ""
+                if isinstance(s, _summary):
+                    lines.append(f"{name}_count{label_str} {s.count}")
+                    lines.append(f"{name}_sum{label_str} {s.sum!r}")
+                else:
+                    lines.append(f"{name}{label_str} {s.value!r}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        Set every metric back to zero and forget the librdkafka statistics
+        """
+        with self._lock:
+            for s in self._series.values():
+                with s.lock:
+                    if isinstance(s, _summary):
+                        s.count = 0
+                        s.sum = 0.0
+                    else:
+                        s.value = 0
+            self._statistics = {}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+default_metrics = metrics_registry()
+
+def get_metrics():
+    """
+    Returns the current value of every metric recorded in this process
+    (see metrics_registry.snapshot)
+    """
+    return default_metrics.snapshot()
+
+def start_metrics_server(port=9464, host="0.0.0.0", registry=None):
+    """
+    Serve the metrics over HTTP in the Prometheus text format from a
+    background thread. Any path returns the metrics.
+
+    Parameters
+    ----------
+    port : int
+        Port to listen on. 0 picks a free port
+    host : str
+        Address to listen on
+    registry : metrics_registry
+        Registry to serve. None serves default_metrics
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer
+        The running server. Its server_address holds the port and
+        shutdown() stops it
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    if registry is None:
+        registry = default_metrics
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = registry.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _statistics_config(interval_ms, **labels):
+    """
+    librdkafka config properties that record statistics to default_metrics
+    every interval_ms milliseconds
+    """
+    return {
+        'statistics.interval.ms': interval_ms,
+        'stats_cb': default_metrics.stats_cb(**labels)
+    }
+
+def _message_metrics(topic, direction, enabled=True):
+    """
+    Returns the message and byte counters of a topic. direction is
+    'produced' or 'consumed'. Counters that record nothing are returned
+    when enabled is False
+    """
+    if not enabled:
+        return (_null, _null)
+    return (default_metrics.metric(f'mdml_{direction}_messages_total', topic=topic),
+            default_metrics.metric(f'mdml_{direction}_bytes_total', topic=topic))
+
+class _instrumented_serializer:
+    """
+    Wraps a value serializer to record serialization time, messages and
+    bytes for a topic.
+    """
+    def __init__(self, serializer, topic):
+        self.serializer = serializer
+        self.seconds = default_metrics.summary('mdml_serialize_seconds', topic=topic)
+        self.messages, self.bytes = _message_metrics(topic, 'produced')
+
+    def __call__(self, obj, ctx=None):
+        start = time.perf_counter()
+        data = self.serializer(obj, ctx)
+        self.seconds.observe(time.perf_counter() - start)
+        self.messages.inc()
+        if data is not None:
+            self.bytes.inc(len(data))
+        return data
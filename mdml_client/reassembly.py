@@ -0,0 +1,303 @@
+import os
+import tempfile
+import time
+from base64 import b64decode
+from collections import OrderedDict
+from .compression import decompress
+from .metrics import default_metrics
+
+def _parse_part(part, fn):
+    """
+    Returns (part, total parts) of a chunk's 'part' string ("N.M", with
+    1 <= N <= M)
+    """
+    try:
+        n, total = part.split('.')
+        if not (n.isdigit() and total.isdigit()):
+            raise ValueError
+        n, total = int(n), int(total)
+    except (AttributeError, ValueError):
+        raise Exception(f"Error, chunk part of {fn} must be 'N.M' with positive integers N and M, got {part!r}.")
+    if not 1 <= n <= total:
+        raise Exception(f"Error, chunk part of {fn} must be between 1 and the number of parts, got {part!r}.")
+    return n, total
+
+class _partial_file:
+    """
+    State of one file that is being reassembled from its chunks.
+    """
+    def __init__(self, fn, total_parts, encoding, save_dir):
+        self.fn = fn
+        self.total_parts = total_parts
+        self.encoding = encoding
+        self.time = None
+        self.received = 0
+        # One bit per part to track which parts have arrived
+        self.bitmap = bytearray((total_parts + 7) // 8)
+        # Parts are written at fixed offsets (stream=False) or appended
+        # in order (stream=True). None until enough parts are seen to decide.
+        self.stream = None
+        self.stride = None
+        self.next_part = 1
+        self.carry = b''
+        self.size = 0
+        # Parts that cannot be written yet, in memory or spilled to disk
+        self.pending = {}
+        self.spilled = {}
+        self.spill = None
+        fd, self.tmp_path = tempfile.mkstemp(
+            prefix=f'.{os.path.basename(fn)}.', suffix='.part', dir=save_dir)
+        self.out = os.fdopen(fd, 'w+b')
+        self.last_seen = time.monotonic()
+
+    def seen(self, part):
+        return self.bitmap[(part-1) >> 3] & (1 << ((part-1) & 7))
+
+    def mark(self, part):
+        self.bitmap[(part-1) >> 3] |= 1 << ((part-1) & 7)
+        self.received += 1
+
+    def close(self):
+        self.out.close()
+        if self.spill is not None:
+            self.spill.close()
+
+class chunk_reassembler:
+    """
+    Reassembles files from the chunks created by chunk_file and
+    chunk_file_binary. Parts may arrive in any order. Each part is
+    decoded when it arrives and written directly to its place in the
+    output file, so memory use does not grow with the size of the files.
+    Parts that cannot be placed yet are held in memory up to
+    max_buffer_bytes (across all files) and spilled to disk beyond that.
+
+    Parameters
+    ----------
+    save_dir : str
+        Directory to save the reassembled files in
+    max_buffer_bytes : int
+        Maximum number of bytes of parts that are held in memory
+    ttl : float
+        Seconds without receiving a part after which an incomplete file
+        is discarded. None disables the time limit
+    max_files : int
+        Maximum number of incomplete files. When exceeded, the least
+        recently updated file is discarded
+    """
+    def __init__(self, save_dir='.', max_buffer_bytes=64*1024*1024, ttl=3600.0, max_files=1000):
+        self.save_dir = save_dir
+        self.max_buffer_bytes = max_buffer_bytes
+        self.ttl = ttl
+        self.max_files = max_files
+        self.buffered_bytes = 0
+        self.files = OrderedDict()
+        self._parts = default_metrics.metric('mdml_reassembly_parts_total')
+        self._duplicates = default_metrics.metric('mdml_reassembly_duplicate_parts_total')
+        self._completed = default_metrics.metric('mdml_reassembly_files_completed_total')
+        self._discarded = default_metrics.metric('mdml_reassembly_files_discarded_total')
+        # Gauges are shared by all reassemblers, so each reports its changes
+        self._incomplete = default_metrics.metric('mdml_reassembly_incomplete_files')
+        self._buffered = default_metrics.metric('mdml_reassembly_buffered_bytes')
+        self._reported = (0, 0)
+
+    def add(self, value):
+        """
+        Add one chunk to the reassembler
+
+        Parameters
+        ----------
+        value : dict
+            Chunk message containing 'time', 'chunk', 'part', 'filename'
+            and 'encoding' (see mdml_client.multipart_schema), and
+            'compression' if the chunk payload is compressed
+
+        Returns
+        -------
+        tuple or None
+            (timestamp, filepath) once the last missing part of a file has
+            been added, where timestamp is the time the first part was sent.
+            None otherwise.
+        """
+        fn = value['filename']
+        part, total_parts = _parse_part(value['part'], fn)
+        compression = value.get('compression')
+        self._parts.inc()
+        state = self.files.get(fn)
+        if state is not None and state.total_parts != total_parts:
+            raise Exception(f"Error, part {value['part']} of {fn} does not match the {state.total_parts} parts of earlier chunks.")
+        if state is None:
+            # Compressed parts are decoded on arrival and placed as raw bytes
+            encoding = value['encoding'] if compression is None else 'binary'
+            state = _partial_file(fn, total_parts, encoding, self.save_dir)
+            self.files[fn] = state
+        else:
+            self.files.move_to_end(fn)
+            state.last_seen = time.monotonic()
+        if state.seen(part):
+            self._duplicates.inc()
+            return None # duplicate delivery
+        state.mark(part)
+        if part == 1:
+            state.time = value['time']
+        data = value['chunk']
+        if compression is not None:
+            if isinstance(data, str):
+                data = b64decode(data)
+            data = decompress(data, compression)
+        elif isinstance(data, str):
+            if state.encoding == 'base64':
+                data = data.encode('ascii')
+            else:
+                data = data.encode(state.encoding)
+        self._place(state, part, data)
+        if state.received == state.total_parts:
+            res = self._finish(fn, state)
+            self._completed.inc()
+            self._report()
+            return res
+        self.evict()
+        self._report()
+        return None
+
+    def evict(self):
+        """
+        Discard incomplete files that exceeded the ttl or max_files limits
+        """
+        now = time.monotonic()
+        while self.files:
+            fn, state = next(iter(self.files.items()))
+            expired = self.ttl is not None and now - state.last_seen > self.ttl
+            if len(self.files) > self.max_files or expired:
+                print(f"Discarding incomplete file {fn} ({state.received}/{state.total_parts} parts received)")
+                self.discard(fn)
+            else:
+                break
+
+    def discard(self, fn):
+        """
+        Discard an incomplete file and any parts held for it
+
+        Parameters
+        ----------
+        fn : str
+            Filename (or file ID) of the chunked file
+        """
+        state = self.files.pop(fn)
+        self.buffered_bytes -= sum(len(d) for d in state.pending.values())
+        state.close()
+        os.remove(state.tmp_path)
+        self._discarded.inc()
+        self._report()
+
+    def close(self):
+        """
+        Discard all incomplete files
+        """
+        for fn in list(self.files):
+            self.discard(fn)
+
+    def _report(self):
+        files, buffered = len(self.files), self.buffered_bytes
+        self._incomplete.inc(files - self._reported[0])
+        self._buffered.inc(buffered - self._reported[1])
+        self._reported = (files, buffered)
+
+    def _choose_mode(self, state, part, data):
+        if state.encoding not in ('base64', 'binary'):
+            state.stream = True
+        elif state.total_parts == 1:
+            state.stream = False
+            state.stride = 0
+        elif part != state.total_parts:
+            # All parts except the last have the same length
+            if state.encoding == 'binary':
+                state.stream = False
+                state.stride = len(data)
+            elif len(data) % 4 == 0:
+                state.stream = False
+                state.stride = len(data) // 4 * 3
+            else:
+                # Chunks that split base64 quanta must be decoded in order
+                state.stream = True
+        if state.stream is False:
+            state.out.truncate(state.stride * state.total_parts)
+
+    def _place(self, state, part, data):
+        if state.stream is None:
+            self._choose_mode(state, part, data)
+            if state.stream is None:
+                self._hold(state, part, data)
+                return
+            # Place anything held while the layout was unknown
+            if not state.stream:
+                for p in list(state.pending) + list(state.spilled):
+                    self._write_at(state, p, self._take(state, p))
+        if not state.stream:
+            self._write_at(state, part, data)
+        elif part != state.next_part:
+            self._hold(state, part, data)
+        else:
+            while data is not None:
+                self._append(state, data)
+                state.next_part += 1
+                data = self._take(state, state.next_part)
+
+    def _write_at(self, state, part, data):
+        if state.encoding == 'base64':
+            data = b64decode(data)
+        offset = (part-1) * state.stride
+        state.out.seek(offset)
+        state.out.write(data)
+        if part == state.total_parts:
+            state.size = offset + len(data)
+
+    def _append(self, state, data):
+        if state.encoding == 'base64':
+            data = state.carry + data
+            n = len(data) // 4 * 4
+            state.carry = data[n:]
+            data = b64decode(data[:n])
+        state.out.write(data)
+        state.size += len(data)
+
+    def _hold(self, state, part, data):
+        state.pending[part] = data
+        self.buffered_bytes += len(data)
+        if self.buffered_bytes <= self.max_buffer_bytes:
+            return
+        # Spill held parts to disk, least recently updated files first
+        for other in self.files.values():
+            if other.pending:
+                if other.spill is None:
+                    other.spill = tempfile.TemporaryFile(dir=self.save_dir)
+                other.spill.seek(0, os.SEEK_END)
+                for p, d in other.pending.items():
+                    other.spilled[p] = (other.spill.tell(), len(d))
+                    other.spill.write(d)
+                    self.buffered_bytes -= len(d)
+                other.pending = {}
+            if self.buffered_bytes <= self.max_buffer_bytes:
+                break
+
+    def _take(self, state, part):
+        if part in state.pending:
+            data = state.pending.pop(part)
+            self.buffered_bytes -= len(data)
+            return data
+        if part in state.spilled:
+            offset, length = state.spilled.pop(part)
+            state.spill.seek(offset)
+            return state.spill.read(length)
+        return None
+
+    def _finish(self, fn, state):
+        del self.files[fn]
+        if state.carry:
+            data = b64decode(state.carry)
+            state.out.write(data)
+            state.size += len(data)
+        state.out.truncate(state.size)
+        state.close()
+        path = os.path.join(self.save_dir, os.path.basename(fn))
+        os.replace(state.tmp_path, path)
+        return state.time, path
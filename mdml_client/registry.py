@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # Windows
+from confluent_kafka.schema_registry import SchemaRegistryClient, RegisteredSchema, Schema
+from .metrics import default_metrics
+
+_clients = {}
+_clients_lock = threading.Lock()
+_cache_config = {
+    'ttl': 300.0,
+    'path': None
+}
+
+def configure_schema_registry_cache(ttl=300.0, path=None):
+    """
+    Configure the schema cache used by all schema registry clients in
+    this process.
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds a looked up schema is reused before the registry is asked
+        again. None caches lookups for the lifetime of the process
+    path : str
+        Path of a JSON file used to persist schema IDs and schemas between
+        processes. Processes sharing the file merge their entries into it.
+        None keeps the cache in memory only
+    """
+    with _clients_lock:
+        _cache_config['ttl'] = ttl
+        _cache_config['path'] = path
+        for client in _clients.values():
+            client._configure(ttl, path)
+
+def get_schema_registry_client(url):
+    """
+    Returns the shared schema registry client for a URL, creating it on
+    first use. All producers, consumers and helper functions in this
+    process share one client (and its cache) per registry.
+
+    Parameters
+    ----------
+    url : str
+        URL of the schema registry, e.g. http://merf.egs.anl.gov:8081
+
+    Returns
+    -------
+    cached_schema_registry_client
+    """
+    with _clients_lock:
+        client = _clients.get(url)
+        if client is None:
+            client = cached_schema_registry_client({'url': url}, _cache_config['ttl'], _cache_config['path'])
+            _clients[url] = client
+        return client
+
+def _load_cache(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _merge_cache(path, saved):
+    """
+    Merge the entries of saved into the cache file at path. The newest
+    latest-version lookup of each subject is kept. Writers on the same
+    path are serialized with a lock file where flock is available.
+    """
+    lock = None
+    if fcntl is not None:
+        lock = open(f"{path}.lock", 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+        merged = _load_cache(path)
+        latest = merged.setdefault('latest', {})
+        for subject, d in saved['latest'].items():
+            if subject not in latest or latest[subject]['time'] <= d['time']:
+                latest[subject] = d
+        merged.setdefault('registered', {}).update(saved['registered'])
+        merged.setdefault('lookups', {}).update(saved['lookups'])
+        merged.setdefault('ids', {}).update(saved['ids'])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, path)
+    finally:
+        if lock is not None:
+            lock.close() # releases the flock
+
+def _registered_schema(subject, version, schema_id, schema):
+    try:
+        return RegisteredSchema(schema_id=schema_id, schema=schema, subject=subject, version=version)
+    except TypeError:
+        # Newer confluent_kafka versions also require a guid
+        return RegisteredSchema(schema_id=schema_id, schema=schema, subject=subject, version=version, guid=None)
+
+class cached_schema_registry_client(SchemaRegistryClient):
+    """
+    SchemaRegistryClient that caches latest-version lookups for a time to
+    live and can persist schema IDs and schemas to disk. Use
+    get_schema_registry_client to get the shared instance for a URL.
+
+    Parameters
+    ----------
+    conf : dict
+        SchemaRegistryClient config
+    ttl : float
+        Seconds a latest-version lookup is reused. None never expires
+    path : str
+        Path of a JSON file used to persist the cache. None disables it.
+        New entries are merged with the file on disk, so processes sharing
+        the path do not overwrite each other's entries
+    """
+    def __init__(self, conf, ttl=300.0, path=None):
+        super().__init__(conf)
+        self._cache_lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._cache_path = None
+        self._latest = {} # subject -> (time, RegisteredSchema)
+        self._registered = {} # subject\nschema_type\nschema_str -> schema ID
+        self._lookups = {} # subject\ndeleted\nschema_type\nschema_str -> [schema ID, version]
+        self._ids = {} # schema ID -> (schema_str, schema_type)
+        self._configure(ttl, path)
+
+    def _configure(self, ttl, path):
+        # Lookups in other threads keep working: the cache is updated in
+        # place under the cache lock, and entries loaded from a new path
+        # are added to the ones already in memory
+        with self._cache_lock:
+            self._cache_ttl = ttl
+            if path is None or path == self._cache_path:
+                self._cache_path = path
+                return
+            self._cache_path = path
+            saved = _load_cache(path)
+            for subject, d in saved.get('latest', {}).items():
+                schema = Schema(d['schema'], schema_type=d['schema_type'])
+                self._latest.setdefault(subject, (d['time'], _registered_schema(subject, d['version'], d['id'], schema)))
+            for key, schema_id in saved.get('registered', {}).items():
+                self._registered.setdefault(key, schema_id)
+            for key, value in saved.get('lookups', {}).items():
+                self._lookups.setdefault(key, value)
+            for schema_id, value in saved.get('ids', {}).items():
+                self._ids.setdefault(int(schema_id), tuple(value))
+
+    def _fresh(self, cached_time):
+        return self._cache_ttl is None or time.time() - cached_time < self._cache_ttl
+
+    def _snapshot(self):
+        return {
+            'latest': {subject: {
+                'time': t, 'id': reg.schema_id, 'version': reg.version,
+                'schema': reg.schema.schema_str, 'schema_type': reg.schema.schema_type
+            } for subject, (t, reg) in self._latest.items()},
+            'registered': dict(self._registered),
+            'lookups': dict(self._lookups),
+            'ids': {str(k): list(v) for k, v in self._ids.items()}
+        }
+
+    def _save(self):
+        """
+        Write the cache to disk after a miss. Misses recorded while a
+        write is in progress are written together by the writing thread,
+        and lookups are not blocked by the file I/O.
+        """
+        if self._cache_path is None:
+            return
+        with self._cache_lock:
+            self._dirty = True
+        while self._save_lock.acquire(blocking=False):
+            try:
+                while True:
+                    with self._cache_lock:
+                        if not self._dirty:
+                            break
+                        self._dirty = False
+                        saved = self._snapshot()
+                    _merge_cache(self._cache_path, saved)
+            finally:
+                self._save_lock.release()
+            with self._cache_lock:
+                if not self._dirty:
+                    return
+
+    def get_latest_version(self, subject_name, *args, **kwargs):
+        with self._cache_lock:
+            cached = self._latest.get(subject_name)
+            if cached is not None and self._fresh(cached[0]):
+                default_metrics.inc('mdml_schema_lookups_total', kind='latest', result='hit')
+                return cached[1]
+        default_metrics.inc('mdml_schema_lookups_total', kind='latest', result='miss')
+        registered = super().get_latest_version(subject_name, *args, **kwargs)
+        with self._cache_lock:
+            self._latest[subject_name] = (time.time(), registered)
+            self._ids[registered.schema_id] = (registered.schema.schema_str, registered.schema.schema_type)
+        self._save()
+        return registered
+
+    def register_schema_full_response(self, subject_name, schema, *args, **kwargs):
+        # register_schema and JSONSerializer (with auto.register.schemas)
+        # both register through this method
+        key = f"{subject_name}\n{schema.schema_type}\n{schema.schema_str}"
+        with self._cache_lock:
+            schema_id = self._registered.get(key)
+        if schema_id is not None:
+            default_metrics.inc('mdml_schema_lookups_total', kind='register', result='hit')
+            return _registered_schema(subject_name, None, schema_id, schema)
+        default_metrics.inc('mdml_schema_lookups_total', kind='register', result='miss')
+        registered = super().register_schema_full_response(subject_name, schema, *args, **kwargs)
+        with self._cache_lock:
+            self._registered[key] = registered.schema_id
+            self._ids[registered.schema_id] = (schema.schema_str, schema.schema_type)
+        self._save()
+        return registered
+
+    def lookup_schema(self, subject_name, schema, normalize_schemas=False, fmt=None, deleted=False):
+        # Used by JSONSerializer when auto.register.schemas is off
+        key = f"{subject_name}\n{deleted}\n{schema.schema_type}\n{schema.schema_str}"
+        with self._cache_lock:
+            cached = self._lookups.get(key) if fmt is None else None
+        if cached is not None:
+            default_metrics.inc('mdml_schema_lookups_total', kind='lookup', result='hit')
+            return _registered_schema(subject_name, cached[1], cached[0], schema)
+        default_metrics.inc('mdml_schema_lookups_total', kind='lookup', result='miss')
+        registered = super().lookup_schema(subject_name, schema, normalize_schemas=normalize_schemas,
+            fmt=fmt, deleted=deleted)
+        if fmt is None:
+            with self._cache_lock:
+                self._lookups[key] = [registered.schema_id, registered.version]
+                self._ids[registered.schema_id] = (schema.schema_str, schema.schema_type)
+            self._save()
+        return registered
+
+    def get_schema(self, schema_id, *args, **kwargs):
+        with self._cache_lock:
+            cached = self._ids.get(schema_id)
+        if cached is not None:
+            default_metrics.inc('mdml_schema_lookups_total', kind='id', result='hit')
+            return Schema(cached[0], schema_type=cached[1])
+        default_metrics.inc('mdml_schema_lookups_total', kind='id', result='miss')
+        schema = super().get_schema(schema_id, *args, **kwargs)
+        with self._cache_lock:
+            self._ids[schema_id] = (schema.schema_str, schema.schema_type)
+        self._save()
+        return schema
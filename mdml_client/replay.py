@@ -0,0 +1,290 @@
+import json
+import time
+import uuid
+from .MDML_client import kafka_mdml_producer
+from .experiment_data import _iter_json_records
+from .export import external_sort
+
+def _record_time(record):
+    if 'time' in record:
+        return record['time']
+    return record['value']['time']
+
+def read_experiment_file(fn, chunk_size=1024*1024):
+    """
+    Yield the records of an exported experiment file. The file may be a
+    JSON array or newline-delimited JSON and may be compressed with any
+    of the export codecs (see upload_experiment_to_ADC).
+
+    Parameters
+    ----------
+    fn : str
+        Path to the file
+    chunk_size : int
+        Number of bytes read at a time
+
+    Yields
+    ------
+    dict
+        Records containing the topic and value of each message
+    """
+    def chunks():
+        with open(fn, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    yield from _iter_json_records(chunks())
+
+def read_experiment_topic(experiment_id, start=None, end=None, max_memory_bytes=64*1024*1024,
+                kafka_host="merf.egs.anl.gov", kafka_port=9092, timeout=10.0):
+    """
+    Yield the records of an experiment's topic (mdml-experiment-<id>) in
+    time order. Records are read from all partitions without joining a
+    consumer group and sorted with an external merge sort.
+
+    Parameters
+    ----------
+    experiment_id : str
+        Experiment ID
+    start : float
+        Unix time of the first message to read. None reads from the
+        beginning of the topic
+    end : float
+        Unix time after which messages are not read. None reads up to
+        the end of the topic when this function is called
+    max_memory_bytes : int
+        Approximate number of bytes of messages held in memory while sorting
+    kafka_host : str
+        Host name of the kafka broker
+    kafka_port : int
+        Port used for the kafka broker
+    timeout : float
+        Seconds to wait for broker requests
+
+    Yields
+    ------
+    dict
+        Records containing the topic and value of each message
+    """
+    from confluent_kafka import Consumer, TopicPartition
+    topic = f"mdml-experiment-{experiment_id}"
+    consumer = Consumer({
+        'bootstrap.servers': f"{kafka_host}:{kafka_port}",
+        'group.id': f"mdml-replay-{uuid.uuid4()}",
+        'enable.auto.commit': False
+    })
+    try:
+        partitions = consumer.list_topics(topic, timeout=timeout).topics[topic].partitions
+        assignment = []
+        ends = {}
+        for p in partitions:
+            low, high = consumer.get_watermark_offsets(TopicPartition(topic, p), timeout=timeout)
+            ends[p] = high
+            assignment.append(TopicPartition(topic, p, low))
+        if start is not None:
+            assignment = consumer.offsets_for_times(
+                [TopicPartition(topic, tp.partition, int(start * 1000)) for tp in assignment], timeout=timeout)
+        if end is not None:
+            for tp in consumer.offsets_for_times(
+                    [TopicPartition(topic, p, int(end * 1000)) for p in partitions], timeout=timeout):
+                if tp.offset >= 0:
+                    ends[tp.partition] = tp.offset
+        # offsets_for_times returns -1 for partitions without later messages
+        assignment = [tp for tp in assignment if tp.offset != -1 and tp.offset < ends[tp.partition]]
+        def records():
+            remaining = {tp.partition for tp in assignment}
+            consumer.assign(assignment)
+            while remaining:
+                msgs = consumer.consume(1000, timeout)
+                if not msgs:
+                    print(f"Stopped reading {topic}, no messages received within {timeout} seconds")
+                    return
+                for msg in msgs:
+                    if msg.error() is not None or msg.partition() not in remaining:
+                        continue
+                    if msg.offset() < ends[msg.partition()]:
+                        record = json.loads(msg.value())
+                        yield _record_time(record), json.dumps(record)
+                    if msg.offset() >= ends[msg.partition()] - 1:
+                        remaining.discard(msg.partition())
+        for line in external_sort(records(), max_memory_bytes):
+            yield json.loads(line)
+    finally:
+        consumer.close()
+
+class replay_engine:
+    """
+    Replays experiment records down their original topics from the client.
+    Records are scheduled against a monotonic clock: each record is sent
+    when (record time - first record time) / speed has elapsed, and all
+    records that are due in the same tick are produced as one batch. With
+    speed=None records are sent as fast as possible.
+
+    Parameters
+    ----------
+    speed : float
+        Speed multiplier used during the replay. None for as fast as possible
+    producer_kwargs : dict
+        Dictionary that is passed as kwargs to the underlying producers.
+        Parameter names should be the same as those in a kafka_mdml_producer.
+        Schemas are looked up in the registry for each topic
+    tick : float
+        Seconds of records that are grouped into one batch
+    batch_size : int
+        Maximum number of records in one batch
+    verbose : bool
+        Print the achieved rate and scheduling lag after a replay
+    clock : callable
+        Monotonic clock returning seconds. Defaults to time.monotonic
+    sleep : callable
+        Function called with the seconds to wait until a batch is due.
+        Defaults to time.sleep
+    """
+    def __init__(self, speed=1, producer_kwargs={}, tick=0.005, batch_size=1000, verbose=True,
+                clock=None, sleep=None):
+        if speed is not None and speed <= 0:
+            raise Exception("Error, speed must be positive or None.")
+        self.speed = speed
+        self.producer_kwargs = producer_kwargs
+        self.tick = tick
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.clock = time.monotonic if clock is None else clock
+        self.sleep = time.sleep if sleep is None else sleep
+        self.producers = {}
+
+    def _producer(self, topic):
+        producer = self.producers.get(topic)
+        if producer is None:
+            producer = kafka_mdml_producer(topic, **self.producer_kwargs)
+            self.producers[topic] = producer
+        return producer
+
+    def _send(self, batch, failures):
+        by_topic = {}
+        for record in batch:
+            by_topic.setdefault(record['topic'], []).append(record['value'])
+        for topic, values in by_topic.items():
+            # Delivery failures are added to the list as reports are served
+            failures.append(self._producer(topic).produce_batch(values))
+
+    def replay(self, records):
+        """
+        Replay records in the order given
+
+        Parameters
+        ----------
+        records : iterable(dict)
+            Records containing the topic and value of each message, sorted
+            by time (see read_experiment_file and read_experiment_topic)
+
+        Returns
+        -------
+        dict
+            'records' sent, 'seconds' taken, achieved 'rate' in records
+            per second, 'mean_lag' and 'max_lag' in seconds behind
+            schedule, and the number of 'failures'
+        """
+        stats = {'records': 0, 'seconds': 0.0, 'rate': 0.0, 'mean_lag': 0.0, 'max_lag': 0.0, 'failures': 0}
+        total_lag = 0.0
+        failures = [] # failure lists returned by produce_batch
+        batch = []
+        batch_due = None
+        start = None
+        t0 = None
+        def flush_batch():
+            nonlocal total_lag
+            lag = max(0.0, self.clock() - batch_due) if batch_due is not None else 0.0
+            self._send(batch, failures)
+            total_lag += lag * len(batch)
+            stats['max_lag'] = max(stats['max_lag'], lag)
+            stats['records'] += len(batch)
+            batch.clear()
+        for record in records:
+            if start is None:
+                # The schedule starts when the first record is available
+                start = self.clock()
+            if self.speed is None:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    flush_batch()
+                continue
+            t = _record_time(record)
+            if t0 is None:
+                t0 = t
+            due = start + (t - t0) / self.speed
+            if batch and (due - batch_due >= self.tick or len(batch) >= self.batch_size):
+                flush_batch()
+            if not batch:
+                batch_due = due
+                wait = due - self.clock()
+                if wait > 0:
+                    self.sleep(wait)
+            batch.append(record)
+        if batch:
+            flush_batch()
+        for producer in self.producers.values():
+            producer.flush()
+        stats['failures'] = sum(len(f) for f in failures)
+        if start is not None:
+            stats['seconds'] = self.clock() - start
+        if stats['records']:
+            if stats['seconds'] > 0:
+                stats['rate'] = stats['records'] / stats['seconds']
+            stats['mean_lag'] = total_lag / stats['records']
+        if self.verbose:
+            print(f"Replayed {stats['records']} records in {stats['seconds']:.2f} s "
+                  f"({stats['rate']:.0f} records/s), mean lag {stats['mean_lag']*1000:.2f} ms, "
+                  f"max lag {stats['max_lag']*1000:.2f} ms, {stats['failures']} failures")
+        return stats
+
+    def replay_file(self, fn):
+        """
+        Replay an exported experiment file (see upload_experiment_to_ADC)
+
+        Parameters
+        ----------
+        fn : str
+            Path to the file
+
+        Returns
+        -------
+        dict
+            Replay statistics (see replay)
+        """
+        return self.replay(read_experiment_file(fn))
+
+    def replay_topic(self, experiment_id, start=None, end=None, kafka_host="merf.egs.anl.gov", kafka_port=9092):
+        """
+        Replay a time range of an experiment's topic (see read_experiment_topic)
+
+        Parameters
+        ----------
+        experiment_id : str
+            Experiment ID
+        start : float
+            Unix time of the first message to replay
+        end : float
+            Unix time after which messages are not replayed
+        kafka_host : str
+            Host name of the kafka broker
+        kafka_port : int
+            Port used for the kafka broker
+
+        Returns
+        -------
+        dict
+            Replay statistics (see replay)
+        """
+        return self.replay(read_experiment_topic(experiment_id, start, end,
+            kafka_host=kafka_host, kafka_port=kafka_port))
+
+    def close(self):
+        """
+        Deliver all replayed records and close the producers
+        """
+        for producer in self.producers.values():
+            producer.close()
+        self.producers = {}
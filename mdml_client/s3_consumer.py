@@ -0,0 +1,437 @@
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .MDML_client import kafka_mdml_consumer, _s3_download
+from .metrics import default_metrics
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # pins only protect files within this process
+
+class s3_object_cache:
+    """
+    Size-bounded cache of S3 objects on disk. Files are keyed by bucket,
+    object name and ETag, so a replaced object is never served from the
+    cache. When the cache grows past max_bytes the least recently used
+    files are removed. Several processes can share one directory: files
+    are added with an atomic rename, recency is kept in the file
+    modification times and a pinned file holds a shared flock that
+    eviction in any process respects. Where flock is not available
+    (Windows), pins only protect files from eviction by this process.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory holding the cached files
+    max_bytes : int
+        Maximum total size of the cached files
+    """
+    def __init__(self, cache_dir, max_bytes=10*1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pinned = {} # path -> [number of users, locked file]
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, bucket, object_name, etag):
+        """
+        Returns the path an object is cached under
+
+        Parameters
+        ----------
+        bucket : str
+            Name of the bucket the object is saved in
+        object_name : str
+            Name/key of the object
+        etag : str
+            ETag of the object
+        """
+        digest = hashlib.sha256(f"{bucket}/{object_name}/{etag}".encode('utf-8')).hexdigest()
+        # Keep the extension so applications can recognise the file type
+        return os.path.join(self.cache_dir, digest + os.path.splitext(object_name)[1])
+
+    def lookup(self, bucket, object_name, etag, pin=False):
+        """
+        Returns the cached path of an object or None if it is not cached.
+        A hit marks the file as recently used.
+
+        Parameters
+        ----------
+        bucket : str
+            Name of the bucket the object is saved in
+        object_name : str
+            Name/key of the object
+        etag : str
+            ETag of the object
+        pin : bool
+            Protect the file from eviction until unpin is called
+        """
+        path = self.path(bucket, object_name, etag)
+        with self._lock:
+            if pin:
+                try:
+                    self._pin(path)
+                except FileNotFoundError:
+                    return None
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                if pin:
+                    self._unpin(path)
+                return None
+        return path
+
+    def pin(self, path):
+        """
+        Protect a cached file from eviction until unpin is called
+
+        Parameters
+        ----------
+        path : str
+            Path of the cached file
+        """
+        with self._lock:
+            self._pin(path)
+
+    def _pin(self, path, f=None):
+        pinned = self._pinned.get(path)
+        if pinned is not None:
+            pinned[0] += 1
+            if f is not None:
+                f.close()
+            return
+        if f is None:
+            f = open(path, 'rb')
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            if os.fstat(f.fileno()).st_nlink == 0:
+                # Evicted by another process before the lock was taken
+                f.close()
+                raise FileNotFoundError(path)
+        self._pinned[path] = [1, f]
+
+    def _unpin(self, path):
+        pinned = self._pinned.get(path)
+        if pinned is None:
+            return
+        pinned[0] -= 1
+        if pinned[0] == 0:
+            del self._pinned[path]
+            pinned[1].close() # releases the flock
+
+    def store(self, bucket, object_name, etag, download, pin=False):
+        """
+        Adds an object to the cache and evicts old files if needed
+
+        Parameters
+        ----------
+        bucket : str
+            Name of the bucket the object is saved in
+        object_name : str
+            Name/key of the object
+        etag : str
+            ETag of the object
+        download : callable
+            Function called as download(path) that writes the object to path
+        pin : bool
+            Protect the file from eviction until unpin is called
+
+        Returns
+        -------
+        str
+            Path of the cached file
+        """
+        path = self.path(bucket, object_name, etag)
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            download(tmp_path)
+            with self._lock:
+                f = None
+                if pin:
+                    # Lock the file before it becomes visible to other processes
+                    f = open(tmp_path, 'rb')
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_SH)
+                os.replace(tmp_path, path)
+                if f is not None:
+                    self._pin(path, f)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return path
+
+    def unpin(self, path):
+        """
+        Allow a file returned with pin=True to be evicted again
+
+        Parameters
+        ----------
+        path : str
+            Path of the cached file
+        """
+        with self._lock:
+            self._unpin(path)
+
+    def size(self):
+        """
+        Returns the total size of the cached files
+        """
+        return sum(entry[2] for entry in self._entries())
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.part') or not entry.is_file():
+                    continue # download in progress
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue # evicted by another process
+                entries.append((st.st_mtime, entry.path, st.st_size))
+        return entries
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache fits in max_bytes.
+        Files pinned by any process are kept.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(entry[2] for entry in entries)
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if path in self._pinned or not self._remove_unpinned(path):
+                    continue
+                total -= size
+
+    def _remove_unpinned(self, path):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return True # evicted by another process
+        with f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False # pinned by another process
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+class kafka_mdml_s3_consumer:
+    """
+    Consumes the upload notifications sent by a kafka_mdml_s3_client and
+    prefetches the referenced objects into an s3_object_cache. Up to
+    prefetch notifications are read ahead of the application and their
+    objects are downloaded concurrently while the application processes
+    earlier ones. Objects already in the cache (including those fetched
+    by other processes sharing cache_dir) are not downloaded again.
+
+    Parameters
+    ----------
+    topic : str
+        Notification topic to consume from
+    group : str
+        Consumer group ID
+    cache_dir : str
+        Directory of the object cache
+    max_cache_bytes : int
+        Maximum total size of the cached files
+    s3_endpoint : str
+        Host of the S3 service
+    s3_access_key : str
+        S3 access key
+    s3_secret_key : str
+        S3 secret key
+    prefetch : int
+        Maximum number of notifications read ahead of the application
+    workers : int
+        Number of objects downloaded at the same time
+    download_kwargs : dict
+        Dictionary that is passed as kwargs to the downloads. Parameter
+        names should be the same as those in kafka_mdml_s3_client.consume
+        (part_size, workers and buffer_size)
+    consumer_kwargs : dict
+        Dictionary that is passed as kwargs to the underlying consumer.
+        Parameter names should be the same as those in a kafka_mdml_consumer.
+    """
+    def __init__(self, topic, group, cache_dir, max_cache_bytes=10*1024**3,
+                s3_endpoint=None, s3_access_key=None, s3_secret_key=None,
+                prefetch=16, workers=4, download_kwargs={}, consumer_kwargs={}):
+        import boto3
+        self.cache = s3_object_cache(cache_dir, max_cache_bytes)
+        session = boto3.session.Session()
+        self.s3_client = session.client(
+            service_name='s3',
+            aws_access_key_id=s3_access_key,
+            aws_secret_access_key=s3_secret_key,
+            endpoint_url=s3_endpoint
+        )
+        self.download_kwargs = download_kwargs
+        self.consumer = kafka_mdml_consumer([topic], group, **consumer_kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._ready = queue.Queue(maxsize=prefetch)
+        self._inflight = {} # (bucket, object name) -> future
+        self._inflight_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._fetcher = None
+        self._poll_timeout = 1.0
+
+    def _fetch(self, bucket, object_name):
+        head = self.s3_client.head_object(Bucket=bucket, Key=object_name)
+        etag = head.get('ETag')
+        path = self.cache.lookup(bucket, object_name, etag, pin=True)
+        default_metrics.inc('mdml_s3_cache_requests_total', result='miss' if path is None else 'hit')
+        if path is None:
+            path = self.cache.store(bucket, object_name, etag,
+                lambda tmp_path: _s3_download(self.s3_client, bucket, object_name, head,
+                    tmp_path, **self.download_kwargs), pin=True)
+        return path
+
+    def _prefetch(self, bucket, object_name):
+        """
+        Returns (future, shared). Notifications for an object that is still
+        downloading share the download; only the first one is pinned by
+        the download, the others are pinned when they are consumed.
+        """
+        key = (bucket, object_name)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, True
+            future = self.executor.submit(self._fetch, bucket, object_name)
+            self._inflight[key] = future
+        # Registered outside the lock: a finished future runs it right away
+        future.add_done_callback(lambda f: self._fetched(key, f))
+        return future, False
+
+    def _fetched(self, key, future):
+        with self._inflight_lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _read_notifications(self):
+        try:
+            while not self._stop.is_set():
+                msg = self.consumer.consumer.poll(self._poll_timeout)
+                if msg is None:
+                    continue
+                val = self.consumer._deserialize(msg)
+                if val is None:
+                    continue # default message from broker the topic hasn't been created
+                if 's3_bucket' not in val or 's3_object_name' not in val:
+                    raise Exception(f"Error, notification on {msg.topic()} has no s3_bucket and s3_object_name.")
+                future, shared = self._prefetch(val['s3_bucket'], val['s3_object_name'])
+                self._put({'topic': msg.topic(), 'value': val, 'future': future, 'shared': shared})
+        except Exception as e:
+            # Stop reading and raise the error from consume()
+            self._put({'error': e})
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                # Blocks while prefetch notifications are waiting for the application
+                self._ready.put(item, timeout=self._poll_timeout)
+                return
+            except queue.Full:
+                pass
+
+    def consume(self, poll_timeout=1.0, overall_timeout=300.0, verbose=True):
+        """
+        Start consuming notifications and yield the objects as they become
+        available on disk, in the order of the notifications. A path stays
+        in the cache at least until the next object is requested; copy or
+        hard link the file to keep it longer.
+
+        Parameters
+        ----------
+        poll_timeout : float
+            Timeout to wait when consuming one message
+        overall_timeout : float
+            Timeout to wait until the consume generator is closed down.
+            This timeout is restarted every time a new notification is
+            received. -1 runs until Ctrl+C
+        verbose : bool
+            Print a message with notes when the consume loop starts
+
+        Yields
+        ------
+        dict
+            A dictionary containing the topic, the value of the
+            notification and the local path of the object. Raises if an
+            object could not be downloaded or a notification could not be
+            read
+        """
+        if verbose:
+            if overall_timeout != -1:
+                print(f"Consumer loop will exit after {overall_timeout} seconds without receiving a message or with Ctrl+C")
+            else:
+                print(f"Consumer loop will run indefinitely until a Ctrl+C")
+        self._poll_timeout = poll_timeout
+        if self._fetcher is None:
+            self._fetcher = threading.Thread(target=self._read_notifications, daemon=True)
+            self._fetcher.start()
+        last = time.monotonic()
+        previous = None
+        try:
+            while overall_timeout == -1 or time.monotonic() - last < overall_timeout:
+                try:
+                    item = self._ready.get(timeout=poll_timeout)
+                except queue.Empty:
+                    continue
+                except KeyboardInterrupt:
+                    break
+                if 'error' in item:
+                    raise item['error']
+                path = item['future'].result()
+                if item['shared']:
+                    # Each notification holds its own pin on the file
+                    try:
+                        self.cache.pin(path)
+                    except FileNotFoundError:
+                        # Evicted since the shared download finished
+                        val = item['value']
+                        path = self._fetch(val['s3_bucket'], val['s3_object_name'])
+                if previous is not None:
+                    self.cache.unpin(previous)
+                previous = path
+                last = time.monotonic()
+                yield {
+                    'topic': item['topic'],
+                    'value': item['value'],
+                    'path': path
+                }
+        finally:
+            if previous is not None:
+                self.cache.unpin(previous)
+
+    def close(self):
+        """
+        Stop prefetching, release the objects that were prefetched but not
+        consumed and close the consumer
+        """
+        self._stop.set()
+        if self._fetcher is not None:
+            self._fetcher.join()
+        self.executor.shutdown(wait=True)
+        # Release the pins of objects prefetched but never consumed
+        while True:
+            try:
+                item = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            future = item.get('future')
+            if future is not None and not item['shared'] and future.exception() is None:
+                self.cache.unpin(future.result())
+        self.consumer.close()
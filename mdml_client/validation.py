@@ -0,0 +1,206 @@
+import json
+import struct
+import warnings
+from confluent_kafka.serialization import SerializationError
+
+validation_policies = ("always", "every", "first", "off")
+
+# Keywords that do not affect validation
+_annotations = {"$schema", "$id", "title", "description", "default", "examples", "$comment"}
+
+_type_checks = {
+    "string": lambda v: isinstance(v, str),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "integer": lambda v: (isinstance(v, int) and not isinstance(v, bool)) or (isinstance(v, float) and v.is_integer()),
+    "boolean": lambda v: isinstance(v, bool),
+    "array": lambda v: isinstance(v, list),
+    "object": lambda v: isinstance(v, dict),
+    "null": lambda v: v is None,
+}
+
+class _unsupported(Exception):
+    pass
+
+def _compile_node(schema):
+    """
+    Compiles one level of a schema into a function that returns an error
+    message or None. Raises _unsupported for keywords it does not handle.
+    """
+    unknown = set(schema) - _annotations - {"type", "properties", "required", "items", "additionalProperties"}
+    if unknown:
+        raise _unsupported(unknown)
+    checks = []
+    stype = schema.get("type")
+    if stype is not None:
+        types = stype if isinstance(stype, list) else [stype]
+        if any(t not in _type_checks for t in types):
+            raise _unsupported(stype)
+        funcs = [_type_checks[t] for t in types]
+        def check_type(v, funcs=funcs, stype=stype):
+            for f in funcs:
+                if f(v):
+                    return None
+            return f"{v!r} is not of type {stype!r}"
+        checks.append(check_type)
+    required = schema.get("required")
+    if required:
+        def check_required(v, required=tuple(required)):
+            if isinstance(v, dict):
+                for k in required:
+                    if k not in v:
+                        return f"{k!r} is a required property"
+            return None
+        checks.append(check_required)
+    props = schema.get("properties")
+    if props:
+        compiled = [(k, _compile_node(sub)) for k, sub in props.items()]
+        def check_props(v, compiled=compiled):
+            if isinstance(v, dict):
+                for k, check in compiled:
+                    if k in v:
+                        err = check(v[k])
+                        if err is not None:
+                            return err
+            return None
+        checks.append(check_props)
+    additional = schema.get("additionalProperties", True)
+    if additional is False:
+        allowed = frozenset(props or ())
+        def check_additional(v, allowed=allowed):
+            if isinstance(v, dict):
+                extra = [k for k in v if k not in allowed]
+                if extra:
+                    return f"Additional properties are not allowed ({extra!r} were unexpected)"
+            return None
+        checks.append(check_additional)
+    elif additional is not True:
+        raise _unsupported("additionalProperties")
+    items = schema.get("items")
+    if items is not None:
+        if not isinstance(items, dict):
+            raise _unsupported("items")
+        check_item = _compile_node(items)
+        def check_items(v, check_item=check_item):
+            if isinstance(v, list):
+                for item in v:
+                    err = check_item(item)
+                    if err is not None:
+                        return err
+            return None
+        checks.append(check_items)
+    if len(checks) == 1:
+        return checks[0]
+    def check_all(v, checks=tuple(checks)):
+        for check in checks:
+            err = check(v)
+            if err is not None:
+                return err
+        return None
+    return check_all
+
+def compile_validator(schema):
+    """
+    Compile a JSON schema into a validation function. Schemas that only use
+    type, properties, required, items and additionalProperties (such as
+    those made by create_schema) are compiled into specialized checks. Other
+    schemas use fastjsonschema if it is installed and jsonschema otherwise.
+
+    Parameters
+    ----------
+    schema : dict or str
+        JSON schema
+
+    Returns
+    -------
+    function
+        Function that takes a data object and raises a SerializationError
+        if it does not match the schema
+    """
+    if isinstance(schema, str):
+        schema = json.loads(schema)
+    try:
+        check = _compile_node(schema)
+        def validate(obj):
+            err = check(obj)
+            if err is not None:
+                raise SerializationError(err)
+        return validate
+    except _unsupported:
+        pass
+    try:
+        import fastjsonschema
+        fast_validate = fastjsonschema.compile(schema)
+        def validate(obj):
+            try:
+                fast_validate(obj)
+            except fastjsonschema.JsonSchemaException as e:
+                raise SerializationError(e.message)
+        return validate
+    except ImportError:
+        pass
+    from jsonschema.validators import validator_for
+    # Same draft as confluent_kafka's JSONSerializer: the one named by
+    # $schema, or the latest for other URIs such as the MDML ones, which
+    # jsonschema warns about
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        validator = validator_for(schema)(schema)
+    def validate(obj):
+        err = next(validator.iter_errors(obj), None)
+        if err is not None:
+            raise SerializationError(err.message)
+    return validate
+
+class compiled_json_serializer:
+    """
+    Serializes data objects into the schema registry JSON wire format
+    (magic byte, schema ID, JSON) like confluent_kafka's JSONSerializer,
+    but validates with a schema compiled once by compile_validator and
+    only as often as the validation policy requires.
+
+    Parameters
+    ----------
+    schema_str : str
+        JSON schema
+    schema_registry_client : SchemaRegistryClient
+        Client used to register the schema and get its ID
+    validation : str
+        'always' validates every message, 'every' validates one out of
+        every validation_n messages, 'first' validates the first
+        validation_n messages and trusts the rest, 'off' never validates
+    validation_n : int
+        Number of messages used by the 'every' and 'first' policies
+    """
+    def __init__(self, schema_str, schema_registry_client, validation="always", validation_n=1000):
+        if validation not in validation_policies:
+            raise Exception(f"Error, validation must be one of {validation_policies}.")
+        self.schema_str = schema_str
+        self.registry = schema_registry_client
+        self.validation = validation
+        self.validation_n = validation_n
+        self.validate = compile_validator(schema_str)
+        self.schema_ids = {}
+        self.count = 0
+
+    def _should_validate(self):
+        self.count += 1
+        if self.validation == "always":
+            return True
+        elif self.validation == "every":
+            return self.count % self.validation_n == 1 or self.validation_n == 1
+        elif self.validation == "first":
+            return self.count <= self.validation_n
+        return False
+
+    def __call__(self, obj, ctx):
+        if obj is None:
+            return None
+        subject = f"{ctx.topic}-value"
+        schema_id = self.schema_ids.get(subject)
+        if schema_id is None:
+            from confluent_kafka.schema_registry import Schema
+            schema_id = self.registry.register_schema(subject, Schema(self.schema_str, schema_type="JSON"))
+            self.schema_ids[subject] = schema_id
+        if self._should_validate():
+            self.validate(obj)
+        return struct.pack('>bI', 0, schema_id) + json.dumps(obj).encode('utf-8')
@@ -20,6 +20,12 @@ setuptools.setup(
 	    "requests",
         "jsonschema"
     ],
+    extras_require={
+        "fast": ["fastjsonschema"],
+        "columnar": ["numpy", "pyarrow"],
+        "compression": ["zstandard", "lz4"],
+        "all": ["fastjsonschema", "numpy", "pyarrow", "zstandard", "lz4"],
+    },
     classifiers = [
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
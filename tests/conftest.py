@@ -0,0 +1,43 @@
+import pytest
+import standins
+
+@pytest.fixture
+def mock_kafka():
+  """
+  Bootstrap servers ("host:port") of a librdkafka mock cluster
+  """
+  handle, servers = standins.mock_kafka()
+  yield servers
+  del handle # the cluster shuts down with its handle
+
+@pytest.fixture
+def schema_registry():
+  """
+  In-memory schema registry server. Its address is in server_address
+  and the requests it served in server.registry.requests
+  """
+  server, host, port = standins.schema_registry()
+  yield server
+  server.shutdown()
+
+@pytest.fixture
+def client_kwargs(mock_kafka, schema_registry):
+  """
+  kafka_host, kafka_port, schema_host and schema_port of the mock cluster
+  and schema registry, as passed to the MDML producers and consumers
+  """
+  host, port = mock_kafka.split(':')
+  schema_host, schema_port = schema_registry.server_address
+  return {'kafka_host': host, 'kafka_port': port, 'schema_host': schema_host, 'schema_port': schema_port}
+
+@pytest.fixture
+def s3_service(monkeypatch):
+  """
+  (server, endpoint_url) of an in-memory S3 service. Objects are in
+  server.store.objects
+  """
+  pytest.importorskip("boto3")
+  monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+  server, url = standins.s3()
+  yield server, url
+  server.shutdown()
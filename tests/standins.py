@@ -0,0 +1,278 @@
+"""
+Local stand-ins for the services an MDML client talks to, so the offline
+tests (through the fixtures in conftest.py) and the benchmarks can run
+without a deployed MDML instance.
+
+  mock_kafka()      - librdkafka's built-in mock cluster
+  schema_registry() - minimal in-memory Confluent schema registry over HTTP
+  s3()              - minimal in-memory S3 service (objects, multipart
+                      uploads and ranged GETs) for boto3 over HTTP
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+def mock_kafka(num_brokers=1):
+    """
+    Start a librdkafka mock cluster. Returns (handle, bootstrap_servers).
+    The cluster is shut down when the handle is garbage collected.
+    """
+    from confluent_kafka import Producer
+    handle = Producer({'test.mock.num.brokers': num_brokers})
+    md = handle.list_topics(timeout=10)
+    servers = ",".join(f"{b.host}:{b.port}" for b in md.brokers.values())
+    return handle, servers
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.schemas = {} # id -> (schema_str, schema_type)
+        self.ids = {} # (schema_str, schema_type) -> id
+        self.subjects = {} # subject -> [id, ...]
+        self.requests = [] # (method, path) of each request served
+
+    def register(self, subject, schema_str, schema_type):
+        with self.lock:
+            key = (schema_str, schema_type)
+            if key not in self.ids:
+                self.ids[key] = len(self.schemas) + 1
+                self.schemas[self.ids[key]] = key
+            schema_id = self.ids[key]
+            versions = self.subjects.setdefault(subject, [])
+            if schema_id not in versions:
+                versions.append(schema_id)
+            return schema_id, versions.index(schema_id) + 1
+
+    def version(self, subject, version):
+        with self.lock:
+            versions = self.subjects.get(subject)
+            if not versions:
+                return None
+            idx = len(versions) if version == 'latest' else int(version)
+            if idx < 1 or idx > len(versions):
+                return None
+            schema_str, schema_type = self.schemas[versions[idx-1]]
+            return {
+                'subject': subject, 'version': idx, 'id': versions[idx-1],
+                'schema': schema_str, 'schemaType': schema_type
+            }
+
+def _handler(registry):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/vnd.schemaregistry.v1+json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def not_found(self):
+            self.reply(404, {'error_code': 40401, 'message': 'Subject not found'})
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            registry.requests.append(('GET', path))
+            m = re.fullmatch(r'/subjects/([^/]+)/versions/([^/]+)', path)
+            if m:
+                res = registry.version(m.group(1), m.group(2))
+                return self.reply(200, res) if res else self.not_found()
+            m = re.fullmatch(r'/schemas/ids/(\d+)', path)
+            if m and int(m.group(1)) in registry.schemas:
+                schema_str, schema_type = registry.schemas[int(m.group(1))]
+                return self.reply(200, {'schema': schema_str, 'schemaType': schema_type})
+            if path == '/subjects':
+                return self.reply(200, list(registry.subjects))
+            self.not_found()
+
+        def do_POST(self):
+            path = self.path.split('?')[0]
+            registry.requests.append(('POST', path))
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            schema_type = body.get('schemaType', 'AVRO')
+            m = re.fullmatch(r'/subjects/([^/]+)/versions', path)
+            if m:
+                schema_id, _ = registry.register(m.group(1), body['schema'], schema_type)
+                return self.reply(200, {'id': schema_id})
+            m = re.fullmatch(r'/subjects/([^/]+)', path)
+            if m:
+                schema_id = registry.ids.get((body['schema'], schema_type))
+                if schema_id is None or schema_id not in registry.subjects.get(m.group(1), []):
+                    return self.not_found()
+                version = registry.subjects[m.group(1)].index(schema_id) + 1
+                return self.reply(200, registry.version(m.group(1), version))
+            self.not_found()
+    return Handler
+
+def schema_registry():
+    """
+    Start an in-memory schema registry on a free localhost port.
+    Returns (server, host, port); the requests served are listed in
+    server.registry.requests. Call server.shutdown() when finished.
+    """
+    registry = _Registry()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(registry))
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, host, port
+
+class _S3:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {} # (bucket, key) -> (data, etag, mtime)
+        self.uploads = {} # upload ID -> {part number: data}
+        self.requests = 0
+
+    def put(self, bucket, key, data, etag=None):
+        if etag is None:
+            etag = hashlib.md5(data).hexdigest()
+        with self.lock:
+            self.objects[(bucket, key)] = (data, f'"{etag}"', time.time())
+        return f'"{etag}"'
+
+def _read_body(handler):
+    """
+    Reads a request body, undoing chunked transfer and aws-chunked
+    (streaming checksum) encodings used by newer botocore versions.
+    """
+    headers = handler.headers
+    if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        raw = b''
+        while True:
+            size = int(handler.rfile.readline().split(b';')[0], 16)
+            if size == 0:
+                while handler.rfile.readline() not in (b'\r\n', b''):
+                    pass
+                break
+            raw += handler.rfile.read(size)
+            handler.rfile.readline()
+    else:
+        raw = handler.rfile.read(int(headers.get('Content-Length', 0)))
+    if 'aws-chunked' in headers.get('Content-Encoding', '') or \
+            headers.get('x-amz-content-sha256', '').startswith('STREAMING-'):
+        data = b''
+        pos = 0
+        while True:
+            end = raw.index(b'\r\n', pos)
+            size = int(raw[pos:end].split(b';')[0], 16)
+            if size == 0:
+                break
+            data += raw[end+2:end+2+size]
+            pos = end + 2 + size + 2
+        return data
+    return raw
+
+def _s3_handler(store):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, code, body=b'', headers={}):
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            self.send_response(code)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def parse(self):
+            with store.lock:
+                store.requests += 1
+            url = urlsplit(self.path)
+            parts = unquote(url.path).lstrip('/').split('/', 1)
+            key = parts[1] if len(parts) > 1 else ''
+            return parts[0], key, parse_qs(url.query, keep_blank_values=True)
+
+        def not_found(self):
+            self.reply(404, '<Error><Code>NoSuchKey</Code><Message>Not found</Message></Error>',
+                {'Content-Type': 'application/xml'})
+
+        def do_PUT(self):
+            bucket, key, query = self.parse()
+            data = _read_body(self)
+            if not key:
+                return self.reply(200)
+            if 'uploadId' in query:
+                with store.lock:
+                    store.uploads[query['uploadId'][0]][int(query['partNumber'][0])] = data
+                return self.reply(200, headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+            etag = store.put(bucket, key, data)
+            self.reply(200, headers={'ETag': etag})
+
+        def do_POST(self):
+            bucket, key, query = self.parse()
+            _read_body(self)
+            if 'uploads' in query:
+                upload_id = uuid.uuid4().hex
+                with store.lock:
+                    store.uploads[upload_id] = {}
+                return self.reply(200, f'<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket>'
+                    f'<Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>',
+                    {'Content-Type': 'application/xml'})
+            if 'uploadId' in query:
+                with store.lock:
+                    parts = store.uploads.pop(query['uploadId'][0])
+                data = b''.join(parts[n] for n in sorted(parts))
+                digest = hashlib.md5(b''.join(hashlib.md5(parts[n]).digest() for n in sorted(parts)))
+                etag = store.put(bucket, key, data, f'{digest.hexdigest()}-{len(parts)}')
+                return self.reply(200, f'<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket>'
+                    f'<Key>{key}</Key><ETag>{etag}</ETag></CompleteMultipartUploadResult>',
+                    {'Content-Type': 'application/xml'})
+            self.not_found()
+
+        def do_DELETE(self):
+            bucket, key, query = self.parse()
+            with store.lock:
+                if 'uploadId' in query:
+                    store.uploads.pop(query['uploadId'][0], None)
+                else:
+                    store.objects.pop((bucket, key), None)
+            self.reply(204)
+
+        def do_GET(self):
+            bucket, key, query = self.parse()
+            with store.lock:
+                obj = store.objects.get((bucket, key))
+            if obj is None:
+                return self.not_found()
+            data, etag, mtime = obj
+            headers = {'ETag': etag, 'Last-Modified': formatdate(mtime, usegmt=True),
+                'Accept-Ranges': 'bytes', 'Content-Type': 'binary/octet-stream'}
+            m = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if m:
+                start = int(m.group(1))
+                end = min(int(m.group(2)) if m.group(2) else len(data) - 1, len(data) - 1)
+                headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+                return self.reply(206, data[start:end+1], headers)
+            self.reply(200, data, headers)
+
+        do_HEAD = do_GET
+    return Handler
+
+def s3():
+    """
+    Start an in-memory S3 service on a free localhost port. Buckets are
+    created on first use. Returns (server, endpoint_url); the objects are
+    in server.store.objects. Call server.shutdown() when finished.
+    """
+    store = _S3()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _s3_handler(store))
+    server.store = store
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
@@ -0,0 +1,143 @@
+import math
+import os
+import pytest
+from base64 import b64encode, b64decode
+import mdml_client as mdml
+
+def test_chunk_file_matches_whole_file_encoding(tmp_path):
+  fn = str(tmp_path / "detector.bin")
+  with open(fn, "wb") as f:
+    f.write(os.urandom(100000))
+  with open(fn, "rb") as f:
+    encoded = b64encode(f.read()).decode('utf-8')
+  parts = list(mdml.chunk_file(fn, 4096, file_id="detector.bin"))
+  assert len(parts) == -(-len(encoded) // 4096)
+  assert parts[0]['part'] == f"1.{len(parts)}"
+  assert parts[-1]['part'] == f"{len(parts)}.{len(parts)}"
+  for i, part in enumerate(parts):
+    assert part['filename'] == "detector.bin"
+    assert part['encoding'] == "base64"
+    assert part['chunk'] == encoded[i*4096:(i+1)*4096]
+
+def test_chunk_file_unaligned_chunk_size(tmp_path):
+  fn = str(tmp_path / "detector.bin")
+  with open(fn, "wb") as f:
+    f.write(os.urandom(9999))
+  parts = list(mdml.chunk_file(fn, 1001))
+  assert all(len(part['chunk']) <= 1001 for part in parts)
+  with open(fn, "rb") as f:
+    assert b64decode(''.join(part['chunk'] for part in parts)) == f.read()
+
+def test_chunk_file_text(tmp_path):
+  fn = str(tmp_path / "log.txt")
+  with open(fn, "w", encoding="utf-8") as f:
+    f.write("température 21.5\n" * 500)
+  parts = list(mdml.chunk_file(fn, 333, use_b64=False))
+  assert parts[-1]['part'] == f"{len(parts)}.{len(parts)}"
+  assert len(parts) == math.ceil(os.path.getsize(fn) / 333)
+  with open(fn, "r", encoding="utf-8") as f:
+    assert ''.join(part['chunk'] for part in parts) == f.read()
+
+def test_chunk_file_binary(tmp_path):
+  fn = str(tmp_path / "detector.bin")
+  with open(fn, "wb") as f:
+    f.write(os.urandom(10000))
+  parts = list(mdml.chunk_file_binary(fn, 3000, file_id="detector.bin"))
+  assert len(parts) == 4
+  chunk, headers = parts[0]
+  headers = dict(headers)
+  assert headers['part'] == "1.4"
+  assert headers['filename'] == "detector.bin"
+  assert headers['encoding'] == "binary"
+  with open(fn, "rb") as f:
+    assert b''.join(chunk for chunk, _ in parts) == f.read()
+
+def reassemble(parts, tmp_path, **kwargs):
+  out_dir = tmp_path / "out"
+  out_dir.mkdir(exist_ok=True)
+  reassembler = mdml.chunk_reassembler(str(out_dir), **kwargs)
+  results = [reassembler.add(part) for part in parts]
+  assert all(res is None for res in results[:-1])
+  return reassembler, results[-1]
+
+def test_chunk_reassembler_out_of_order(tmp_path):
+  fn = str(tmp_path / "detector.bin")
+  with open(fn, "wb") as f:
+    f.write(os.urandom(50000))
+  parts = list(mdml.chunk_file(fn, 4000, file_id="detector.bin"))
+  parts = parts[::-1] # last part first
+  reassembler, (timestamp, path) = reassemble(parts, tmp_path, max_buffer_bytes=0)
+  assert timestamp == parts[-1]['time']
+  assert reassembler.buffered_bytes == 0
+  assert len(reassembler.files) == 0
+  with open(fn, "rb") as f1, open(path, "rb") as f2:
+    assert f1.read() == f2.read()
+
+def test_chunk_reassembler_unaligned_and_text(tmp_path):
+  data = os.urandom(5000)
+  encoded = b64encode(data).decode('utf-8')
+  # chunks from older clients may split base64 quanta
+  parts = [{
+    'time': 0.0, 'chunk': encoded[i:i+999], 'part': f"{i//999+1}.{-(-len(encoded)//999)}",
+    'filename': "old.bin", 'encoding': 'base64'
+  } for i in range(0, len(encoded), 999)]
+  parts = parts[1:] + parts[:1]
+  reassembler, (_, path) = reassemble(parts, tmp_path, max_buffer_bytes=2000)
+  with open(path, "rb") as f:
+    assert f.read() == data
+  fn = str(tmp_path / "log.txt")
+  with open(fn, "w", encoding="utf-8") as f:
+    f.write("température 21.5\n" * 500)
+  parts = list(mdml.chunk_file(fn, 333, use_b64=False, file_id="log.txt"))
+  parts = parts[::2] + parts[1::2]
+  reassembler, (_, path) = reassemble(parts, tmp_path)
+  with open(fn, "rb") as f1, open(path, "rb") as f2:
+    assert f1.read() == f2.read()
+
+def test_chunk_reassembler_compressed(tmp_path):
+  fn = str(tmp_path / "log.txt")
+  with open(fn, "w", encoding="utf-8") as f:
+    f.write("".join(f"{i} température 21.5\n" for i in range(5000)))
+  with open(fn, "rb") as f:
+    data = f.read()
+  for codec in ("zlib", "bz2", "lzma"):
+    parts = list(mdml.chunk_file(fn, 4000, file_id=f"{codec}.txt", compression=codec))
+    assert all(part['compression'] == codec for part in parts)
+    assert sum(len(part['chunk']) for part in parts) < len(data) / 2
+    reassembler, (_, path) = reassemble(parts[::-1], tmp_path)
+    with open(path, "rb") as f:
+      assert f.read() == data
+    parts = list(mdml.chunk_file_binary(fn, 3000, file_id=f"{codec}.bin", compression=codec))
+    assert dict(parts[0][1])['compression'] == codec
+    values = [{'time': 0.0, 'chunk': chunk, 'part': dict(headers)['part'], 'filename': f"{codec}.bin",
+      'encoding': 'binary', 'compression': codec} for chunk, headers in parts]
+    reassembler, (_, path) = reassemble(values[1:] + values[:1], tmp_path)
+    with open(path, "rb") as f:
+      assert f.read() == data
+  with pytest.raises(Exception, match="use_b64"):
+    list(mdml.chunk_file(fn, 4000, use_b64=False, compression="zlib"))
+
+def test_chunk_reassembler_eviction(tmp_path):
+  fn = str(tmp_path / "detector.bin")
+  with open(fn, "wb") as f:
+    f.write(os.urandom(10000))
+  reassembler = mdml.chunk_reassembler(str(tmp_path), max_files=2)
+  for i in range(3):
+    part = next(mdml.chunk_file(fn, 4000, file_id=f"file{i}.bin"))
+    assert reassembler.add(part) is None
+  assert list(reassembler.files) == ["file1.bin", "file2.bin"]
+  reassembler.ttl = 0
+  reassembler.evict()
+  assert len(reassembler.files) == 0
+  assert sorted(os.listdir(tmp_path)) == ["detector.bin"]
+
+def test_reassembler_rejects_malformed_parts(tmp_path):
+  reassembler = mdml.chunk_reassembler(str(tmp_path))
+  chunk = {'time': 0.0, 'chunk': "abc", 'filename': "bad.txt", 'encoding': "utf-8"}
+  for part in ("0.3", "4.3", "1.0", "0.0", "-1.3", "1", "1.2.3", "a.b", " 1.3", ""):
+    with pytest.raises(Exception, match="chunk part of bad.txt"):
+      reassembler.add(dict(chunk, part=part))
+  assert reassembler.files == {}
+  reassembler.add(dict(chunk, part="1.3"))
+  with pytest.raises(Exception, match="does not match the 3 parts"):
+    reassembler.add(dict(chunk, part="2.4"))
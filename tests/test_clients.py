@@ -0,0 +1,182 @@
+import asyncio
+import json
+import time
+import pytest
+import mdml_client as mdml
+from confluent_kafka import KafkaException
+
+def test_producer_futures(client_kwargs):
+  kwargs = client_kwargs
+  producer = mdml.kafka_mdml_producer_schemaless("mdml-test-futures",
+    kafka_host=kwargs['kafka_host'], kafka_port=kwargs['kafka_port'], background_poll=True)
+  futures = [producer.produce(json.dumps({"time": time.time(), "int1": i}), return_future=True) for i in range(5)]
+  # Delivery reports are served by the background thread, without poll or flush
+  for i, future in enumerate(futures):
+    msg = future.result(timeout=30)
+    assert msg.topic() == "mdml-test-futures"
+    assert json.loads(msg.value())["int1"] == i
+  producer.close()
+  schema = mdml.create_schema({"time": 1.0, "int1": 1}, "Test schema", "Schema used for testing futures")
+  producer = mdml.kafka_mdml_producer("mdml-test-futures-schema", schema=schema, background_poll=True, **kwargs)
+  delivered = []
+  future = producer.produce({"time": time.time(), "int1": 1}, return_future=True,
+    on_delivery=lambda err, msg: delivered.append(err))
+  assert future.result(timeout=30).topic() == "mdml-test-futures-schema"
+  assert delivered == [None]
+  producer.close()
+
+def test_delivery_future_errors():
+  from mdml_client.MDML_client import _delivery_future
+  reports = []
+  future, callback = _delivery_future(lambda err, msg: reports.append(err))
+  callback("Broker: Message size too large", None)
+  assert reports == ["Broker: Message size too large"]
+  with pytest.raises(KafkaException, match="Message size too large"):
+    future.result(timeout=0)
+
+def produce_records(kwargs, topic, count):
+  schema = mdml.create_schema({"time": 1.0, "int1": 1}, "Test schema", "Schema used for testing consumers",
+    required_keys=["time", "int1"])
+  producer = mdml.kafka_mdml_producer(topic, schema=schema, **kwargs)
+  records = [{"time": time.time(), "int1": i} for i in range(count)]
+  records[10] = {"time": time.time(), "int1": "not a number"}
+  failures = producer.produce_batch(records, flush=True)
+  assert [i for i, _ in failures] == [10]
+  producer.close()
+
+def test_consume_batch(client_kwargs):
+  kwargs = client_kwargs
+  produce_records(kwargs, "mdml-test-batch", 1000)
+  consumer = mdml.kafka_mdml_consumer(["mdml-test-batch"], "test-batch", provision_topics=False, **kwargs)
+  msgs = []
+  for batch in consumer.consume_batch(batch_size=100, overall_timeout=30, verbose=False):
+    assert 0 < len(batch) <= 100
+    msgs.extend(batch)
+    if len(msgs) == 999:
+      break
+  consumer.close()
+  assert all(msg['topic'] == "mdml-test-batch" for msg in msgs)
+  assert sorted(msg['value']['int1'] for msg in msgs) == [i for i in range(1000) if i != 10]
+
+def test_consume_processes(client_kwargs):
+  kwargs = client_kwargs
+  produce_records(kwargs, "mdml-test-processes", 1000)
+  consumer = mdml.kafka_mdml_consumer(["mdml-test-processes"], "test-processes", provision_topics=False, **kwargs)
+  msgs = []
+  for msg in consumer.consume(overall_timeout=30, verbose=False, processes=2):
+    msgs.append(msg)
+    if len(msgs) == 999:
+      break
+  consumer.close()
+  assert sorted(msg['value']['int1'] for msg in msgs) == [i for i in range(1000) if i != 10]
+  assert all(msg['topic'] == "mdml-test-processes" for msg in msgs)
+
+def test_async_clients(client_kwargs):
+  kwargs = client_kwargs
+  schema = mdml.create_schema({"time": 1.0, "int1": 1}, "Test schema", "Schema used for testing asyncio clients")
+  async def run():
+    producer = mdml.kafka_mdml_producer_async("mdml-test-async", schema=schema, **kwargs)
+    futures = [producer.produce({"time": time.time(), "int1": i}) for i in range(5)]
+    for msg in await asyncio.gather(*futures):
+      assert msg.topic() == "mdml-test-async"
+    await producer.close()
+    consumer = mdml.kafka_mdml_consumer_async(["mdml-test-async"], "test-async",
+      provision_topics=False, **kwargs)
+    msgs = []
+    async for msg in consumer.consume(overall_timeout=30, verbose=False):
+      msgs.append(msg)
+      if len(msgs) == 5:
+        break
+    await consumer.close()
+    return msgs
+  msgs = asyncio.run(run())
+  assert sorted(msg['value']['int1'] for msg in msgs) == list(range(5))
+
+def test_async_schemaless_consumer(client_kwargs):
+  from confluent_kafka import Producer
+  kwargs = client_kwargs
+  producer = Producer({'bootstrap.servers': f"{kwargs['kafka_host']}:{kwargs['kafka_port']}"})
+  producer.produce("mdml-test-async-schemaless", value=b'{"int1": 1}')
+  producer.produce("mdml-test-async-schemaless", value=None) # tombstone
+  producer.flush()
+  messages = mdml.default_metrics.metric('mdml_consumed_messages_total', topic="mdml-test-async-schemaless")
+  nbytes = mdml.default_metrics.metric('mdml_consumed_bytes_total', topic="mdml-test-async-schemaless")
+  before = (messages.value, nbytes.value)
+  async def run():
+    consumer = mdml.kafka_mdml_consumer_schemaless_async(["mdml-test-async-schemaless"], "test-async-schemaless",
+      provision_topics=False, kafka_host=kwargs['kafka_host'], kafka_port=kwargs['kafka_port'])
+    msgs = []
+    async for msg in consumer.consume(overall_timeout=30, verbose=False):
+      msgs.append(msg)
+      if len(msgs) == 2:
+        break
+    await consumer.close()
+    bad = mdml.kafka_mdml_consumer_schemaless_async(["not-mdml"], "test-async-schemaless")
+    with pytest.raises(Exception, match="topic must be of the form"):
+      await bad.close()
+    return msgs
+  msgs = asyncio.run(run())
+  assert sorted([msg['value'] for msg in msgs], key=lambda v: v is None) == [b'{"int1": 1}', None]
+  assert (messages.value - before[0], nbytes.value - before[1]) == (2, len(b'{"int1": 1}'))
+
+def test_async_producer_drain_skips_cancelled_futures():
+  from mdml_client.aio import _async_producer
+  class full_producer:
+    def __init__(self):
+      self.calls = 0
+    def produce(self, data, **kwargs):
+      self.calls += 1
+      if self.calls == 1:
+        raise BufferError()
+      raise ValueError(data)
+  async def run():
+    producer = _async_producer(full_producer())
+    cancelled = producer.produce("a")
+    failed = producer.produce("b")
+    cancelled.cancel()
+    await producer._drain_task
+    return cancelled, failed
+  cancelled, failed = asyncio.run(run())
+  assert cancelled.cancelled()
+  with pytest.raises(ValueError, match="b"):
+    failed.result()
+
+def test_produce_batch_retries_full_queue():
+  class full_producer:
+    def __init__(self):
+      self.sent = []
+      self.polls = 0
+      self.full = True
+    def produce(self, topic, value, key=None, on_delivery=None):
+      if self.full:
+        self.full = False
+        raise BufferError()
+      self.sent.append(value)
+    def poll(self, timeout):
+      self.polls += 1
+      self.full = False
+  producer = mdml.kafka_mdml_producer.__new__(mdml.kafka_mdml_producer)
+  producer.topic = "mdml-test-batch"
+  producer.add_time = False
+  producer.value_serializer = None
+  producer.producer = full_producer()
+  assert producer.produce_batch(["a", "b", "c"], poll_interval=0) == []
+  assert producer.producer.sent == ["a", "b", "c"]
+  assert producer.producer.polls == 5 # one for the full queue, one per record and one at the end
+
+def test_consume_processes_keeps_partition_order(client_kwargs):
+  kwargs = client_kwargs
+  schema = mdml.create_schema({"time": 1.0, "int1": 1}, "Test schema", "Schema used for testing consumers")
+  producer = mdml.kafka_mdml_producer("mdml-test-processes-order", schema=schema, **kwargs)
+  assert producer.produce_batch([{"time": time.time(), "int1": i} for i in range(500)], partition=0, flush=True) == []
+  producer.close()
+  consumer = mdml.kafka_mdml_consumer(["mdml-test-processes-order"], "test-processes-order", provision_topics=False, **kwargs)
+  with pytest.raises(Exception, match="processes must be at least 1"):
+    next(consumer.consume(verbose=False, processes=0))
+  msgs = []
+  for batch in consumer.consume_batch(batch_size=100, overall_timeout=30, verbose=False, processes=3):
+    msgs.extend(batch)
+    if len(msgs) == 500:
+      break
+  consumer.close()
+  assert [msg['value']['int1'] for msg in msgs] == list(range(500))
@@ -0,0 +1,91 @@
+import math
+import pytest
+import mdml_client as mdml
+
+def test_columnar_buffer_numpy():
+  schema = mdml.create_schema({
+    "time": 1.0,
+    "int1": 1,
+    "name": "sensor",
+    "int_array": [1,2,3]
+  }, "Test schema", "Schema used for testing columnar output")
+  buffer = mdml.columnar_buffer(schema)
+  assert buffer.dtype.names == ("time", "int1", "name", "int_array", "mdml_time")
+  for i in range(5):
+    buffer.append({"time": float(i), "int1": i, "name": f"s{i}", "int_array": [i, i], "mdml_time": 2.0})
+  buffer.append({"time": 5.0, "extra": True})
+  arr = buffer.to_numpy()
+  assert len(arr) == 6
+  assert list(arr['int1'][:5]) == [0, 1, 2, 3, 4]
+  assert math.isnan(arr['int1'][5])
+  assert arr['name'][1] == "s1"
+  assert arr['int_array'][2] == [2, 2]
+  buffer.clear()
+  assert len(buffer) == 0
+  assert len(buffer.to_numpy()) == 0
+
+def test_schema_dtype_without_mdml_time():
+  schema = {"type": "object", "properties": {"count": {"type": "integer"}, "ok": {"type": "boolean"}}}
+  dtype = mdml.schema_dtype(schema, show_mdml_time=False)
+  assert dtype.names == ("count", "ok")
+  assert dtype['count'].kind == 'i'
+  assert dtype['ok'].kind == 'b'
+
+def test_columnar_buffer_missing_values():
+  schema = {"type": "object", "properties": {"count": {"type": "integer"}, "ok": {"type": "boolean"}, "x": {"type": "number"}}}
+  buffer = mdml.columnar_buffer(schema, show_mdml_time=False)
+  buffer.append({"count": 1, "ok": True, "x": 1.5})
+  buffer.append({"count": 2, "ok": False, "x": 2.5})
+  arr = buffer.to_numpy()
+  assert arr.dtype == buffer.dtype
+  assert list(arr['count']) == [1, 2]
+  buffer.append({"x": 3.5})
+  arr = buffer.to_numpy()
+  # Integer gaps are NaN rather than 0, boolean gaps are None rather than False
+  assert arr.dtype['count'].kind == 'f'
+  assert list(arr['count'][:2]) == [1.0, 2.0]
+  assert math.isnan(arr['count'][2])
+  assert arr.dtype['ok'].kind == 'O'
+  assert list(arr['ok']) == [True, False, None]
+  assert arr.dtype['x'].kind == 'f'
+
+def test_schema_dtype_type_lists():
+  schema = {"type": "object", "properties": {
+    "x": {"type": ["number", "null"]},
+    "count": {"type": ["null", "integer"]},
+    "either": {"type": ["number", "string"]},
+    "nothing": {"type": ["null"]}
+  }}
+  dtype = mdml.schema_dtype(schema, show_mdml_time=False)
+  assert [dtype[name].kind for name in dtype.names] == ['f', 'i', 'O', 'O']
+  buffer = mdml.columnar_buffer(schema, show_mdml_time=False)
+  buffer.append({"x": 1.5, "count": 1})
+  buffer.append({"x": None, "count": None, "either": "a"})
+  arr = buffer.to_numpy()
+  assert math.isnan(arr['x'][1]) and math.isnan(arr['count'][1])
+  assert list(arr['either']) == [None, "a"]
+
+def test_columnar_buffer_mismatched_values():
+  schema = {"type": "object", "properties": {"x": {"type": "number"}, "count": {"type": "integer"}}}
+  buffer = mdml.columnar_buffer(schema, show_mdml_time=False)
+  buffer.append({"x": 1.5, "count": 1})
+  buffer.append({"x": "not a number", "count": 2})
+  arr = buffer.to_numpy()
+  assert arr.dtype['x'].kind == 'O'
+  assert list(arr['x']) == [1.5, "not a number"]
+  assert arr.dtype['count'].kind == 'i'
+
+def test_columnar_buffer_arrow():
+  pa = pytest.importorskip("pyarrow")
+  schema = {"type": "object", "properties": {"count": {"type": "integer"}, "ok": {"type": "boolean"}, "name": {"type": "string"}}}
+  buffer = mdml.columnar_buffer(schema)
+  buffer.append({"count": 1, "ok": True, "name": "a", "mdml_time": 1.0})
+  buffer.append({"name": "b", "mdml_time": 2.0})
+  batch = buffer.to_arrow()
+  assert batch.num_rows == 2
+  assert batch.schema.names == ["count", "ok", "name", "mdml_time"]
+  assert batch.schema.field("count").type == pa.int64()
+  assert batch.schema.field("ok").type == pa.bool_()
+  assert batch.column("count").to_pylist() == [1, None]
+  assert batch.column("ok").to_pylist() == [True, None]
+  assert batch.column("name").to_pylist() == ["a", "b"]
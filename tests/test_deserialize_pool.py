@@ -0,0 +1,17 @@
+import json
+import struct
+import mdml_client as mdml
+from mdml_client.deserialize_pool import _deserialize_messages
+
+def test_deserialize_messages_keeps_order():
+  schema = json.dumps(mdml.create_schema({"time": 1.0, "int1": 1}, "Test schema", "Schema used for testing"))
+  messages = []
+  for i in range(10):
+    topic = f"mdml-test-{i % 2}"
+    value = struct.pack('>bI', 0, 1) + json.dumps({"time": float(i), "int1": i, "mdml_time": 2.0}).encode('utf-8')
+    messages.append((topic, value))
+  schemas = {"mdml-test-0": schema, "mdml-test-1": schema}
+  results = _deserialize_messages(schemas, messages, show_mdml_time=False)
+  assert [res['value']['int1'] for res in results] == list(range(10))
+  assert [res['topic'] for res in results] == [topic for topic, _ in messages]
+  assert 'mdml_time' not in results[0]['value']
@@ -0,0 +1,75 @@
+import gzip
+import json
+import threading
+import pytest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import mdml_client as mdml
+from mdml_client.experiment_data import _iter_json_records
+
+RECORDS = [{"topic": "mdml-test", "value": {"time": i, "text": "é, [x]"}, "time": i} for i in range(200)]
+
+def split(data, size):
+  return [data[i:i+size] for i in range(0, len(data), size)]
+
+def test_iter_json_records_formats():
+  array = json.dumps(RECORDS).encode('utf-8')
+  ndjson = "\n".join(json.dumps(r) for r in RECORDS).encode('utf-8')
+  for data in (array, ndjson, gzip.compress(array)):
+    for size in (1, 7, 4096):
+      assert list(_iter_json_records(split(data, size))) == RECORDS
+
+def test_iter_json_records_long_records():
+  records = [{"text": 'a "quoted" {brace} \\ ' * 50 + "\\", "n": list(range(100))}, {"x": "}"}]
+  data = json.dumps(records).encode('utf-8')
+  for size in (1, 3, 64):
+    assert list(_iter_json_records(split(data, size))) == records
+  with pytest.raises(Exception, match="invalid record"):
+    list(_iter_json_records([b'[{"a": tru', b'e, "b": x}, {"c": 1}]']))
+  with pytest.raises(Exception, match="incomplete record"):
+    list(_iter_json_records([b'[{"a": {"b": 1}', b', "c": "}"']))
+
+def test_refresh_index_fetches_new_samples(tmp_path):
+  samples = [("c1", "MDML experiment exp-1", "url-1"), ("c2", "Other sample", "url-2")]
+  fetched = []
+  def fetch_samples(after=None):
+    fetched.append(after)
+    cursors = [cursor for cursor, _, _ in samples]
+    return samples[cursors.index(after) + 1:] if after else list(samples)
+  store = mdml.experiment_data_store("token", cache_dir=str(tmp_path))
+  store._fetch_samples = fetch_samples
+  assert store.url("exp-1") == "url-1"
+  samples.append(("c3", "MDML experiment exp-3", "url-3"))
+  store = mdml.experiment_data_store("token", cache_dir=str(tmp_path))
+  store._fetch_samples = fetch_samples
+  assert store.url("exp-3") == "url-3"
+  with pytest.raises(Exception, match="No experiment found"):
+    store.url("exp-4")
+  assert fetched == [None, "c2", "c3"]
+  assert store.index == {"exp-1": "url-1", "exp-3": "url-3"}
+
+def test_experiment_data_store_cache(tmp_path):
+  requests_served = []
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      requests_served.append(self.path)
+      body = json.dumps(RECORDS).encode('utf-8')
+      self.send_response(200)
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    def log_message(self, *args):
+      pass
+  server = HTTPServer(("127.0.0.1", 0), Handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  url = f"http://127.0.0.1:{server.server_port}/exp"
+  store = mdml.experiment_data_store("token", cache_dir=str(tmp_path))
+  store.index = {"exp-1": url, "exp-2": url + "2"}
+  assert store.get("exp-1") == (url, RECORDS)
+  assert list(store.iter_records("exp-1")) == RECORDS
+  assert requests_served == ["/exp"]
+  # a new store reads the index and cached files from disk
+  store = mdml.experiment_data_store("token", cache_dir=str(tmp_path))
+  results = store.get_many(["exp-1", "exp-2"])
+  assert results["exp-2"] == (url + "2", RECORDS)
+  assert requests_served == ["/exp", "/exp2"]
+  server.shutdown()
@@ -0,0 +1,68 @@
+import json
+import time
+import mdml_client as mdml
+from mdml_client import experiments
+from confluent_kafka import Consumer
+
+def control_messages(servers, topic, count):
+  consumer = Consumer({'bootstrap.servers': servers, 'group.id': f"test-{topic}", 'auto.offset.reset': 'earliest'})
+  consumer.subscribe([topic])
+  values = []
+  deadline = time.monotonic() + 30
+  while len(values) < count and time.monotonic() < deadline:
+    msg = consumer.poll(0.5)
+    if msg is not None and msg.error() is None:
+      # Skip the schema registry framing (magic byte and schema id)
+      values.append(json.loads(msg.value()[5:]))
+  consumer.close()
+  return values
+
+def test_start_experiment_confirms_delivery(mock_kafka, client_kwargs):
+  servers, kwargs = mock_kafka, client_kwargs
+  start = time.monotonic()
+  mdml.start_experiment("test-exp", topics=["mdml-test-a", "mdml-test-b"], producer_kwargs=kwargs)
+  mdml.stop_experiment("test-exp", producer_kwargs=kwargs)
+  mdml.replay_experiment("test-exp", speed=2, producer_kwargs=kwargs)
+  # No fixed settle sleep unless one is asked for
+  assert time.monotonic() - start < 5
+  values = control_messages(servers, "mdml-experiment-service", 2)
+  values.sort(key=lambda v: v['time'])
+  assert [(v['experiment_id'], v['status']) for v in values] == [("test-exp", "on"), ("test-exp", "off")]
+  assert values[0]['topics'] == ["mdml-test-a", "mdml-test-b"]
+  assert control_messages(servers, "mdml-replay-service", 1)[0]['speed'] == 2
+  experiments._close_sessions()
+
+def test_experiment_session_pipelines(mock_kafka, client_kwargs):
+  servers, kwargs = mock_kafka, client_kwargs
+  with mdml.experiment_session(producer_kwargs=kwargs) as session:
+    futures = [
+      session.start("test-session-1", topics=["mdml-test-session-topic"], wait=False),
+      session.start("test-session-2", topics=["mdml-test-session-topic"], wait=False),
+      session.stop("test-session-1", wait=False),
+      session.stop("test-session-2", wait=False)
+    ]
+    session.flush()
+    for future in futures:
+      assert future.result().topic() == "mdml-experiment-service"
+  values = control_messages(servers, "mdml-experiment-service", 4)
+  # Control messages may land on different partitions
+  assert sorted((v['experiment_id'], v['status']) for v in values) == [
+    ("test-session-1", "off"), ("test-session-1", "on"), ("test-session-2", "off"), ("test-session-2", "on")]
+
+def test_default_sessions_are_bounded(monkeypatch):
+  closed = []
+  class FakeSession:
+    def __init__(self, producer_kwargs):
+      self.producer_kwargs = producer_kwargs
+    def close(self):
+      closed.append(self.producer_kwargs['kafka_port'])
+  monkeypatch.setattr(experiments, "experiment_session", FakeSession)
+  monkeypatch.setattr(experiments, "_sessions", experiments.OrderedDict())
+  sessions = [experiments._default_session({'kafka_port': i}) for i in range(experiments._max_sessions)]
+  assert experiments._default_session({'kafka_port': 0}) is sessions[0]
+  # Port 1 is now the least recently used session
+  experiments._default_session({'kafka_port': experiments._max_sessions})
+  assert closed == [1]
+  experiments._close_sessions()
+  assert sorted(closed) == [0, 1, 2, 3, 4]
+  assert len(experiments._sessions) == 0
@@ -0,0 +1,72 @@
+import gzip
+import json
+import random
+import pytest
+import mdml_client as mdml
+from mdml_client.export import external_sort, open_export, write_export, export_suffix
+
+def test_external_sort_spills_and_is_stable(tmp_path):
+  records = [(float(random.randrange(50)), json.dumps({"i": i})) for i in range(2000)]
+  expected = [line for _, line in sorted(records, key=lambda r: r[0])]
+  assert list(external_sort(iter(records), max_memory_bytes=500, tmp_dir=str(tmp_path))) == expected
+  assert list(external_sort(iter(records))) == expected
+  assert list(tmp_path.iterdir()) == []
+
+def test_write_export_formats(tmp_path):
+  lines = [json.dumps({"time": t}) for t in range(3)]
+  fn = str(tmp_path / "exp.json")
+  with open_export(fn) as f:
+    assert write_export(iter(lines), f, "json") == 3
+  with open(fn) as f:
+    assert json.load(f) == [{"time": t} for t in range(3)]
+  fn = str(tmp_path / "exp.ndjson.gz")
+  with open_export(fn, "gzip") as f:
+    write_export(iter(lines), f, "ndjson")
+  with gzip.open(fn, "rt") as f:
+    assert [json.loads(line) for line in f] == [{"time": t} for t in range(3)]
+
+def test_compressed_exports_are_readable(tmp_path):
+  lines = [json.dumps({"topic": "mdml-test", "value": {"time": t}, "time": t}) for t in range(200)]
+  for codec in ("gzip", "bz2", "xz"):
+    fn = str(tmp_path / f"exp{export_suffix('json', codec)}")
+    with open_export(fn, codec) as f:
+      write_export(iter(lines), f, "json")
+    assert [r["time"] for r in mdml.read_experiment_file(fn, chunk_size=3)] == list(range(200))
+  fn = str(tmp_path / "tiny.ndjson")
+  with open(fn, "w") as f:
+    f.write("{}")
+  assert list(mdml.read_experiment_file(fn)) == [{}]
+
+def test_external_sort_spills_string_times(tmp_path):
+  times = [f"2024-05-01 10:{m:02d}:00" for m in range(60)]
+  random.shuffle(times)
+  records = [(t, json.dumps({"time": t})) for t in times]
+  expected = [json.dumps({"time": t}) for t in sorted(times)]
+  assert list(external_sort(iter(records), max_memory_bytes=200, tmp_dir=str(tmp_path))) == expected
+  # Integer times keep their type through the spilled runs
+  records = [(i % 7, json.dumps({"i": i})) for i in range(100)]
+  expected = [line for _, line in sorted(records, key=lambda r: r[0])]
+  assert list(external_sort(iter(records), max_memory_bytes=100, tmp_dir=str(tmp_path))) == expected
+
+def test_external_sort_rejects_mixed_times(tmp_path):
+  records = [(1.0, "{}"), (None, "{}"), ("2024-05-01", "{}")]
+  with pytest.raises(Exception, match="cannot sort records by time"):
+    list(external_sort(iter(records)))
+  records = [(float(i), "{}") for i in range(50)] + [(None, "{}")]
+  with pytest.raises(Exception, match="cannot sort records by time"):
+    list(external_sort(iter(records), max_memory_bytes=20, tmp_dir=str(tmp_path)))
+
+def test_external_sort_bounds_merge_fan_in(tmp_path, monkeypatch):
+  from mdml_client import export
+  merge = export.heapq.merge
+  fan_ins = []
+  def bounded_merge(*runs, **kwargs):
+    fan_ins.append(len(runs))
+    return merge(*runs, **kwargs)
+  monkeypatch.setattr(export, '_max_fan_in', 3)
+  monkeypatch.setattr(export.heapq, 'merge', bounded_merge)
+  records = [(float(random.randrange(20)), json.dumps({"i": i})) for i in range(500)]
+  expected = [line for _, line in sorted(records, key=lambda r: r[0])]
+  assert list(external_sort(iter(records), max_memory_bytes=200, tmp_dir=str(tmp_path))) == expected
+  assert len(fan_ins) > 1 and max(fan_ins) <= 3
+  assert list(tmp_path.iterdir()) == []
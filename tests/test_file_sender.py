@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import pytest
+import mdml_client as mdml
+from mdml_client import file_sender
+
+class FakeProducer:
+  """
+  Stands in for kafka_mdml_producer_schemaless. Parts are delivered when
+  poll or flush is called, fail if deliver_error is set, and the first
+  full_calls calls to produce raise BufferError.
+  """
+  def __init__(self, topic, deliver_error=None, full_calls=0, **kwargs):
+    self.lock = threading.Lock()
+    self.queued = []
+    self.sent = []
+    self.deliver_error = deliver_error
+    self.full_calls = full_calls
+    self.polls = 0
+  def produce(self, data, on_delivery=None, headers=None):
+    with self.lock:
+      if self.full_calls > 0:
+        self.full_calls -= 1
+        raise BufferError("Local: Queue full")
+      self.queued.append((data, headers, on_delivery))
+  def poll(self, timeout=0):
+    with self.lock:
+      self.polls += 1
+      queued, self.queued = self.queued, []
+    for data, headers, on_delivery in queued:
+      self.sent.append((data, headers))
+      on_delivery(self.deliver_error, None)
+    return len(queued)
+  def flush(self):
+    self.poll()
+  def close(self):
+    self.poll()
+
+def make_sender(monkeypatch, **kwargs):
+  producers = []
+  def factory(topic, **producer_kwargs):
+    producers.append(FakeProducer(topic, **kwargs))
+    return producers[-1]
+  monkeypatch.setattr(file_sender, "kafka_mdml_producer_schemaless", factory)
+  sender = mdml.kafka_mdml_file_sender("mdml-test-files", chunk_size=1000, workers=2, binary=True)
+  return sender, producers[0]
+
+def test_file_sender_resolves_after_delivery(tmp_path, monkeypatch):
+  sender, producer = make_sender(monkeypatch)
+  fn = tmp_path / "data.bin"
+  fn.write_bytes(os.urandom(4500))
+  future = sender.send(str(fn), file_id="data.bin")
+  deadline = time.monotonic() + 5
+  while len(producer.queued) < 5 and time.monotonic() < deadline:
+    time.sleep(0.01)
+  # The file may be removed before the delivery reports are served
+  fn.unlink()
+  assert not future.done()
+  producer.poll()
+  result = future.result(timeout=5)
+  assert result['filename'] == "data.bin"
+  assert result['parts'] == 5
+  assert result['bytes'] == 4500
+  assert len(producer.sent) == 5
+  sender.close()
+
+def test_file_sender_empty_file(tmp_path, monkeypatch):
+  sender, producer = make_sender(monkeypatch)
+  fn = tmp_path / "empty.bin"
+  fn.write_bytes(b"")
+  result = sender.send(str(fn)).result(timeout=5)
+  assert result['parts'] == 0
+  assert result['bytes'] == 0
+  assert producer.sent == []
+  sender.close()
+
+def test_file_sender_delivery_error(tmp_path, monkeypatch):
+  sender, producer = make_sender(monkeypatch, deliver_error="Broker: Message size too large")
+  fn = tmp_path / "data.bin"
+  fn.write_bytes(os.urandom(2500))
+  future = sender.send(str(fn))
+  sender.flush()
+  with pytest.raises(Exception, match="Message size too large"):
+    future.result(timeout=5)
+  sender.close()
+
+def test_file_sender_missing_file(tmp_path, monkeypatch):
+  sender, producer = make_sender(monkeypatch)
+  future = sender.send(str(tmp_path / "missing.bin"))
+  with pytest.raises(FileNotFoundError):
+    future.result(timeout=5)
+  sender.close()
+
+def test_file_sender_waits_when_queue_is_full(tmp_path, monkeypatch):
+  sender, producer = make_sender(monkeypatch, full_calls=3)
+  fn = tmp_path / "data.bin"
+  fn.write_bytes(os.urandom(1500))
+  future = sender.send(str(fn))
+  sender.flush()
+  assert future.result(timeout=5)['parts'] == 2
+  # Each BufferError served delivery reports before retrying
+  assert producer.polls >= 3
+  assert len(producer.sent) == 2
+  sender.close()
+
+def test_file_sender_mock_cluster(tmp_path, mock_kafka):
+  host, port = mock_kafka.split(':')
+  sender = mdml.kafka_mdml_file_sender("mdml-test-files", chunk_size=1000, binary=True,
+    producer_kwargs={'kafka_host': host, 'kafka_port': port})
+  fns = []
+  for i in range(3):
+    fn = tmp_path / f"frame{i}.bin"
+    fn.write_bytes(os.urandom(3000 + i))
+    fns.append(str(fn))
+  results = [f.result(timeout=30) for f in sender.send_many(fns)]
+  sender.close()
+  assert [r['parts'] for r in results] == [3, 4, 4]
+  assert [r['bytes'] for r in results] == [3000, 3001, 3002]
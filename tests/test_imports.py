@@ -0,0 +1,12 @@
+import subprocess
+import sys
+
+def test_import_is_lazy():
+  code = "import sys, mdml_client; print(' '.join(m for m in ('boto3', 'requests', 'confluent_kafka.schema_registry', 'mdml_client.registry', 'mdml_client.aio') if m in sys.modules))"
+  out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+  assert out.strip() == ""
+
+def test_lazy_names_resolve():
+  import mdml_client as mdml
+  assert callable(mdml.get_schema_registry_client)
+  assert "kafka_mdml_consumer_async" in dir(mdml)
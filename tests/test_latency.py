@@ -0,0 +1,65 @@
+import random
+import pytest
+import mdml_client as mdml
+
+class FakeMessage:
+  def __init__(self, topic, partition, timestamp_ms):
+    self._topic = topic
+    self._partition = partition
+    self._timestamp = (1, timestamp_ms) if timestamp_ms is not None else (0, -1)
+  def topic(self):
+    return self._topic
+  def partition(self):
+    return self._partition
+  def timestamp(self):
+    return self._timestamp
+
+def test_histogram_percentiles():
+  rng = random.Random(0)
+  values = sorted(rng.expovariate(1 / 0.02) for _ in range(20000))
+  h = mdml.latency_histogram()
+  for v in values:
+    h.record(v)
+  for p in (50, 99, 99.9):
+    exact = values[int(p / 100 * len(values) + 0.5) - 1]
+    assert h.percentile(p) == pytest.approx(exact, rel=0.01)
+  summary = h.summary()
+  assert summary['count'] == 20000
+  assert summary['max'] == pytest.approx(values[-1], abs=1e-6)
+  other = mdml.latency_histogram()
+  other.record(-0.5)
+  other.record(7200.0)
+  h.merge(other)
+  assert h.count == 20002
+  assert h.negative == 1
+  assert h.min == 0
+  assert h.percentile(100) == 3600.0
+
+def test_tracker_stages():
+  tracker = mdml.latency_tracker()
+  tracker.record_message(FakeMessage("mdml-a", 0, 1000500), 1000.0, received=1001.0)
+  tracker.record_message(FakeMessage("mdml-a", 1, None), 1000.0, received=1000.25)
+  tracker.record_message(FakeMessage("mdml-a", 1, 1000000), None, received=1000.125)
+  report = tracker.report()
+  p0 = report["mdml-a"][0]
+  assert p0['end_to_end']['p50'] == pytest.approx(1.0, rel=0.01)
+  assert p0['produce']['p50'] == pytest.approx(0.5, rel=0.01)
+  assert p0['consume']['p50'] == pytest.approx(0.5, rel=0.01)
+  p1 = report["mdml-a"][1]
+  assert p1['end_to_end']['count'] == 1
+  assert p1['produce']['count'] == 0
+  assert p1['consume']['p99'] == pytest.approx(0.125, rel=0.01)
+  gauges = mdml.get_metrics()['mdml_latency_seconds']
+  assert {'topic': "mdml-a", 'partition': "0", 'stage': "end_to_end", 'quantile': "0.99"} in [g['labels'] for g in gauges]
+
+def test_tracker_periodic_reports():
+  reports = []
+  tracker = mdml.latency_tracker(report_interval=10.0, report=reports.append)
+  start = tracker._last_report
+  tracker.record("mdml-b", 0, start - 0.1, None, start + 1)
+  assert reports == []
+  tracker.record("mdml-b", 0, start + 10, None, start + 11)
+  assert len(reports) == 1
+  assert reports[0]["mdml-b"][0]['end_to_end']['count'] == 2
+  # Periodic reports start new histograms
+  assert tracker.report()["mdml-b"][0]['end_to_end']['count'] == 0
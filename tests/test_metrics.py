@@ -0,0 +1,119 @@
+import json
+import urllib.request
+import mdml_client as mdml
+from mdml_client.metrics import _instrumented_serializer
+
+def value(snapshot, name, **labels):
+  for series in snapshot.get(name, []):
+    if series['labels'] == labels:
+      return series['value']
+  return 0
+
+def test_registry_snapshot_and_exposition():
+  registry = mdml.metrics_registry()
+  registry.inc('mdml_produced_messages_total', topic="mdml-a")
+  registry.inc('mdml_produced_messages_total', 2, topic="mdml-a")
+  registry.set('mdml_reassembly_incomplete_files', 5)
+  registry.observe('mdml_serialize_seconds', 0.5, topic="mdml-a")
+  registry.observe('mdml_serialize_seconds', 0.25, topic="mdml-a")
+  snapshot = registry.snapshot()
+  assert value(snapshot, 'mdml_produced_messages_total', topic="mdml-a") == 3
+  assert value(snapshot, 'mdml_reassembly_incomplete_files') == 5
+  assert value(snapshot, 'mdml_serialize_seconds_count', topic="mdml-a") == 2
+  assert value(snapshot, 'mdml_serialize_seconds_sum', topic="mdml-a") == 0.75
+  text = registry.prometheus()
+  assert "# TYPE mdml_produced_messages_total counter" in text
+  assert 'mdml_produced_messages_total{topic="mdml-a"} 3' in text
+  assert 'mdml_serialize_seconds_count{topic="mdml-a"} 2' in text
+  assert "mdml_reassembly_incomplete_files 5" in text
+  registry.reset()
+  assert value(registry.snapshot(), 'mdml_produced_messages_total', topic="mdml-a") == 0
+
+def test_librdkafka_statistics():
+  registry = mdml.metrics_registry()
+  stats = {
+    'name': "rdkafka#consumer-1", 'type': "consumer", 'msg_cnt': 7, 'msg_size': 700,
+    'brokers': {
+      "GroupCoordinator": {'name': "GroupCoordinator", 'nodeid': -1, 'rtt': {'avg': 0, 'p99': 0}},
+      "localhost:9092/1": {'name': "localhost:9092/1", 'nodeid': 1, 'outbuf_msg_cnt': 3,
+        'waitresp_msg_cnt': 1, 'rtt': {'avg': 2000, 'p99': 9000}}
+    },
+    'topics': {
+      "mdml-a": {'partitions': {
+        "0": {'txmsgs': 0, 'txbytes': 0, 'rxmsgs': 40, 'rxbytes': 4000, 'consumer_lag': 12},
+        "-1": {'txmsgs': 0, 'txbytes': 0, 'rxmsgs': 0, 'rxbytes': 0, 'consumer_lag': -1}
+      }}
+    }
+  }
+  registry.record_statistics(json.dumps(stats), group="g")
+  snapshot = registry.snapshot()
+  client = {'client': "rdkafka#consumer-1", 'group': "g"}
+  assert value(snapshot, 'mdml_kafka_queue_messages', **client) == 7
+  broker = dict(client, broker="localhost:9092/1")
+  assert value(snapshot, 'mdml_kafka_broker_rtt_seconds', **broker) == 0.002
+  assert value(snapshot, 'mdml_kafka_broker_rtt_p99_seconds', **broker) == 0.009
+  assert len(snapshot['mdml_kafka_broker_rtt_seconds']) == 1
+  partition = dict(client, topic="mdml-a", partition="0")
+  assert value(snapshot, 'mdml_kafka_partition_rx_messages', **partition) == 40
+  assert value(snapshot, 'mdml_kafka_partition_consumer_lag', **partition) == 12
+  assert len(snapshot['mdml_kafka_partition_consumer_lag']) == 1
+  assert registry.statistics()["rdkafka#consumer-1"]['msg_cnt'] == 7
+
+def test_metrics_server():
+  registry = mdml.metrics_registry()
+  registry.inc('mdml_consumed_messages_total', topic="mdml-b")
+  server = mdml.start_metrics_server(port=0, host="127.0.0.1", registry=registry)
+  try:
+    port = server.server_address[1]
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as r:
+      text = r.read().decode('utf-8')
+  finally:
+    server.shutdown()
+  assert 'mdml_consumed_messages_total{topic="mdml-b"} 1' in text
+
+def test_client_metrics(tmp_path):
+  before = mdml.get_metrics()
+  serializer = _instrumented_serializer(lambda obj, ctx: json.dumps(obj).encode('utf-8'), "mdml-test-metrics")
+  serializer({'x': 1}, None)
+  reassembler = mdml.chunk_reassembler(str(tmp_path))
+  reassembler.add({'time': 1.0, 'chunk': "YWJj", 'part': "1.2", 'filename': "f.txt", 'encoding': "base64"})
+  reassembler.add({'time': 1.0, 'chunk': "YWJj", 'part': "1.2", 'filename': "f.txt", 'encoding': "base64"})
+  during = mdml.get_metrics()
+  reassembler.add({'time': 1.0, 'chunk': "ZGVm", 'part': "2.2", 'filename': "f.txt", 'encoding': "base64"})
+  after = mdml.get_metrics()
+  def delta(name, snapshot=after, **labels):
+    return value(snapshot, name, **labels) - value(before, name, **labels)
+  assert delta('mdml_produced_messages_total', topic="mdml-test-metrics") == 1
+  assert delta('mdml_produced_bytes_total', topic="mdml-test-metrics") == len(b'{"x": 1}')
+  assert delta('mdml_serialize_seconds_count', topic="mdml-test-metrics") == 1
+  assert delta('mdml_reassembly_parts_total') == 3
+  assert delta('mdml_reassembly_duplicate_parts_total') == 1
+  assert delta('mdml_reassembly_files_completed_total') == 1
+  assert delta('mdml_reassembly_incomplete_files', during) == 1
+  assert delta('mdml_reassembly_incomplete_files') == 0
+
+def test_topic_metrics_off(client_kwargs):
+  kwargs = client_kwargs
+  topic = "mdml-test-metrics-off"
+  schema = mdml.create_schema({"time": 1.0, "int1": 1}, "Test schema", "Schema used for testing metrics")
+  producer = mdml.kafka_mdml_producer(topic, schema=schema, topic_metrics=False, **kwargs)
+  assert producer.produce_batch([{"time": 1.0, "int1": i} for i in range(3)], flush=True) == []
+  producer.close()
+  producer = mdml.kafka_mdml_producer_schemaless(topic + "-raw", topic_metrics=False,
+    kafka_host=kwargs['kafka_host'], kafka_port=kwargs['kafka_port'])
+  producer.produce(json.dumps({"int1": 1}))
+  producer.close()
+  consumer = mdml.kafka_mdml_consumer([topic], "test-metrics-off", provision_topics=False, topic_metrics=False, **kwargs)
+  msgs = []
+  for msg in consumer.consume(overall_timeout=30, verbose=False):
+    msgs.append(msg)
+    if len(msgs) == 3:
+      break
+  consumer.close()
+  consumer = mdml.kafka_mdml_consumer_schemaless([topic + "-raw"], "test-metrics-off-raw", provision_topics=False,
+    topic_metrics=False, kafka_host=kwargs['kafka_host'], kafka_port=kwargs['kafka_port'])
+  assert next(consumer.consume(overall_timeout=30, verbose=False))['value'] == b'{"int1": 1}'
+  consumer.close()
+  recorded = [name for name, series in mdml.get_metrics().items()
+    if any(s['labels'].get('topic', '').startswith(topic) for s in series)]
+  assert recorded == []
@@ -0,0 +1,128 @@
+import json
+import threading
+from confluent_kafka.schema_registry import SchemaRegistryClient, Schema
+from mdml_client import registry
+from mdml_client.registry import cached_schema_registry_client, _registered_schema
+import mdml_client as mdml
+
+schema_str = json.dumps({"type": "object", "properties": {"time": {"type": "number"}}})
+
+def test_get_schema_registry_client_is_shared():
+  a = mdml.get_schema_registry_client("http://registry-a:8081")
+  assert a is mdml.get_schema_registry_client("http://registry-a:8081")
+  assert a is not mdml.get_schema_registry_client("http://registry-b:8081")
+
+def test_cached_lookups_persist(tmp_path, monkeypatch):
+  calls = []
+  def get_latest_version(self, subject_name, *args, **kwargs):
+    calls.append(subject_name)
+    return _registered_schema(subject_name, 1, 42, Schema(schema_str, schema_type="JSON"))
+  def register_schema_full_response(self, subject_name, schema, *args, **kwargs):
+    calls.append(subject_name)
+    return _registered_schema(subject_name, 1, 43, schema)
+  monkeypatch.setattr(SchemaRegistryClient, "get_latest_version", get_latest_version)
+  monkeypatch.setattr(SchemaRegistryClient, "register_schema_full_response", register_schema_full_response)
+  path = str(tmp_path / "schemas.json")
+  client = cached_schema_registry_client({"url": "http://registry:8081"}, ttl=60, path=path)
+  for _ in range(3):
+    assert client.get_latest_version("mdml-test-value").schema.schema_str == schema_str
+    assert client.register_schema("mdml-test2-value", Schema(schema_str, schema_type="JSON")) == 43
+  assert calls == ["mdml-test-value", "mdml-test2-value"]
+  # A new process reuses the cache on disk
+  restarted = cached_schema_registry_client({"url": "http://registry:8081"}, ttl=60, path=path)
+  assert restarted.get_latest_version("mdml-test-value").schema_id == 42
+  assert restarted.register_schema("mdml-test2-value", Schema(schema_str, schema_type="JSON")) == 43
+  assert restarted.get_schema(42).schema_str == schema_str
+  assert len(calls) == 2
+  expired = cached_schema_registry_client({"url": "http://registry:8081"}, ttl=0, path=path)
+  expired.get_latest_version("mdml-test-value")
+  assert len(calls) == 3
+
+def test_shared_cache_file_merges(tmp_path, monkeypatch):
+  def register_schema_full_response(self, subject_name, schema, *args, **kwargs):
+    return _registered_schema(subject_name, 1, {"mdml-a-value": 1, "mdml-b-value": 2}[subject_name], schema)
+  monkeypatch.setattr(SchemaRegistryClient, "register_schema_full_response", register_schema_full_response)
+  path = str(tmp_path / "schemas.json")
+  # Two processes open the cache before either has written to it
+  a = cached_schema_registry_client({"url": "http://registry:8081"}, path=path)
+  b = cached_schema_registry_client({"url": "http://registry:8081"}, path=path)
+  a.register_schema("mdml-a-value", Schema(schema_str, schema_type="JSON"))
+  b.register_schema("mdml-b-value", Schema(schema_str, schema_type="JSON"))
+  restarted = cached_schema_registry_client({"url": "http://registry:8081"}, path=path)
+  assert sorted(restarted._ids) == [1, 2]
+  assert len(restarted._registered) == 2
+
+def test_cache_writes_are_batched(tmp_path, monkeypatch):
+  def get_schema(self, schema_id, *args, **kwargs):
+    return Schema(schema_str, schema_type="JSON")
+  monkeypatch.setattr(SchemaRegistryClient, "get_schema", get_schema)
+  writing = threading.Event()
+  release = threading.Event()
+  writes = []
+  merge_cache = registry._merge_cache
+  def slow_merge(path, saved):
+    writes.append(len(saved['ids']))
+    writing.set()
+    release.wait(5)
+    merge_cache(path, saved)
+  monkeypatch.setattr(registry, "_merge_cache", slow_merge)
+  client = cached_schema_registry_client({"url": "http://registry:8081"}, path=str(tmp_path / "schemas.json"))
+  first = threading.Thread(target=client.get_schema, args=(0,))
+  first.start()
+  writing.wait(5)
+  # Misses during a write return without waiting for the file
+  for schema_id in range(1, 10):
+    client.get_schema(schema_id)
+  release.set()
+  first.join()
+  assert writes == [1, 10]
+  assert len(registry._load_cache(str(tmp_path / "schemas.json"))['ids']) == 10
+
+def test_serializer_registration_is_cached(tmp_path, schema_registry):
+  from confluent_kafka.schema_registry.json_schema import JSONSerializer
+  from confluent_kafka.schema_registry import topic_subject_name_strategy
+  from confluent_kafka.serialization import SerializationContext, MessageField
+  host, port = schema_registry.server_address
+  url = f"http://{host}:{port}"
+  path = str(tmp_path / "schemas.json")
+  ctx = SerializationContext("mdml-test", MessageField.VALUE)
+  schema = Schema(schema_str, schema_type="JSON")
+  for conf in ({}, {'auto.register.schemas': False}):
+    # Each client stands in for a new producer process sharing the cache file
+    requests = schema_registry.registry.requests
+    for _ in range(2):
+      client = cached_schema_registry_client({"url": url}, path=path)
+      serializer = JSONSerializer(schema, client, conf=dict(conf, **{'subject.name.strategy': topic_subject_name_strategy}))
+      data = serializer({"time": 1.0}, ctx)
+      assert data[1:5] == (1).to_bytes(4, 'big')
+    if not conf:
+      assert requests == [('POST', '/subjects/mdml-test-value/versions')]
+    else:
+      assert requests[1:] == [('POST', '/subjects/mdml-test-value')]
+
+def test_second_producer_uses_cache_file(tmp_path, monkeypatch, client_kwargs, schema_registry):
+  monkeypatch.setattr(registry, "_clients", {})
+  monkeypatch.setattr(registry, "_cache_config", {'ttl': 300.0, 'path': None})
+  mdml.configure_schema_registry_cache(path=str(tmp_path / "schemas.json"))
+  schema = mdml.create_schema({"time": 1.0}, "Test schema", "Schema used for testing the cache file")
+  requests = schema_registry.registry.requests
+  for i in range(2):
+    # A new process starts with no schema registry clients
+    monkeypatch.setattr(registry, "_clients", {})
+    producer = mdml.kafka_mdml_producer("mdml-test-cache", schema=schema, **client_kwargs)
+    producer.produce({"time": float(i)})
+    producer.close()
+    assert requests == [('POST', '/subjects/mdml-test-cache-value/versions')]
+
+def test_configure_updates_cache_in_place(tmp_path):
+  path = str(tmp_path / "schemas.json")
+  with open(path, "w") as f:
+    json.dump({'ids': {"7": [schema_str, "JSON"]}}, f)
+  client = cached_schema_registry_client({"url": "http://registry:8081"})
+  client._ids[5] = (schema_str, "JSON")
+  lock, ids = client._cache_lock, client._ids
+  client._configure(60, path)
+  # Threads already using the client keep the same lock and entries
+  assert client._cache_lock is lock and client._ids is ids
+  assert sorted(client._ids) == [5, 7]
+  assert client._cache_ttl == 60
@@ -0,0 +1,86 @@
+import json
+import pytest
+import mdml_client as mdml
+
+class FakeClock:
+  """
+  Clock that only advances when the engine sleeps, plus any lag added
+  by each produced batch
+  """
+  def __init__(self, send_seconds=0.0):
+    self.now = 1000.0
+    self.sleeps = []
+    self.send_seconds = send_seconds
+  def __call__(self):
+    return self.now
+  def sleep(self, seconds):
+    self.sleeps.append(seconds)
+    self.now += seconds
+
+class FakeProducer:
+  def __init__(self, sent, clock):
+    self.sent = sent
+    self.clock = clock
+    self.failures = []
+  def produce_batch(self, records):
+    self.sent.append((self.clock(), list(records)))
+    self.clock.now += self.clock.send_seconds
+    # Records with a "fail" key are reported as failed when flushed
+    failures = []
+    self.failures.append((failures, [i for i, r in enumerate(records) if 'fail' in r]))
+    return failures
+  def flush(self):
+    for failures, indexes in self.failures:
+      failures.extend((i, "delivery failed") for i in indexes)
+    self.failures = []
+
+def make_engine(sent, clock, **kwargs):
+  engine = mdml.replay_engine(verbose=False, clock=clock, sleep=clock.sleep, **kwargs)
+  producers = {}
+  def producer(topic):
+    if topic not in producers:
+      producers[topic] = engine.producers[topic] = FakeProducer(sent, clock)
+    return producers[topic]
+  engine._producer = producer
+  return engine
+
+def test_replay_engine_speed(tmp_path):
+  records = [{"topic": f"mdml-test-{i % 2}", "value": {"time": 100 + i / 128, "i": i}, "time": 100 + i / 128} for i in range(30)]
+  fn = str(tmp_path / "exp.ndjson")
+  with open(fn, "w") as f:
+    f.write("\n".join(json.dumps(r) for r in records))
+  sent = []
+  clock = FakeClock()
+  stats = make_engine(sent, clock, speed=2, tick=1 / 64).replay_file(fn)
+  assert stats['records'] == 30
+  # Records 1/128 s apart at speed 2 are due every 1/256 s, and the 1/64 s
+  # tick groups them into batches of four (each sent to two topics)
+  assert clock.sleeps == pytest.approx([1 / 64] * 7)
+  assert [t - 1000.0 for t, _ in sent[::2]] == pytest.approx([i / 64 for i in range(8)])
+  assert stats['seconds'] == pytest.approx(7 / 64)
+  assert stats['max_lag'] == 0.0
+  assert sorted(v['i'] for _, values in sent for v in values) == list(range(30))
+  sent = []
+  clock = FakeClock()
+  stats = make_engine(sent, clock, speed=None, batch_size=8).replay(records)
+  assert stats['records'] == 30
+  assert clock.sleeps == []
+  assert sum(len(values) for _, values in sent) == 30
+
+def test_replay_engine_lag():
+  records = [{"topic": "mdml-test", "value": {"time": i * 0.1, "i": i}, "time": i * 0.1} for i in range(5)]
+  sent = []
+  # Each batch takes 0.15 s to send, longer than the 0.1 s between records
+  clock = FakeClock(send_seconds=0.15)
+  stats = make_engine(sent, clock, speed=1, tick=0.01).replay(records)
+  assert stats['records'] == 5
+  assert clock.sleeps == []
+  assert stats['max_lag'] == pytest.approx(0.2)
+  assert stats['mean_lag'] == pytest.approx(0.1)
+
+def test_replay_engine_counts_delivery_failures():
+  records = [{"topic": "mdml-test", "value": {"time": i, "i": i} if i % 3 else {"time": i, "fail": True}, "time": i} for i in range(9)]
+  sent = []
+  stats = make_engine(sent, FakeClock(), speed=None, batch_size=4).replay(records)
+  assert stats['records'] == 9
+  assert stats['failures'] == 3
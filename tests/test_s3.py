@@ -0,0 +1,219 @@
+import os
+import queue
+import threading
+import time
+import pytest
+import mdml_client as mdml
+from concurrent.futures import Future, ThreadPoolExecutor
+from mdml_client import MDML_client
+
+class FakeProducer:
+  def __init__(self, topic, **kwargs):
+    self.sent = []
+  def produce(self, data, on_delivery=None):
+    self.sent.append(data)
+    on_delivery(None, None)
+  def flush(self):
+    pass
+  def close(self):
+    pass
+
+def test_s3_client_uploads(tmp_path, monkeypatch, s3_service):
+  monkeypatch.setattr(MDML_client, "kafka_mdml_producer", FakeProducer)
+  server, url = s3_service
+  files = []
+  for i in range(4):
+    fn = tmp_path / f"frame{i}.bin"
+    fn.write_bytes(os.urandom(6 * 1024 * 1024 + i))
+    files.append(fn)
+  client = mdml.kafka_mdml_s3_client("mdml-test-s3", s3_endpoint=url, s3_access_key="a", s3_secret_key="b",
+    upload_workers=2, max_inflight_bytes=13 * 1024 * 1024,
+    transfer_kwargs={"multipart_threshold": 5 * 1024 * 1024, "multipart_chunksize": 5 * 1024 * 1024})
+  progress = {}
+  lock = threading.Lock()
+  def on_progress(name, sent, total):
+    with lock:
+      progress[name] = (sent, total)
+  futures = [client.upload(str(fn), fn.name, progress=on_progress) for fn in files]
+  results = [f.result(30) for f in futures]
+  client.close()
+  for fn, result in zip(files, results):
+    size = os.path.getsize(fn)
+    assert result["bytes"] == size
+    assert progress[fn.name] == (size, size)
+    data, etag, _ = server.store.objects[("mdml-test", fn.name)]
+    assert data == fn.read_bytes()
+    assert etag.endswith('-2"') # sent as a multipart upload
+  assert sorted(m["s3_object_name"] for m in client.producer.sent) == [fn.name for fn in files]
+  assert client._inflight_bytes == 0
+
+def test_s3_client_ranged_downloads(tmp_path, monkeypatch, s3_service):
+  monkeypatch.setattr(MDML_client, "kafka_mdml_producer", FakeProducer)
+  server, url = s3_service
+  data = os.urandom(1024 * 1024 + 17)
+  server.store.put("mdml-test", "result.bin", data)
+  client = mdml.kafka_mdml_s3_client("mdml-test-s3", s3_endpoint=url, s3_access_key="a", s3_secret_key="b")
+  requests = server.store.requests
+  fn = str(tmp_path / "result.bin")
+  assert client.consume("mdml-test", "result.bin", fn, part_size=100000, buffer_size=4096) is None
+  with open(fn, "rb") as f:
+    assert f.read() == data
+  assert server.store.requests - requests == 1 + 11 # HEAD plus one GET per part
+  buf = bytearray(len(data) + 10)
+  assert client.consume("mdml-test", "result.bin", buffer=memoryview(buf), part_size=100000) == len(data)
+  assert buf[:len(data)] == data
+  assert client.consume("mdml-test", "result.bin") == data
+  with pytest.raises(Exception, match="buffer"):
+    client.consume("mdml-test", "result.bin", buffer=bytearray(10))
+  client.close()
+
+def test_s3_object_cache_lru(tmp_path):
+  cache = mdml.s3_object_cache(str(tmp_path / "cache"), max_bytes=250)
+  def writer(n):
+    def download(path):
+      with open(path, "wb") as f:
+        f.write(b"x" * n)
+    return download
+  a = cache.store("mdml-test", "a.tif", '"1"', writer(100), pin=True)
+  assert a.endswith(".tif")
+  b = cache.store("mdml-test", "b.tif", '"1"', writer(100))
+  os.utime(b, (1, 1)) # b is the least recently used
+  os.utime(a, (2, 2))
+  assert cache.lookup("mdml-test", "a.tif", '"2"') is None # ETag is part of the key
+  c = cache.store("mdml-test", "c.tif", '"1"', writer(100))
+  assert cache.lookup("mdml-test", "b.tif", '"1"') is None
+  assert cache.lookup("mdml-test", "a.tif", '"1"') == a
+  assert cache.size() == 200
+  # Pinned files are kept even when they are the least recently used
+  os.utime(a, (1, 1))
+  os.utime(c, (2, 2))
+  cache.store("mdml-test", "d.tif", '"1"', writer(100))
+  assert os.path.exists(a) and not os.path.exists(c)
+  cache.unpin(a)
+  cache.store("mdml-test", "e.tif", '"1"', writer(100))
+  assert not os.path.exists(a)
+  assert not [fn for fn in os.listdir(tmp_path / "cache") if fn.endswith(".part")]
+
+def test_s3_object_cache_pins_across_caches(tmp_path):
+  pytest.importorskip("fcntl")
+  def writer(download_path):
+    with open(download_path, "wb") as f:
+      f.write(b"x" * 100)
+  # A second cache on the same directory acts like another process
+  cache = mdml.s3_object_cache(str(tmp_path / "cache"), max_bytes=150)
+  other = mdml.s3_object_cache(str(tmp_path / "cache"), max_bytes=150)
+  a = cache.store("mdml-test", "a.tif", '"1"', writer, pin=True)
+  os.utime(a, (1, 1))
+  b = other.store("mdml-test", "b.tif", '"1"', writer)
+  assert os.path.exists(a) and not os.path.exists(b)
+  cache.unpin(a)
+  other.store("mdml-test", "c.tif", '"1"', writer)
+  assert not os.path.exists(a)
+
+def test_s3_consumer_prefetches(tmp_path, s3_service, client_kwargs):
+  server, url = s3_service
+  kwargs = client_kwargs
+  client = mdml.kafka_mdml_s3_client("mdml-test-s3", s3_endpoint=url, s3_access_key="a", s3_secret_key="b", **kwargs)
+  files = {}
+  for i in range(4):
+    fn = tmp_path / f"frame{i}.bin"
+    fn.write_bytes(os.urandom(200000 + i))
+    files[fn.name] = fn.read_bytes()
+    client.produce(str(fn), fn.name)
+  client.close()
+  consumer = mdml.kafka_mdml_s3_consumer("mdml-test-s3", "s3-prefetch", str(tmp_path / "cache"),
+    s3_endpoint=url, s3_access_key="a", s3_secret_key="b",
+    consumer_kwargs=dict(kwargs, provision_topics=False))
+  received = []
+  for msg in consumer.consume(poll_timeout=0.5, overall_timeout=30, verbose=False):
+    with open(msg['path'], "rb") as f:
+      assert f.read() == files[msg['value']['s3_object_name']]
+    received.append(msg['value']['s3_object_name'])
+    if len(received) == 2:
+      break
+  # Wait for the remaining objects to be prefetched, then close without consuming them
+  deadline = time.monotonic() + 30
+  while consumer._ready.qsize() < 2 and time.monotonic() < deadline:
+    time.sleep(0.05)
+  assert consumer._ready.qsize() == 2
+  consumer.close()
+  assert consumer.cache._pinned == {}
+  assert sorted(os.listdir(tmp_path / "cache")) == sorted(
+    os.path.basename(consumer.cache.path("mdml-test", name, server.store.objects[("mdml-test", name)][1]))
+    for name in files)
+
+def test_s3_consumer_raises_notification_errors(tmp_path, s3_service, client_kwargs):
+  server, url = s3_service
+  kwargs = client_kwargs
+  schema = mdml.create_schema({'time': 1.0}, "bad", "Notification without an object")
+  producer = mdml.kafka_mdml_producer("mdml-test-bad", schema=schema, **kwargs)
+  producer.produce({'time': 1.0})
+  producer.flush()
+  consumer = mdml.kafka_mdml_s3_consumer("mdml-test-bad", "s3-errors", str(tmp_path / "cache"),
+    s3_endpoint=url, s3_access_key="a", s3_secret_key="b",
+    consumer_kwargs=dict(kwargs, provision_topics=False))
+  with pytest.raises(Exception, match="s3_object_name"):
+    for msg in consumer.consume(poll_timeout=0.5, overall_timeout=30, verbose=False):
+      pass
+  consumer.close()
+
+def bare_s3_consumer(tmp_path, fetch):
+  # kafka_mdml_s3_consumer without Kafka or S3: notifications are put on
+  # _ready by the test and objects are "downloaded" by fetch
+  consumer = mdml.kafka_mdml_s3_consumer.__new__(mdml.kafka_mdml_s3_consumer)
+  consumer.cache = mdml.s3_object_cache(str(tmp_path / "cache"), max_bytes=10000)
+  consumer.executor = ThreadPoolExecutor(max_workers=2)
+  consumer._ready = queue.Queue()
+  consumer._inflight = {}
+  consumer._inflight_lock = threading.Lock()
+  consumer._stop = threading.Event()
+  consumer._fetcher = threading.Thread() # not started by consume()
+  consumer._poll_timeout = 0.1
+  consumer._fetch = lambda bucket, name: fetch(consumer.cache, bucket, name)
+  return consumer
+
+def store_object(cache, bucket, name):
+  def writer(download_path):
+    with open(download_path, "wb") as f:
+      f.write(name.encode())
+  return cache.store(bucket, name, '"1"', writer, pin=True)
+
+def test_s3_consumer_prefetch_finished_future(tmp_path):
+  consumer = bare_s3_consumer(tmp_path, store_object)
+  done = Future()
+  done.set_result("cached.bin")
+  consumer.executor.submit = lambda fn, *args: done
+  # A download that finishes before its callback is added must not deadlock
+  t = threading.Thread(target=consumer._prefetch, args=("mdml-test", "a.bin"))
+  t.start()
+  t.join(5)
+  assert not t.is_alive()
+  assert consumer._inflight == {}
+
+def test_s3_consumer_shared_downloads_pin_each_notification(tmp_path):
+  release = threading.Event()
+  fetches = []
+  def fetch(cache, bucket, name):
+    fetches.append(name)
+    release.wait(5)
+    return store_object(cache, bucket, name)
+  consumer = bare_s3_consumer(tmp_path, fetch)
+  value = {'s3_bucket': "mdml-test", 's3_object_name': "a.bin"}
+  for _ in range(3):
+    future, shared = consumer._prefetch("mdml-test", "a.bin")
+    consumer._ready.put({'topic': "mdml-test-s3", 'value': value, 'future': future, 'shared': shared})
+  release.set()
+  assert [item['shared'] for item in list(consumer._ready.queue)] == [False, True, True]
+  gen = consumer.consume(poll_timeout=0.1, overall_timeout=1, verbose=False)
+  path = next(gen)['path']
+  assert consumer.cache._pinned[path][0] == 1
+  assert next(gen)['path'] == path
+  # The previous notification's pin is released once the next one is pinned
+  assert consumer.cache._pinned[path][0] == 1
+  gen.close()
+  assert consumer.cache._pinned == {}
+  # A shared download evicted before its notification is consumed is fetched again
+  os.remove(path)
+  assert next(consumer.consume(poll_timeout=0.1, overall_timeout=1, verbose=False))['path'] == path
+  assert fetches == ["a.bin", "a.bin"]
+  consumer.executor.shutdown()
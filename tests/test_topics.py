@@ -0,0 +1,32 @@
+from mdml_client import MDML_client
+
+class FakeFuture:
+  def result(self):
+    return None
+
+class FakeMetadata:
+  def __init__(self, topics):
+    self.topics = {topic: None for topic in topics}
+
+class FakeAdminClient:
+  calls = []
+  def __init__(self, conf):
+    self.conf = conf
+  def list_topics(self, timeout=None):
+    FakeAdminClient.calls.append("list_topics")
+    return FakeMetadata(["mdml-old-1", "mdml-old-2"])
+  def create_topics(self, new_topics, request_timeout=None):
+    FakeAdminClient.calls.append(("create_topics", sorted(t.topic for t in new_topics)))
+    return {t.topic: FakeFuture() for t in new_topics}
+
+def test_provision_topics_batched_and_cached(monkeypatch):
+  monkeypatch.setattr(MDML_client, "AdminClient", FakeAdminClient)
+  monkeypatch.setattr(MDML_client, "_known_topics", {})
+  FakeAdminClient.calls = []
+  topics = ["mdml-old-1", "mdml-old-2", "mdml-new-1", "mdml-new-2"]
+  MDML_client._provision_topics("localhost:9092", topics)
+  assert FakeAdminClient.calls == ["list_topics", ("create_topics", ["mdml-new-1", "mdml-new-2"])]
+  assert MDML_client._known_topics["localhost:9092"] == set(topics)
+  FakeAdminClient.calls = []
+  MDML_client._provision_topics("localhost:9092", topics)
+  assert FakeAdminClient.calls == []
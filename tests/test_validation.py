@@ -0,0 +1,73 @@
+import json
+import sys
+import time
+import pytest
+import mdml_client as mdml
+from confluent_kafka.serialization import SerializationError, SerializationContext, MessageField
+
+schema = mdml.create_schema({
+  "time": time.time(),
+  "int1": 1,
+  "str": "two",
+  "int_array": [1,2,3],
+  "dict": {"hello": "world"}
+}, "Test schema", "Schema used for testing validation", required_keys=["time", "int1"])
+
+class registry_stub:
+  def register_schema(self, subject, schema):
+    return 7
+
+def test_compile_validator():
+  validate = mdml.compile_validator(schema)
+  validate({"time": time.time(), "int1": 1, "str": "a", "int_array": [1, 2.5], "dict": {"hello": "x"}})
+  for bad in [
+    {"time": time.time()},
+    {"time": True, "int1": 1},
+    {"time": time.time(), "int1": 1, "int_array": [1, "2"]},
+    {"time": time.time(), "int1": 1, "dict": {"hello": 1}},
+  ]:
+    with pytest.raises(SerializationError):
+      validate(bad)
+
+def test_compile_validator_fallback():
+  validate = mdml.compile_validator({
+    "type": "object",
+    "properties": {"int1": {"type": "number", "minimum": 3}}
+  })
+  validate({"int1": 3})
+  with pytest.raises(SerializationError):
+    validate({"int1": 1})
+
+def test_compile_validator_fallback_uses_latest_draft(monkeypatch):
+  monkeypatch.setitem(sys.modules, 'fastjsonschema', None)
+  # prefixItems is ignored by draft 7 but checked by the latest draft, as in JSONSerializer
+  validate = mdml.compile_validator({
+    "$schema": "http://merf.egs.anl.gov/mdml-test-schema#",
+    "type": "object",
+    "properties": {"pair": {"type": "array", "prefixItems": [{"type": "number"}, {"type": "string"}]}}
+  })
+  validate({"pair": [1, "a"]})
+  with pytest.raises(SerializationError):
+    validate({"pair": ["a", 1]})
+
+def test_compiled_json_serializer_policies():
+  ctx = SerializationContext("mdml-test-validation", MessageField.VALUE)
+  bad = {"time": "not a number", "int1": 1}
+  serializer = mdml.compiled_json_serializer(json.dumps(schema), registry_stub(), validation="always")
+  assert serializer({"time": 1.0, "int1": 1}, ctx) == b'\x00\x00\x00\x00\x07{"time": 1.0, "int1": 1}'
+  with pytest.raises(SerializationError):
+    serializer(bad, ctx)
+  serializer = mdml.compiled_json_serializer(json.dumps(schema), registry_stub(), validation="first", validation_n=2)
+  for _ in range(2):
+    with pytest.raises(SerializationError):
+      serializer(bad, ctx)
+  serializer(bad, ctx)
+  serializer = mdml.compiled_json_serializer(json.dumps(schema), registry_stub(), validation="every", validation_n=3)
+  with pytest.raises(SerializationError):
+    serializer(bad, ctx)
+  serializer(bad, ctx)
+  serializer(bad, ctx)
+  with pytest.raises(SerializationError):
+    serializer(bad, ctx)
+  serializer = mdml.compiled_json_serializer(json.dumps(schema), registry_stub(), validation="off")
+  serializer(bad, ctx)